@@ -1,20 +1,125 @@
-from flask import Flask, jsonify, request, current_app
+from flask import Flask, jsonify, request, current_app, Response, g, has_request_context
 from flask_restful import Api, Resource, reqparse, fields, marshal_with
 from flask_sqlalchemy import SQLAlchemy
 from singleton import Singleton
+import engine
+from events import EventBroker, encodeEvent
+from metrics import Metrics, QUERY_BUCKETS
+from storage import createStore, MemoryGameStore
+from gamelog import GameLog
+from persistence import GroupCommitter
+from bots import BotRunner
+from roomcache import RoomListCache, FULL, PROTECTED, STARTED
+from maps import packMap, mapId, expandTiles, grid
+from mapgen import MapPool, emptyMap
+from replays import playReplay
+from wire import encodeState, MIMETYPE as STATE_MIMETYPE
+from matchmaking import Matchmaker
+from profiling import Profiler
+from reaper import Activity, Reaper
+from ticks import TickLoop, DIRECTIONS
+from ranking import RankIndex, rateGame
+from sqlalchemy import func, event, select, literal, exists, or_, and_, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.exceptions import HTTPException
 import argparse
+import os
 import uuid
-import random
 import json
 from flask_cors import CORS, cross_origin
-import statistics
+import time
+import logging
+import collections
+import concurrent.futures
+import gc
+import gzip
+import hmac
 
 app = Flask(__name__)
 api = Api(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('TRON_DATABASE_URI', 'sqlite:///database.db')
+#Pooled connections instead of one per checkout, shared with the group commit thread
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'poolclass': QueuePool,
+    'pool_size': 8,
+    'max_overflow': 16,
+    'connect_args': {'check_same_thread': False, 'timeout': 30}
+}
+#Lobby writes of concurrent requests are committed together, see persistence.py
+app.config['GROUP_COMMIT'] = os.environ.get('TRON_GROUP_COMMIT', '1') != '0'
+app.config['GROUP_COMMIT_WINDOW'] = 0.002
+app.config['GROUP_COMMIT_MAX_BATCH'] = 256
+#Seconds a finished game stays queryable before it is evicted
+app.config['GAME_GRACE_PERIOD'] = 300
+#Where live games are kept: "memory" for a single process, or
+#"sqlite:///path/games.db" to share them between worker processes
+app.config['GAME_STORE'] = os.environ.get('TRON_GAME_STORE', 'memory')
+#Directory of the append-only move log used to recover in-memory games after a
+#restart, "always" fsyncs every step instead of leaving it to the OS
+app.config['GAME_LOG'] = os.environ.get('TRON_GAME_LOG')
+app.config['GAME_LOG_SYNC'] = os.environ.get('TRON_GAME_LOG_SYNC', 'os')
+app.config['GAME_LOG_SNAPSHOT_EVERY'] = 10000
+#Seconds a cached /rooms listing may miss the writes of other workers, which only
+#share the lobby with a shared game store. 0 never reloads the whole list.
+app.config['ROOM_LIST_TTL'] = 0.0 if app.config['GAME_STORE'] == 'memory' else 1.0
+app.config['ROOM_LIST_PAGE'] = 50
+app.config['ROOM_LIST_MAX_PAGE'] = 200
+#Board size and player count of a room unless it asks for others, and their limits
+app.config['BOARD_WIDTH'] = 16
+app.config['BOARD_HEIGHT'] = 16
+app.config['ROOM_CAPACITY'] = 4
+app.config['MIN_BOARD_SIZE'] = 8
+app.config['MAX_BOARD_SIZE'] = 256
+app.config['MAX_PLAYERS'] = 16
+#Processes searching bot moves and the time each move may take, in seconds
+app.config['BOT_WORKERS'] = int(os.environ.get('TRON_BOT_WORKERS', min(4, os.cpu_count() or 1)))
+app.config['BOT_MOVE_BUDGET'] = float(os.environ.get('TRON_BOT_MOVE_BUDGET', 0.1))
+#Obstacle density of the generated maps offered with the empty one, and how many
+#of each are kept ready per board size and player count
+app.config['MAP_DENSITIES'] = (0.1, 0.2, 0.3)
+app.config['MAP_POOL_SIZE'] = 8
+#Matchmaking forms rooms every MATCH_INTERVAL seconds, at most MATCH_BATCH at a time.
+#Players waiting MATCH_MAX_WAIT seconds get a room that is not full.
+app.config['MATCH_INTERVAL'] = 0.1
+app.config['MATCH_MAX_WAIT'] = 10.0
+app.config['MATCH_BATCH'] = 1000
+#/admin endpoints need this in the X-Admin-Token header and are off without it
+app.config['ADMIN_TOKEN'] = os.environ.get('TRON_ADMIN_TOKEN')
+#Share of requests profiled and how: cprofile or sample (stacks every PROFILE_INTERVAL
+#seconds). Requests with the admin token in an X-Profile header are always profiled.
+app.config['PROFILE_RATE'] = float(os.environ.get('TRON_PROFILE_RATE', 0))
+app.config['PROFILE_MODE'] = os.environ.get('TRON_PROFILE_MODE', 'cprofile')
+app.config['PROFILE_INTERVAL'] = 0.005
+#Smaller /game/state bodies are sent uncompressed, gzip would barely shrink them
+app.config['STATE_GZIP_MIN_SIZE'] = 512
+#Every REAPER_INTERVAL seconds (0: never) players idle for PLAYER_TTL seconds are
+#deleted, as are rooms nobody used for ROOM_TTL seconds or that only have bots left
+#after EMPTY_ROOM_TTL, maps no room or replay uses and tiles no map lists.
+#Rows go REAPER_BATCH at a time, then up to REAPER_VACUUM_PAGES free pages are returned.
+app.config['REAPER_INTERVAL'] = float(os.environ.get('TRON_REAPER_INTERVAL', 60))
+app.config['PLAYER_TTL'] = 24 * 3600
+app.config['ROOM_TTL'] = 3600
+app.config['EMPTY_ROOM_TTL'] = 300
+app.config['REAPER_BATCH'] = 500
+app.config['REAPER_VACUUM_PAGES'] = 1000
+#Ticks a second of real-time games, every player of every such game moves one tile a tick
+app.config['TICK_RATE'] = float(os.environ.get('TRON_TICK_RATE', 20))
+#Elo ratings: players start at RATING_INITIAL and a game moves a rating by at most
+#RATING_K. Bots count as opponents rated RATING_INITIAL and are not rated themselves.
+app.config['RATING_INITIAL'] = 1500.0
+app.config['RATING_K'] = 32.0
+#Seconds the in-memory ranking may miss the rating writes of other workers, 0 (never
+#reloaded) is exact while one process writes them all
+app.config['RANKING_TTL'] = float(os.environ.get('TRON_RANKING_TTL', 0))
+app.config['LEADERBOARD_PAGE'] = 50
+app.config['LEADERBOARD_MAX_PAGE'] = 200
 db = SQLAlchemy(app)
 db.init_app(app)
 CORS(app)
+logger = logging.getLogger('tron')
 
 class PlayerModel(db.Model):
     id = db.Column(db.String, primary_key=True)
@@ -24,11 +129,57 @@ class PlayerModel(db.Model):
 class RoomModel(db.Model):
     id = db.Column(db.String, primary_key=True)
     master = db.Column(db.String, nullable=False)
-    players = db.Column(db.String, nullable=False)
+    #Legacy JSON columns, membership and votes live in RoomMemberModel
+    players = db.Column(db.String, nullable=False, default='[]')
     ready = db.Column(db.Boolean, nullable=False)
     passwd = db.Column(db.Integer, nullable=True)
     map = db.Column(db.String, nullable=True)
-    votes = db.Column(db.String, nullable=False)
+    votes = db.Column(db.String, nullable=False, default='[]')
+
+class RoomMemberModel(db.Model):
+    __table_args__ = (db.UniqueConstraint('room', 'player'),)
+    #Autoincrement id keeps the join order
+    id = db.Column(db.Integer, primary_key=True)
+    room = db.Column(db.String, nullable=False, index=True)
+    player = db.Column(db.String, nullable=False, index=True)
+    ready = db.Column(db.Boolean, nullable=False, default=False)
+    vote = db.Column(db.Integer, nullable=True)
+
+class RoomSettingsModel(db.Model):
+    room = db.Column(db.String, primary_key=True)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    players = db.Column(db.Integer, nullable=False)
+
+class BotModel(db.Model):
+    #Players of a room that are played by the server
+    player = db.Column(db.String, primary_key=True)
+    room = db.Column(db.String, nullable=False, index=True)
+
+class ReplayModel(db.Model):
+    #One row per game from its start, data is the replay once the game ended, see replays.py
+    id = db.Column(db.String, primary_key=True)
+    room = db.Column(db.String, nullable=False, index=True)
+    map = db.Column(db.String, nullable=False)
+    started = db.Column(db.Float, nullable=False)
+    ended = db.Column(db.Float, nullable=True)
+    data = db.Column(db.LargeBinary, nullable=True)
+
+class ActivityModel(db.Model):
+    #When a player or room id was last used, see reaper.Activity
+    id = db.Column(db.String, primary_key=True)
+    seen = db.Column(db.Float, nullable=False, index=True)
+
+class RatingModel(db.Model):
+    #Elo rating of a player once a rated game of theirs ended. bucket is the rating's
+    #ranking.RankIndex bucket, the rank index walks the leaderboard in order.
+    __table_args__ = (db.Index('ix_rating_model_rank', 'bucket', 'rating', 'player'),)
+    player = db.Column(db.String, primary_key=True)
+    rating = db.Column(db.Float, nullable=False)
+    bucket = db.Column(db.Integer, nullable=False)
+    games = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Float, nullable=False)
 
 class TileModel(db.Model):
     id = db.Column(db.String, primary_key=True)
@@ -38,123 +189,214 @@ class TileModel(db.Model):
     player = db.Column(db.String, nullable=True)
 
 class MapModel(db.Model):
+    #id is the content hash of tiles, see maps.packMap
     id = db.Column(db.String, primary_key=True)
     tiles = db.Column(db.String, nullable=False)
 
 class GameControl(metaclass=Singleton):
-    games = []
     def __init__(self):
         self.db = db
+        self.store = createStore(app.config['GAME_STORE'])
+        self.bots = BotRunner(self.playBot, self.store.read, app.config['BOT_WORKERS'], app.config['BOT_MOVE_BUDGET'])
+        self.ticks = TickLoop(self.applyTick, app.config['TICK_RATE'])
+        #Replays of real-time games are saved from here, the tick never waits for the database
+        self.replays = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='replay-save')
+        self.log = None
+        #game_id -> (version, {(since, format, gzipped): body}) of the latest version served
+        self.encoded = {}
+        if app.config['GAME_LOG']:
+            if isinstance(self.store, MemoryGameStore):
+                self.log = GameLog(app.config['GAME_LOG'], app.config['GAME_LOG_SYNC'], app.config['GAME_LOG_SNAPSHOT_EVERY'])
+                self.log.recover(self.store, engine.newGame, engine.applyStep)
+                for game in list(self.store.games.values()):
+                    self.bots.schedule(game)
+            else:
+                #Shared stores are durable on their own
+                logger.warning('GAME_LOG ignored with game store %s', app.config['GAME_STORE'])
     
-    def startGame(self, room):
-        from maps import BasicMap
-        game = {
-            "turn": 1,
-            "current_player": json.loads(room.players)[0]['id'],
-            "players": json.loads(room.players),
-            "map": [],
-            "history": {}
-        }
-        map = MapModel.query.get(room.map)
-        tiles = json.loads(map.tiles)
-        for t in tiles:
-            if t['x'] == 1 and t['y'] == 1 : 
-                t['player'] = game['players'][0]['id']
-                game['history'][t['player']] = [{"x": t['x'], "y":t["y"]}]
-            if t['x'] == 1 and t['y'] == 4 : 
-                t['player'] = game['players'][1]['id']
-                game['history'][t['player']] = [{"x": t['x'], "y":4}]
-            if t['x'] == 16 and t['y'] == 1 and len(game['players']) > 2:
-                t['player'] = game['players'][2]['id'] 
-                game['history'][t['player']] = [{"x": t['x'], "y":t["y"]}]
-            if t['x'] == 16 and t['y'] == 16 and len(game['players']) > 3: 
-                t['player']= game['players'][3]['id']
-                game['history'][t['player']] = [{"x": t['x'], "y":t["y"]}]
-        game['map'] = tiles
-        self.games.append(game)
+    def startGame(self, room_id, players, map_id, map_data, bots=(), game_id=None, mode='turns'):
+        #The replay row of the game is the caller's to write, see replayRow.
+        #Real-time games are not logged, a restart loses them.
+        self.evictFinished()
+        game = engine.newGame(game_id or str(uuid.uuid4()), room_id, players, map_id, map_data, bots, mode=mode)
+        if self.log and mode == 'turns':
+            self.log.start(game, map_data, self.store.add)
+        else:
+            self.store.add(game)
+        if mode == 'realtime':
+            self.ticks.add(game)
         return game
 
     def getState(self, player_id):
-        player = serializePlayer(PlayerModel.query.get(player_id))
-        game = self.findGameByPlayer(player)
-        return game
+        self.evictFinished()
+        return self.findGameByPlayer(player_id)
         
-    def findGameByPlayer(self, player):
-        for g in self.games:
-            if player in g['players']:
-                return g
-        return False
+    def findGameByPlayer(self, player_id):
+        return self.store.findByPlayer(player_id) or False
+
+    def findGame(self, game_id):
+        return self.store.get(game_id) or False
+
+    def evictFinished(self):
+        self.store.evict(time.time() - app.config['GAME_GRACE_PERIOD'])
 
     def step(self, data):
-        player = serializePlayer(PlayerModel.query.get(
-            data['player']['id'])
-            )
-        game = self.findGameByPlayer(player)
+        game = self.findGameByPlayer(data['player']['id'])
         if not game: return
-        steps = data['steps']
-
-        if game['history'][player['id']][-1]['x'] != steps[0]['x'] or game['history'][player['id']][-1]['y'] != steps[0]['y']:
-            return False
-        if game['current_player'] != player['id']:
-            print(game['current_player'], player['id'])
+        player = {'id': data['player']['id']}
+        activity.touch(player['id'], game['room'])
+        try:
+            xs = [int(step['x']) for step in data['steps']]
+            ys = [int(step['y']) for step in data['steps']]
+        except (KeyError, TypeError, ValueError):
             return False
-        for i in range(len(steps)-1):
-            valid = self.validateStep(game, steps[i], steps[i+1])
-            if not valid: 
-                print('invalid')
-                return False
-            
-            game['history'][player['id']].append(steps[i+1])
+        result = self.store.update(game['id'], lambda game: self.applyLoggedStep(game, player, xs, ys))
+        if not result:
+            return result
+        #The game may already be at a later step, what this step did is in stepped
+        stepped, killed = result
+        metrics.step()
+        if killed:
+            self.publish(stepped, 'kill')
+        self.publish(stepped, 'step')
+        self.broadcast(stepped, player['id'] if killed else None)
+        #game was read before the step, a shared store decodes a copy that still
+        #has the turn this step played
+        game = self.findGame(stepped['id']) or game
+        if killed and stepped['ended']:
+            self.finishGame(game)
+        self.bots.schedule(game)
+        return stepped['current_player']
 
-            death = self.updateXY(steps[i], steps[i+1], game, player)
-            if death: break
-            print(game['history'])
-        game['current_player'] = self.getNextPlayer(game)
-        return game['current_player']
+    def playBot(self, player_id, tiles):
+        self.step({'player': {'id': player_id}, 'steps': [{'x': x, 'y': y} for x, y in tiles]})
 
-    def getNextPlayer(self, game):
-        
-        turn_index = game['turn'] % (len(game['players']))
-        game['turn'] += 1
-        return game['players'][turn_index]['id']
-
-    def updateXY(self, _from, _to, game, player):
-
-        for i in range(len(game['map'])):
-            if game['map'][i]['x'] == _from['x'] and game['map'][i]['y'] == _from['y']:
-                if[game['map'][i]['occupied']] is True and [game['map'][i]['player']] is None:
-                    self.killPlayer(player, game)
-                    return True
-                game['map'][i]['occupied'] = True
-            if game['map'][i]['x'] == _to['x'] and game['map'][i]['y'] == _to['y']:
-                if str(game['map'][i]['player']) != "None":
-                    self.killPlayer(player, game)
-                    return True
-                else:
-                    game['map'][i]['player'] = player['id']
-                return False
-        return True
-    def killPlayer(self, player, game ):
-        print("kill")
-        for tile in game['map']:
-            if tile['player'] == player['id']:
-                tile['player'] = None
-                tile['occupied'] = False
-        for i in range(len(game['players'])):
-            print('xxx',i, len(game['players']))
-            if game['players'][i]['id'] == player['id']:
-                del game['players'][i]
-                print(game)
-                break
-        game['history'].pop(player['id'])
-        print(game['players'])
-    def validateStep(self, game, _from, _to):
-        #ezért a pokolban fogok elégni
-        if (abs(int(_from['x']) - int(_to['x'])) >= 0 and abs(int(_from['x']) - int(_to['x'])) <= 1) and (abs(int(_from['y']) - int(_to['y'])) >= 0 and abs(int(_from['y']) - int(_to['y'])) <= 1 and (abs(int(_from['x']) - int(_to['x'])) + abs(int(_from['y']) - int(_to['y'])) == 1)) :
-            return True
-        return False
+    def applyLoggedStep(self, game, player, xs, ys):
+        #Runs under the game's lock, returns (the step as stepState, killed) or False
+        slot = game['board'].slots.get(player['id'])
+        result = engine.applyStep(game, player['id'], xs, ys)
+        if not result:
+            return result
+        if self.log:
+            next_slot = game['board'].slots.get(game['current_player'], 0)
+            try:
+                self.log.step(game, slot, xs, ys, result[1], next_slot)
+            except Exception:
+                #The game has already changed, failing here would leave it without events
+                logger.exception('game log step failed game=%s', game['id'])
+        return self.stepState(game), result[1]
 
-        #Validating the passed ID with the current players ID
+    def applyTick(self, game_id, moves, killed):
+        #What a tick of the TickLoop did to a real-time game, see engine.applyTick
+        stepped = self.store.update(game_id, lambda game: self.stepState(engine.applyTick(game, moves, killed)))
+        if not stepped:
+            return
+        self.publish(stepped, 'tick')
+        self.broadcast(stepped, killed, 'tick')
+        if stepped['ended']:
+            game = self.findGame(game_id)
+            try:
+                if game:
+                    future = self.replays.submit(self.finishGame, game)
+                    future.add_done_callback(lambda future: self.savedReplay(game_id, future))
+            except RuntimeError:
+                #No new work once the interpreter is exiting
+                pass
+
+    def stepState(self, game):
+        #What the events of a step need, taken before the next step can change it
+        return {
+            'id': game['id'],
+            'room': game['room'],
+            'version': game['version'],
+            'turn': game['turn'],
+            'current_player': game['current_player'],
+            'history': engine.historySince(game, game['version'] - 1),
+            'ended': game['ended'] is not None
+        }
+
+    def publish(self, game, type):
+        broker.publish(game['room'], 'game', {
+            'type': type,
+            'game': game['id'],
+            'version': game['version'],
+            'current_player': game['current_player']
+        })
+
+    def broadcast(self, stepped, killed, event='step'):
+        #Spectators get each step once, as the tiles it added, see spectatorState.
+        #killed is who crashed: the player or None for a step, a list for a tick.
+        channel = 'game:' + stepped['id']
+        if not broker.watched(channel):
+            return
+        broker.publish(channel, event, {
+            'version': stepped['version'],
+            'turn': stepped['turn'],
+            'current_player': stepped['current_player'],
+            'history': stepped['history'],
+            'killed': killed,
+            'ended': stepped['ended']
+        })
+
+    def spectatorState(self, game_id):
+        #The full state as an SSE event, encoded once per version however many
+        #spectators start watching at that version
+        game = self.findGame(game_id)
+        if not game:
+            return encodeEvent('gone', {'game': game_id})
+        return self.encodedState(game, None, 'event')[1]
+
+    def encodedState(self, game, since, format, gzipped=False):
+        #(version, body) of /game/state (json or binary) or of the spectator state
+        #event. A body is built once per game version and since however many clients
+        #poll for it, from one version of the game read without stopping its steps.
+        key = (since, format, gzipped)
+        version = game['version']
+        cached = self.encoded.get(game['id'])
+        if cached is not None and cached[0] == version and key in cached[1]:
+            return version, cached[1][key]
+        if gzipped:
+            version, body = self.encodedState(game, since, format)
+            body = gzip.compress(body, 6)
+        else:
+            encode = lambda game: (game['version'], self.buildState(game, since, format))
+            #An evicted game has ended, nothing changes it any more
+            version, body = self.store.read(game['id'], encode) or encode(game)
+        cached = self.encoded.get(game['id'])
+        if cached is None or cached[0] < version:
+            if len(self.encoded) >= 4096:
+                self.encoded.clear()
+            cached = self.encoded[game['id']] = (version, {})
+        if cached[0] == version:
+            cached[1][key] = body
+        return version, body
+
+    def buildState(self, game, since, format):
+        if since is not None and not 0 <= since <= game['version']:
+            since = None
+        if format == 'binary':
+            return encodeState(game, since)
+        if format == 'event':
+            return encodeEvent('state', gameState(game))
+        return json.dumps(gameState(game, since), separators=(',', ':')).encode()
+
+    def finishGame(self, game):
+        #The replay and the ratings of an ended game, in one write. Runs on request,
+        #bot and replay-save threads, the last two have no app context of their own.
+        data = bytes(game['replay'])
+
+        def write(session):
+            session.query(ReplayModel).filter_by(id=game['id']).update(
+                {'ended': game['ended'], 'data': data}, synchronize_session=False)
+            return ratePlayers(session, game)
+        with app.app_context():
+            writes.submit(write, moveRanks)
+
+    def savedReplay(self, game_id, future):
+        #Nothing waits for a replay saved from the tick loop, so its failure is logged here
+        error = future.exception()
+        if error is not None:
+            logger.error('saving replay failed game=%s', game_id, exc_info=error)
 
     def loadTile(self, id):
         return TileModel.query.get(id)
@@ -203,6 +445,72 @@ map_resource_fields = {
     })))
 }'''
 control = GameControl()
+writes = GroupCommitter(app, db)
+broker = EventBroker()
+metrics = Metrics()
+activity = Activity()
+metrics.describe('tron_requests_total', 'counter', 'Requests by route, method and status')
+metrics.describe('tron_request_seconds', 'histogram', 'Request latency by route')
+metrics.describe('tron_request_db_queries', 'histogram', 'Database queries per request by route')
+metrics.describe('tron_db_queries_total', 'counter', 'Database queries executed')
+metrics.describe('tron_steps_total', 'counter', 'Accepted /game/step calls')
+metrics.describe('tron_steps_per_second', 'gauge', 'Accepted steps per second over the last 10 seconds')
+metrics.describe('tron_active_games', 'gauge', 'Games that have not ended')
+metrics.describe('tron_active_rooms', 'gauge', 'Rooms that have not started a game')
+metrics.describe('tron_reaped_total', 'counter', 'Rows deleted and free pages returned by the reaper by kind')
+metrics.describe('tron_realtime_games', 'gauge', 'Real-time games the tick loop is moving')
+metrics.describe('tron_tick_seconds', 'gauge', 'Duration of the last tick of the real-time games')
+metrics.describe('tron_tick_overruns', 'gauge', 'Ticks that took longer than their period')
+metrics.describe('tron_rated_players', 'gauge', 'Players on the leaderboard')
+metrics.gauge('tron_steps_per_second', metrics.stepsPerSecond)
+metrics.gauge('tron_active_games', lambda: control.store.activeCount())
+metrics.gauge('tron_active_rooms', lambda: RoomModel.query.filter_by(ready=False).count())
+metrics.gauge('tron_realtime_games', lambda: control.ticks.activeCount())
+metrics.gauge('tron_tick_seconds', lambda: control.ticks.seconds)
+metrics.gauge('tron_tick_overruns', lambda: control.ticks.overruns)
+metrics.gauge('tron_rated_players', lambda: rankIndex().total)
+profiler = Profiler(app.config['PROFILE_RATE'], app.config['PROFILE_MODE'], app.config['ADMIN_TOKEN'], app.config['PROFILE_INTERVAL'])
+
+def routeOf(environ):
+    #Same route label as the request metrics, only looked up for profiled requests
+    try:
+        rule, _ = app.url_map.bind_to_environ(environ).match(return_rule=True)
+        return rule.rule
+    except HTTPException:
+        return 'unmatched'
+
+app.wsgi_app = profiler.wrap(app.wsgi_app, routeOf)
+
+def isAdmin():
+    token = app.config['ADMIN_TOKEN']
+    return token is not None and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def countQuery(conn, cursor, statement, parameters, context, executemany):
+    metrics.inc('tron_db_queries_total')
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+
+@app.before_request
+def startTimer():
+    g.start = time.perf_counter()
+    g.db_queries = 0
+
+@app.before_request
+def startReaper():
+    reaper.start()
+
+@app.after_request
+def recordRequest(response):
+    elapsed = time.perf_counter() - g.start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('route', route),)
+    metrics.inc('tron_requests_total', labels + (('method', request.method), ('status', response.status_code)))
+    metrics.observe('tron_request_seconds', elapsed, labels)
+    metrics.observe('tron_request_db_queries', g.db_queries, labels, QUERY_BUCKETS)
+    logger.debug('request route=%s method=%s status=%d ms=%.2f db_queries=%d',
+        route, request.method, response.status_code, elapsed * 1000, g.db_queries)
+    return response
 
 @marshal_with(player_resouce_fields)
 def serializePlayer(player: PlayerModel):
@@ -220,6 +528,435 @@ def serializeMap(map: MapModel):
 def serializeRoom(room: RoomModel):
     return room
 
+def roomMembers():
+    return db.session.query(RoomMemberModel, PlayerModel.name).join(
+        PlayerModel, PlayerModel.id == RoomMemberModel.player
+    ).order_by(RoomMemberModel.id)
+
+def roomPlayers(room_id):
+    return memberLists(roomMembers().filter(RoomMemberModel.room == room_id).all())
+
+def memberLists(members):
+    players = [{'id': m.player, 'name': name, 'ready': m.ready} for m, name in members]
+    votes = [{m.player: m.vote} for m, _ in members if m.vote is not None]
+    return players, votes
+
+def roomResponse(room: RoomModel):
+    response = serializeRoom(room)
+    response['players'], response['votes'] = roomPlayers(room.id)
+    response['protected'] = False if room.passwd is None else True
+    response['settings'] = roomSettings(room.id)
+    return response
+
+def defaultSettings():
+    return {
+        'width': app.config['BOARD_WIDTH'],
+        'height': app.config['BOARD_HEIGHT'],
+        'players': app.config['ROOM_CAPACITY']
+    }
+
+def settingsResponse(settings):
+    return {'width': settings.width, 'height': settings.height, 'players': settings.players}
+
+def roomSettings(room_id):
+    settings = RoomSettingsModel.query.get(room_id)
+    return settingsResponse(settings) if settings else defaultSettings()
+
+def parseSettings(data):
+    #Room settings from a request, None if they are out of range
+    settings = defaultSettings()
+    try:
+        for key in settings:
+            if key in data:
+                settings[key] = int(data[key])
+    except (TypeError, ValueError):
+        return None
+    size = (app.config['MIN_BOARD_SIZE'], app.config['MAX_BOARD_SIZE'])
+    if not size[0] <= settings['width'] <= size[1] or not size[0] <= settings['height'] <= size[1]:
+        return None
+    if not 2 <= settings['players'] <= app.config['MAX_PLAYERS']:
+        return None
+    #Small boards fit fewer players, see maps.Grid.spawns
+    if not grid(settings['width'], settings['height']).spaced(settings['players']):
+        return None
+    return settings
+
+def loadRoomList(ids=None):
+    #The rooms of ids with their members and settings, or every room when ids is None,
+    #in three queries per 500 rooms, for RoomListCache. Runs in its own app context
+    #since whole reloads run in the background.
+    if ids is None:
+        return encodeRooms(None)
+    ids = list(ids)
+    rooms = []
+    for i in range(0, len(ids), 500):
+        rooms.extend(encodeRooms(ids[i:i + 500]))
+    return rooms
+
+def encodeRooms(ids):
+    with app.app_context():
+        members = {}
+        query = roomMembers()
+        settings = RoomSettingsModel.query
+        rooms = RoomModel.query.order_by(RoomModel.id)
+        if ids is not None:
+            query = query.filter(RoomMemberModel.room.in_(ids))
+            settings = settings.filter(RoomSettingsModel.room.in_(ids))
+            rooms = rooms.filter(RoomModel.id.in_(ids))
+        for member, name in query:
+            members.setdefault(member.room, []).append((member, name))
+        settings = {s.room: settingsResponse(s) for s in settings}
+        encoded = []
+        for room in rooms:
+            response = serializeRoom(room)
+            response['players'], response['votes'] = memberLists(members.get(room.id, []))
+            response['protected'] = False if room.passwd is None else True
+            response['settings'] = settings.get(room.id) or defaultSettings()
+            flags = 0
+            if len(response['players']) >= response['settings']['players']:
+                flags |= FULL
+            if response['protected']:
+                flags |= PROTECTED
+            if room.ready:
+                flags |= STARTED
+            encoded.append((room.id, json.dumps(response), flags))
+        return encoded
+
+def gameState(game, since=None):
+    state = {
+        'game': game['id'],
+        'version': game['version'],
+        'since': None,
+        'turn': game['turn'],
+        'mode': game.get('mode', 'turns'),
+        'width': game['board'].width,
+        'height': game['board'].height,
+        'number_of_players': len(game['players']),
+        'current_player': game['current_player'],
+        'players': game['players']
+    }
+    if since is not None and 0 <= since <= game['version']:
+        state['since'] = since
+        state['map'] = game['board'].changedSince(since)
+        state['history'] = engine.historySince(game, since)
+    else:
+        state['map'] = game['board'].tiles()
+        state['history'] = game['history']
+    return state
+
+def loadReplay(game_id):
+    #Saved replay of a finished game, the replay so far of a live one
+    replay = ReplayModel.query.get(game_id)
+    if replay is not None and replay.data is not None:
+        return replay.data
+    game = control.findGame(game_id)
+    if game and 'replay' in game:
+        return bytes(game['replay'])
+    return None
+
+def replayRow(game_id, room_id, map_id):
+    return {'id': game_id, 'room': room_id, 'map': map_id, 'started': time.time()}
+
+def roomMaps(width, height, players, wait=True):
+    #The first map is always empty, the others come ready from the pool and can be
+    #generated again from their seed, see mapgen.generateMap
+    return [emptyMap(width, height, players)] + [
+        map_pool.take(width, height, players, density, wait) for density in app.config['MAP_DENSITIES']
+    ]
+
+def formRooms(groups):
+    #Rooms for the groups of matchmaking.Matchmaker, all written in one commit. The
+    #first player is the master, a player alone gets bots and a room whose players
+    #are all ready starts its game at once with the map most of them voted for.
+    with app.app_context():
+        ids = [ticket['player'] for _, tickets in groups for ticket in tickets]
+        names = {}
+        for i in range(0, len(ids), 500):
+            names.update(db.session.query(PlayerModel.id, PlayerModel.name).filter(PlayerModel.id.in_(ids[i:i + 500])))
+        packed = set()
+        rooms, settings, members, added_bots, replays, starts, formed = [], [], [], [], [], [], []
+        for (capacity, width, height), tickets in groups:
+            room_id = str(uuid.uuid4())
+            #Maps are reused when the pool runs dry, and a board size the pool has no
+            #map for yet gets empty ones, rather than generated here
+            maps = [m['data'] for m in roomMaps(width, height, capacity, False)]
+            packed.update(maps)
+            players = [{'id': t['player'], 'name': names.get(t['player']), 'ready': t['ready']} for t in tickets]
+            members += [{'room': room_id, 'player': t['player'], 'ready': t['ready'], 'vote': t['vote']} for t in tickets]
+            bots = []
+            if len(tickets) < 2:
+                bots = [str(uuid.uuid4()) for _ in range(capacity - len(tickets))]
+                for n, bot in enumerate(bots, 1):
+                    players.append({'id': bot, 'name': 'Bot %d' % n, 'ready': True})
+                    members.append({'room': room_id, 'player': bot, 'ready': True, 'vote': None})
+                    added_bots.append((bot, 'Bot %d' % n, room_id))
+            room = {'id': room_id, 'master': tickets[0]['player'], 'ready': False,
+                'map': json.dumps([{'id': mapId(data)} for data in maps]), 'players': '[]', 'votes': '[]'}
+            game_id = None
+            if all(p['ready'] for p in players):
+                votes = collections.Counter(t['vote'] for t in tickets if t['vote'] is not None).most_common(1)
+                data = maps[votes[0][0] - 1 if votes else 0]
+                game_id = str(uuid.uuid4())
+                room['ready'] = True
+                room['map'] = mapId(data)
+                replays.append(replayRow(game_id, room_id, mapId(data)))
+                starts.append((room_id, players, data, bots, game_id))
+            rooms.append(room)
+            settings.append({'room': room_id, 'width': width, 'height': height, 'players': capacity})
+            formed.append((room_id, game_id))
+        ready = [t['player'] for _, tickets in groups for t in tickets if t['ready']]
+
+        def write(session):
+            storeMaps(session, list(packed))
+            session.execute(RoomModel.__table__.insert(), rooms)
+            session.execute(RoomSettingsModel.__table__.insert(), settings)
+            session.execute(RoomMemberModel.__table__.insert(), members)
+            if added_bots:
+                session.execute(PlayerModel.__table__.insert(), [{'id': bot, 'name': name, 'ready': True} for bot, name, _ in added_bots])
+                session.execute(BotModel.__table__.insert(), [{'player': bot, 'room': room_id} for bot, _, room_id in added_bots])
+            for i in range(0, len(ready), 500):
+                session.query(PlayerModel).filter(PlayerModel.id.in_(ready[i:i + 500])).update(
+                    {'ready': True}, synchronize_session=False)
+            if replays:
+                session.execute(ReplayModel.__table__.insert(), replays)
+        writes.submit(write)
+        activity.touch(*[room['id'] for room in rooms])
+        room_list.invalidate([room['id'] for room in rooms])
+        for room_id, players, data, bots, game_id in starts:
+            game = control.startGame(room_id, players, mapId(data), data, bots, game_id)
+            control.publish(game, 'start')
+            control.bots.schedule(game)
+        return formed
+
+def notifyMatch(ticket):
+    broker.publish('player:' + ticket['player'], 'match', {'room': ticket['room'], 'game': ticket['game']})
+
+def storeMaps(session, maps):
+    #Identical maps share one row, all of them go in with a single INSERT
+    session.execute(
+        sqlite_insert(MapModel).values(
+            [{'id': mapId(data), 'tiles': data} for data in maps]
+        ).on_conflict_do_nothing()
+    )
+
+def roomMapIds(value):
+    #room.map is the JSON list of the maps offered, or the id of the map played
+    if not value:
+        return []
+    try:
+        maps = json.loads(value)
+    except ValueError:
+        return [value]
+    return [m['id'] for m in maps] if isinstance(maps, list) else [value]
+
+def reapIdle():
+    #One pass of the reaper, every delete is a lobby write so it cannot interleave
+    #with the request that would have used the row. Ids used since the activity was
+    #last written are skipped.
+    now = time.time()
+    batch = app.config['REAPER_BATCH']
+    counts = {'players': 0, 'rooms': 0, 'maps': 0, 'tiles': 0}
+    with app.app_context():
+        seen = [{'id': id, 'seen': t} for id, t in activity.drain().items()]
+
+        def record(session):
+            if seen:
+                upsert = sqlite_insert(ActivityModel)
+                session.execute(upsert.on_conflict_do_update(index_elements=['id'],
+                    set_={'seen': func.max(ActivityModel.seen, upsert.excluded.seen)}), seen)
+            #Players and rooms created before the table, or never used since, count from now
+            for model in (PlayerModel, RoomModel):
+                session.execute(ActivityModel.__table__.insert().from_select(['id', 'seen'],
+                    select(model.id, literal(now)).where(~exists().where(ActivityModel.id == model.id))))
+            session.query(ActivityModel).filter(
+                ~exists().where(PlayerModel.id == ActivityModel.id),
+                ~exists().where(RoomModel.id == ActivityModel.id)
+            ).delete(synchronize_session=False)
+        writes.submit(record)
+
+        def expirePlayers(session):
+            ids = [player_id for player_id, in session.query(PlayerModel.id).join(
+                ActivityModel, ActivityModel.id == PlayerModel.id
+            ).filter(
+                ActivityModel.seen < now - app.config['PLAYER_TTL'],
+                ~exists().where(BotModel.player == PlayerModel.id)
+            ).limit(batch) if not activity.pending(player_id)]
+            session.query(RoomMemberModel).filter(RoomMemberModel.player.in_(ids)).delete(synchronize_session=False)
+            session.query(PlayerModel).filter(PlayerModel.id.in_(ids)).delete(synchronize_session=False)
+            session.query(ActivityModel).filter(ActivityModel.id.in_(ids)).delete(synchronize_session=False)
+            moves = [(bucket, None) for bucket, in session.query(RatingModel.bucket).filter(RatingModel.player.in_(ids))]
+            session.query(RatingModel).filter(RatingModel.player.in_(ids)).delete(synchronize_session=False)
+            return len(ids), moves
+
+        def expireRooms(session):
+            people = exists().where(RoomMemberModel.room == RoomModel.id, ~exists().where(BotModel.player == RoomMemberModel.player))
+            ids = [room_id for room_id, in session.query(RoomModel.id).join(
+                ActivityModel, ActivityModel.id == RoomModel.id
+            ).filter(or_(
+                ActivityModel.seen < now - app.config['ROOM_TTL'],
+                and_(ActivityModel.seen < now - app.config['EMPTY_ROOM_TTL'], ~people)
+            )).limit(batch) if not activity.pending(room_id)]
+            bots = [bot for bot, in session.query(BotModel.player).filter(BotModel.room.in_(ids))]
+            session.query(RoomMemberModel).filter(RoomMemberModel.room.in_(ids)).delete(synchronize_session=False)
+            session.query(RoomSettingsModel).filter(RoomSettingsModel.room.in_(ids)).delete(synchronize_session=False)
+            session.query(BotModel).filter(BotModel.room.in_(ids)).delete(synchronize_session=False)
+            session.query(PlayerModel).filter(PlayerModel.id.in_(bots)).delete(synchronize_session=False)
+            session.query(ActivityModel).filter(ActivityModel.id.in_(ids + bots)).delete(synchronize_session=False)
+            session.query(RoomModel).filter(RoomModel.id.in_(ids)).delete(synchronize_session=False)
+            return len(ids), ()
+
+        def expireMaps(session):
+            #The rooms are read in the same transaction, a map stored by a request
+            #right before this write is already listed by its room
+            used = {map_id for map_id, in session.query(ReplayModel.map).distinct()}
+            for value, in session.query(RoomModel.map):
+                used.update(roomMapIds(value))
+            ids = []
+            for map_id, in session.query(MapModel.id):
+                if map_id not in used:
+                    ids.append(map_id)
+                    if len(ids) >= batch:
+                        break
+            session.query(MapModel).filter(MapModel.id.in_(ids)).delete(synchronize_session=False)
+            return len(ids), ()
+
+        for kind, expire in (('players', expirePlayers), ('rooms', expireRooms), ('maps', expireMaps)):
+            while True:
+                deleted, _ = writes.submit(expire, lambda result: moveRanks(result[1]))
+                counts[kind] += deleted
+                if deleted < batch:
+                    break
+        if counts['players'] or counts['rooms']:
+            room_list.reload()
+
+        #Tiles of the maps stored one row per tile, nothing writes them any more
+        if db.session.query(TileModel.id).first() is not None:
+            listed = set()
+            for tiles, in db.session.query(MapModel.tiles).filter(MapModel.tiles.like('[%')):
+                listed.update(tile['id'] for tile in json.loads(tiles))
+            ids = [tile_id for tile_id, in db.session.query(TileModel.id) if tile_id not in listed]
+            db.session.remove()
+            for i in range(0, len(ids), batch):
+                chunk = ids[i:i + batch]
+                writes.submit(lambda session: session.query(TileModel).filter(TileModel.id.in_(chunk)).delete(synchronize_session=False))
+            counts['tiles'] = len(ids)
+        counts['pages'] = vacuumPages(app.config['REAPER_VACUUM_PAGES'])
+    return counts
+
+def vacuumPages(limit):
+    #Free pages given back to the file system, only databases created with
+    #auto_vacuum=INCREMENTAL (see persistence.tuneSqlite) can, older ones need a VACUUM
+    if db.engine.dialect.name != 'sqlite':
+        return 0
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            logger.debug('reaper vacuum skipped, auto_vacuum is not incremental')
+            return 0
+        free = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        #execute() would free a single page, executescript steps the pragma to the end
+        cursor.executescript('PRAGMA incremental_vacuum(%d)' % limit)
+        return free - cursor.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        conn.close()
+
+def ratePlayers(session, game):
+    #Updates the ratings of the players of an ended game, see ranking.rateGame.
+    #Runs in the game's write, which reads the ratings it changes. Returns the
+    #(old, new) bucket of every rated player for moveRanks once it is committed.
+    places = engine.standings(game)
+    bots = set(game['bots'])
+    humans = [player_id for player_id in places if player_id not in bots]
+    if len(places) < 2 or not humans:
+        return []
+    #Players the reaper deleted since are not rated again
+    humans = [player_id for player_id, in session.query(PlayerModel.id).filter(PlayerModel.id.in_(humans))]
+    initial = app.config['RATING_INITIAL']
+    #Columns rather than models, so an earlier write of the same batch is not read stale
+    rows = {row.player: row for row in session.query(RatingModel.player, RatingModel.rating, RatingModel.bucket).filter(
+        RatingModel.player.in_(humans))}
+    ratings = {player_id: rows[player_id].rating if player_id in rows else initial for player_id in places}
+    rated = rateGame(ratings, places, app.config['RATING_K'])
+    now = time.time()
+    standing = {player['id'] for player in game['players']}
+    values = [{
+        'player': player_id,
+        'rating': rated[player_id],
+        'bucket': ranks.bucket(rated[player_id]),
+        'games': 1,
+        'wins': int(player_id in standing),
+        'updated': now
+    } for player_id in humans]
+    if not values:
+        return []
+    upsert = sqlite_insert(RatingModel)
+    session.execute(upsert.on_conflict_do_update(index_elements=['player'], set_={
+        'rating': upsert.excluded.rating,
+        'bucket': upsert.excluded.bucket,
+        'games': RatingModel.games + 1,
+        'wins': RatingModel.wins + upsert.excluded.wins,
+        'updated': upsert.excluded.updated
+    }), values)
+    return [(rows[value['player']].bucket if value['player'] in rows else None, value['bucket']) for value in values]
+
+def moveRanks(moves):
+    #Applies the bucket moves of a committed rating write to the rank index. It runs
+    #after the commit in commit order, so a failed or retried write moves nothing
+    #twice, and a load read before the write is swapped in before its moves.
+    with ranks.lock:
+        if ranks.loaded is None:
+            return
+        for old, new in moves:
+            ranks.move(old, new)
+
+def rankIndex():
+    #The ranking, loaded from the rating table on first use and then every RANKING_TTL
+    #seconds. It is read in the write queue and swapped in after that commit, so
+    #the moves of every rating write of this process apply to it exactly once.
+    ttl = app.config['RANKING_TTL']
+
+    def stale():
+        return ranks.loaded is None or ttl and time.monotonic() - ranks.loaded > ttl
+
+    def swap(counts):
+        with ranks.lock:
+            if counts is not None:
+                ranks.load(counts)
+
+    if stale():
+        def load(session):
+            if stale():
+                return session.query(RatingModel.bucket, func.count()).group_by(RatingModel.bucket).all()
+        writes.submit(load, swap)
+    return ranks
+
+def rankedPlayers(query):
+    return [{
+        'id': rating.player,
+        'name': name,
+        'rating': round(rating.rating, 1),
+        'games': rating.games,
+        'wins': rating.wins
+    } for rating, name in query]
+
+def leaderboardQuery():
+    #Ratings with their player's name, in leaderboard order when ordered by rankOrder
+    return db.session.query(RatingModel, PlayerModel.name).outerjoin(PlayerModel, PlayerModel.id == RatingModel.player)
+
+def rankOrder(descending=True):
+    #The order of the rank index, best first. The player id only breaks ties.
+    columns = (RatingModel.bucket, RatingModel.rating, RatingModel.player)
+    return [column.desc() if descending else column.asc() for column in columns]
+
+room_list = RoomListCache(loadRoomList, app.config['ROOM_LIST_TTL'])
+ranks = RankIndex()
+map_pool = MapPool(app.config['MAP_POOL_SIZE'])
+map_pool.warm(app.config['BOARD_WIDTH'], app.config['BOARD_HEIGHT'], app.config['ROOM_CAPACITY'], app.config['MAP_DENSITIES'])
+matchmaker = Matchmaker(formRooms, notifyMatch, app.config['MATCH_INTERVAL'], app.config['MATCH_MAX_WAIT'], app.config['MATCH_BATCH'])
+reaper = Reaper(reapIdle, lambda kind, count: metrics.inc('tron_reaped_total', (('kind', kind),), count),
+    app.config['REAPER_INTERVAL'])
+
 class API(metaclass=Singleton): 
     @app.route('/player', methods=['GET'])
     @marshal_with(player_resouce_fields)
@@ -238,25 +975,26 @@ class API(metaclass=Singleton):
         if not 'id' in data:
             return 'missing ID', 406
         player = PlayerModel.query.get(data['id'])
-        rooms = RoomModel.query.all()
-        for room in rooms:
-            if json.dumps(serializePlayer(player)) in room.players:
-                data = []
-                for p in json.loads(room.players):
-                    if p['id'] == player.id:
-                        p['ready'] = True
-                    data.append(p)
-                    votes = json.loads(room.votes)
-                    vote = request.get_json()['vote']
-                    votes.append({p['id']:vote})
-                room.players = json.dumps(data)
-                room.votes = json.dumps(votes)
-        player.ready = True
-
-        db.session.add(player)
-        db.session.add(room)
-        db.session.commit()
-        return serializePlayer(player), 201
+        if not player:
+            return 'Invalid player', 406
+        rooms = [room_id for room_id, in db.session.query(RoomMemberModel.room).join(
+            RoomModel, RoomModel.id == RoomMemberModel.room
+        ).filter(RoomMemberModel.player == player.id, RoomModel.ready == False)]
+        vote = data.get('vote')
+        activity.touch(player.id, *rooms)
+
+        def write(session):
+            session.query(RoomMemberModel).filter(
+                RoomMemberModel.player == player.id, RoomMemberModel.room.in_(rooms)
+            ).update({'ready': True, 'vote': vote}, synchronize_session=False)
+            session.query(PlayerModel).filter_by(id=player.id).update({'ready': True}, synchronize_session=False)
+        writes.submit(write)
+        room_list.invalidate(rooms)
+        for room_id in rooms:
+            broker.publish(room_id, 'room', {'type': 'ready', 'player': player.id})
+        response = serializePlayer(player)
+        response['ready'] = True
+        return response, 201
     
     @app.route('/player/create', methods=['POST'])
     def createPlayer():
@@ -269,8 +1007,8 @@ class API(metaclass=Singleton):
             name = input_name,
             ready = False
         )
-        db.session.add(player)
-        db.session.commit()
+        writes.submit(lambda session: session.add(player))
+        activity.touch(player.id)
         return serializePlayer(player), 201
 
     @app.route('/player', methods=['GET'])
@@ -281,19 +1019,26 @@ class API(metaclass=Singleton):
         player = PlayerModel.query.get(id)
         return serializePlayer(player), 201
 
+    '''
+    A page of rooms ordered by id, the next page starts after the X-Next-Cursor header.
+    full=0, protected=0 and started=0 leave out full, password protected and started rooms
+    /rooms?full=0&started=0&limit=20&cursor=73d38bf6-ba81-486d-a054-00ceef9c13d6
+    '''
     @app.route('/rooms', methods=['GET'])
     #@marshal_with(room_resourse_fields)
     def getRooms():
-        rooms = RoomModel.query.all()
-        response = []
-        for room in rooms:
-            line = serializeRoom(room)
-            line['players'] = json.loads(room.players)
-            line['votes'] = json.loads(room.votes)
-            line['protected'] = False if room.passwd is None else True
-
-            response.append(line)
-        return response
+        exclude = 0
+        for name, flag in (('full', FULL), ('protected', PROTECTED), ('started', STARTED)):
+            if request.args.get(name, '').lower() in ('0', 'false'):
+                exclude |= flag
+        limit = request.args.get('limit', app.config['ROOM_LIST_PAGE'], type=int)
+        limit = max(1, min(limit, app.config['ROOM_LIST_MAX_PAGE']))
+        rooms, next_cursor = room_list.page(exclude, request.args.get('cursor'), limit)
+        headers = {}
+        if next_cursor is not None:
+            headers['X-Next-Cursor'] = next_cursor
+            headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
+        return Response('[' + ','.join(rooms) + ']', mimetype='application/json', headers=headers)
     
     '''
     {
@@ -308,19 +1053,24 @@ class API(metaclass=Singleton):
         room = RoomModel.query.get(id)
         if not room:
             return 'Invalid information'
-        response = serializeRoom(room)
-        response['players'] = json.loads(room.players)
-        response['votes'] = json.loads(room.votes)
-        response['protected'] = True if room.passwd else False
-        return response
+        activity.touch(room.id)
+        return roomResponse(room)
 
 
     '''
+    settings are optional, boards are 8 to 256 tiles wide and high, rooms take 2 to 16 players
+    as long as their spawns on the board are not next to each other (8x8 takes 8 at most)
     {
         "player":
         {
             "id": "f2cf0491-0ed5-46ab-bb8d-11c455b9e70f",
             "name": "jackson"
+        },
+        "settings":
+        {
+            "width": 32,
+            "height": 24,
+            "players": 6
         }
     }
     '''
@@ -331,38 +1081,26 @@ class API(metaclass=Singleton):
         if not 'player' in data:
             return 'Missing room master.', 406
         player = PlayerModel.query.get(data['player']['id'])
+        settings = parseSettings(data.get('settings') or {})
+        if settings is None:
+            return 'Invalid room settings', 406
+        map_data = packMap(settings['width'], settings['height'], bytearray(settings['width'] * settings['height']))
         room = RoomModel(
             id = str(uuid.uuid4()),
             master = player.id,
-            players = json.dumps([serializePlayer(player)]),
             ready = False,
-            votes = json.dumps([])
+            map = json.dumps([{"id": mapId(map_data)}])
         )
 
-        tiles = []
-        for i in range(16):
-            for j in range(16):
-                tile = TileModel(
-                    id = str(uuid.uuid4()),
-                    x = i+1,
-                    y = j+1,
-                    occupied = False
-                )
-                db.session.add(tile)
-                tiles.append(serializeTile(tile))
-        map = MapModel(
-            id = str(uuid.uuid4()),
-            tiles = (json.dumps(tiles))
-        )
-        room.map = json.dumps([map.id])
-        db.session.add(map)
-        db.session.add(room)
-        db.session.commit()
-        response = serializeRoom(room)
-        response['players'] = json.loads(room.players)
-        response['votes'] = json.loads(room.votes)
-        response['protected'] = False if room.passwd is None else True
-        return response
+        def write(session):
+            storeMaps(session, [map_data])
+            session.add(room)
+            session.add(RoomSettingsModel(room=room.id, **settings))
+            session.add(RoomMemberModel(room=room.id, player=player.id))
+        writes.submit(write)
+        activity.touch(room.id, player.id)
+        room_list.invalidate([room.id])
+        return roomResponse(room)
 
 
     '''
@@ -393,21 +1131,29 @@ class API(metaclass=Singleton):
             if not 'password' in data['room'] or data['room']['password'] != room.passwd:
                 return "Invalid password", 401
         
-        players = json.loads(room.players)
         new_player = PlayerModel.query.get(data['player']['id'])
-        new_player = serializePlayer(new_player)
+        if not new_player:
+            return 'Invalid information', 406
         #Játékos beléphet még több szobába !!!!!!
-        if new_player in players:
+        if RoomMemberModel.query.filter_by(room=room.id, player=new_player.id).first():
             return 'Player already joined!', 406
-        players.append(new_player)
-        print(players)
-        room.players = json.dumps(players)
-        db.session.add(room)
-        db.session.commit()
-        response = serializeRoom(room)
-        response['players'] = json.loads(room.players)
-        response['votes'] = json.loads(room.votes) 
-        return response
+        capacity = roomSettings(room.id)['players']
+
+        def write(session):
+            #Counted in the write, so concurrent joins cannot all pass the count
+            if session.query(RoomMemberModel).filter_by(room=room.id).count() >= capacity:
+                return False
+            session.add(RoomMemberModel(room=room.id, player=new_player.id))
+            return True
+        try:
+            if not writes.submit(write):
+                return 'Room is full', 406
+        except IntegrityError:
+            return 'Player already joined!', 406
+        activity.touch(room.id, new_player.id)
+        room_list.invalidate([room.id])
+        broker.publish(room.id, 'room', {'type': 'join', 'player': new_player.id})
+        return roomResponse(room)
 
     '''
     {
@@ -430,11 +1176,63 @@ class API(metaclass=Singleton):
         if not data['password']:
             return "Missing pw information!", 406
         room = RoomModel.query.get(data['id'])
-        room.passwd = data['password']
-        db.session.add(room)
-        db.session.commit()
+        if not room:
+            return 'Invalid information', 406
+        password = data['password']
+        writes.submit(lambda session: session.query(RoomModel).filter_by(id=room.id).update(
+            {'passwd': password}, synchronize_session=False))
+        activity.touch(room.id)
+        room_list.invalidate([room.id])
+        broker.publish(room.id, 'room', {'type': 'password'})
         return "Success", 200
 
+    '''
+    Sets the number of bots in the room, bots are always ready and do not vote
+    {
+        "room":
+        {
+            "id": "b20451f3-631d-4d8a-99bb-c268a06c43dd"
+        },
+        "count": 2
+    }
+    '''
+    @app.route('/room/bots', methods=['POST'])
+    def setBots():
+        data = request.get_json()
+        if not data.get('room'):
+            return 'Missing room information', 406
+        try:
+            count = int(data['count'])
+        except (KeyError, TypeError, ValueError):
+            return 'Missing bot count', 406
+        room = RoomModel.query.get(data['room']['id'])
+        if not room:
+            return 'Invalid information', 406
+        if room.ready:
+            return 'Game already started', 406
+        bots = [bot for bot, in db.session.query(BotModel.player).filter_by(room=room.id)]
+        members = RoomMemberModel.query.filter_by(room=room.id).count()
+        if count < 0 or members - len(bots) + count > roomSettings(room.id)['players']:
+            return 'Room is full', 406
+        added = [str(uuid.uuid4()) for _ in range(count - len(bots))]
+        removed = bots[count:]
+
+        def write(session):
+            for n, bot in enumerate(added, len(bots) + 1):
+                session.add(PlayerModel(id=bot, name='Bot %d' % n, ready=True))
+                session.add(RoomMemberModel(room=room.id, player=bot, ready=True))
+                session.add(BotModel(player=bot, room=room.id))
+            if removed:
+                session.query(RoomMemberModel).filter(RoomMemberModel.room == room.id,
+                    RoomMemberModel.player.in_(removed)).delete(synchronize_session=False)
+                session.query(BotModel).filter(BotModel.player.in_(removed)).delete(synchronize_session=False)
+                session.query(PlayerModel).filter(PlayerModel.id.in_(removed)).delete(synchronize_session=False)
+        writes.submit(write)
+        activity.touch(room.id)
+        room_list.invalidate([room.id])
+        broker.publish(room.id, 'room', {'type': 'bots', 'count': count})
+        return roomResponse(room)
+
     @app.route('/room/leave', methods=['POST'])
     def leaveRoom():
         data = request.get_json()
@@ -444,26 +1242,22 @@ class API(metaclass=Singleton):
             return 'Missing room information', 406
         room_id = data['room']['id']
         room = RoomModel.query.get(room_id)
-        players = json.loads(room.players)
+        if not room:
+            return 'Invalid information', 406
         leaving_player = PlayerModel.query.get(data['player']['id'])
-        s_leaving_player = serializePlayer(leaving_player)
-        if not s_leaving_player in players:
+        member = RoomMemberModel.query.filter_by(room=room.id, player=data['player']['id']).first()
+        if not member or not leaving_player:
             return 'Player is not in the room', 406
-        players.remove(s_leaving_player)
-        room.players = json.dumps(players)
-        leaving_player.ready = False
-        votes = json.loads(room.votes)
-        for vote in votes:
-            if leaving_player.id in vote:
-                votes.remove(vote)
-        room.votes = json.dumps(votes)
-        db.session.add(leaving_player)
-        db.session.add(room)
-        db.session.commit()
-        response = serializeRoom(room)
-        response['players'] = json.loads(room.players)
-        response['votes'] = json.loads(room.votes)
-        return response
+        member_id = member.id
+
+        def write(session):
+            session.query(RoomMemberModel).filter_by(id=member_id).delete(synchronize_session=False)
+            session.query(PlayerModel).filter_by(id=leaving_player.id).update({'ready': False}, synchronize_session=False)
+        writes.submit(write)
+        activity.touch(room.id, leaving_player.id)
+        room_list.invalidate([room.id])
+        broker.publish(room.id, 'room', {'type': 'leave', 'player': leaving_player.id})
+        return roomResponse(room)
     
 
     '''
@@ -473,6 +1267,8 @@ class API(metaclass=Singleton):
             "id":"73d38bf6-ba81-486d-a054-00ceef9c13d6"
         }
     }
+    /map/get?id=73d38bf6-ba81-486d-a054-00ceef9c13d6&format=packed returns the maps packed
+    each map also carries the seed and density it was generated from
     '''
 
     @app.route('/map/get', methods=['GET'])
@@ -485,54 +1281,29 @@ class API(metaclass=Singleton):
         room = RoomModel.query.get(room_id)
         if not room:
             return "Missing room information", 406
+        settings = roomSettings(room.id)
+        generated = roomMaps(settings['width'], settings['height'], settings['players'])
+        packed_only = request.args.get('format') == 'packed'
         response = []
-        tiles = []
-        for i in range(16):
-            for j in range(16):
-                tile = TileModel(
-                    id = str(uuid.uuid4()),
-                    x = i+1,
-                    y = j+1,
-                    occupied = False
-                )
-                db.session.add(tile)
-                tiles.append(serializeTile(tile))
-        map = MapModel(
-            id = str(uuid.uuid4()),
-            tiles = (json.dumps(tiles))
-        )
-        maps = [{"id":map.id}]
-        db.session.add(map)
-        response.append({
-            'id': map.id,
-            'tiles': tiles
-        })
-        for m in range(3):
-            tiles = []
-            for i in range(16):
-                for j in range(16):
-                    occupied  = True if random.randint(1,10) <= m+1 else False
-                    tile = TileModel(
-                        id = str(uuid.uuid4()),
-                        x = i+1,
-                        y = j+1,
-                        occupied = occupied
-                    )
-                    db.session.add(tile)
-                    tiles.append(serializeTile(tile))
-            map = MapModel(
-                id = str(uuid.uuid4()),
-                tiles = (json.dumps(tiles))
-            )
-            maps.append({"id":map.id})
-            db.session.add(map)
-            response.append({
-            'id': map.id,
-            'tiles': tiles
-        })
-        room.map = json.dumps(maps)
-        db.session.add(map)
-        db.session.commit()
+        packed = []
+        for m in generated:
+            data = m['data']
+            packed.append(data)
+            entry = {'id': mapId(data), 'seed': m['seed'], 'density': m['density']}
+            if packed_only:
+                #Large boards: the client unpacks the bitmap itself, see maps.packMap
+                entry['data'] = data
+            else:
+                entry['tiles'] = expandTiles(entry['id'], data)
+            response.append(entry)
+        maps = json.dumps([{"id": m['id']} for m in response])
+
+        def write(session):
+            storeMaps(session, packed)
+            session.query(RoomModel).filter_by(id=room.id).update({'map': maps}, synchronize_session=False)
+        writes.submit(write)
+        activity.touch(room.id)
+        room_list.invalidate([room.id])
         
         return response
     
@@ -548,6 +1319,14 @@ class API(metaclass=Singleton):
             return "invalid step"
         return 'Done! Next player: ' + str(next_player)
 
+    '''
+    {
+        "room": {"id": "..."},
+        "mode": "realtime"
+    }
+    "mode" is "turns" (the default) or "realtime": no turns, every player keeps moving
+    TICK_RATE tiles a second and steers with /game/direction
+    '''
     @app.route('/game/start', methods=['POST'])
     def startGame():
         data = request.get_json()
@@ -555,41 +1334,333 @@ class API(metaclass=Singleton):
             return 'Missing room information', 406
         if not data['room']['id']:
             return 'Missing room ID', 406
+        mode = data.get('mode') or 'turns'
+        if mode not in ('turns', 'realtime'):
+            return 'Invalid game mode', 406
+        if mode == 'realtime' and not isinstance(control.store, MemoryGameStore):
+            #The tick loop of one process moves its games, the players must reach it
+            return 'Real-time games need the memory game store', 406
         room = RoomModel.query.get(data['room']['id'])
         if not room:
             return 'Invalid room', 406
-        if(len(json.loads(room.players)) < 2 ):
+        players, _ = roomPlayers(room.id)
+        if(len(players) < 2 ):
             return 'Not enough players to start the game!', 406
-        votes = []
-        for vote in json.loads(room.votes):
-            values = vote.values()
-            votes.append((list(values))[0])
-        winner_map = statistics.mode(votes)
-        maps = json.loads(room.map)
-        room.map = maps[winner_map-1]['id']
-        for player in json.loads(room.players):
+        for player in players:
             if player['ready'] is False:
                 return "There is an unready player in the room", 401
-        game = control.startGame(room)
-        room.ready = True
-        db.session.add(room)
-        db.session.commit()
+        tally = db.session.query(RoomMemberModel.vote, func.count()).filter(
+            RoomMemberModel.room == room.id, RoomMemberModel.vote != None
+        ).group_by(RoomMemberModel.vote).order_by(func.count().desc()).first()
+        winner_map = tally[0] if tally else 1
+        maps = json.loads(room.map)
+        map_id = maps[winner_map-1]['id']
+        bots = [bot for bot, in db.session.query(BotModel.player).filter_by(room=room.id)]
+        map = MapModel.query.get(map_id)
+        game = control.startGame(room.id, players, map.id, map.tiles, bots, mode=mode)
+
+        def write(session):
+            session.query(RoomModel).filter_by(id=room.id).update({'map': map_id, 'ready': True}, synchronize_session=False)
+            session.execute(ReplayModel.__table__.insert(), [replayRow(game['id'], room.id, map.id)])
+        writes.submit(write)
+        activity.touch(room.id)
+        room_list.invalidate([room.id])
+        control.publish(game, 'start')
+        control.bots.schedule(game)
+        if mode == 'realtime':
+            return 'Game started! Real-time'
         return 'Game started! Next_player ' + game['current_player']
+
+    '''
+    Real-time games: where the player turns on the next tick, the latest direction
+    sent before a tick counts and turning back onto the own trail is ignored
+    {
+        "player": {"id": "..."},
+        "direction": "up"
+    }
+    '''
+    @app.route('/game/direction', methods=['POST'])
+    def setDirection():
+        data = request.get_json()
+        if not data.get('player') or not data['player'].get('id'):
+            return 'Missing player information', 406
+        if data.get('direction') not in DIRECTIONS:
+            return 'Invalid direction', 406
+        if not control.ticks.steer(data['player']['id'], data['direction']):
+            return 'Not in a real-time game', 406
+        activity.touch(data['player']['id'])
+        return 'Done!'
+    '''
+    /game/state?id=<player id>&since=<version>
+    With "Accept: application/x-tron-state" the state comes in the compact binary layout of wire.py
+    '''
     @app.route('/game/state', methods=['GET'])
     def getState():
         player_id = request.args.get('id')
+        since = request.args.get('since', type=int)
         game = control.getState(player_id)
         if not game:
             return 'Game not found', 406
+        activity.touch(player_id, game['room'])
+        format = 'json'
+        if request.accept_mimetypes.best_match(['application/json', STATE_MIMETYPE]) == STATE_MIMETYPE:
+            format = 'binary'
+        etag = '%s-%d%s' % (game['id'], game['version'], '-b' if format == 'binary' else '')
+        headers = {'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+        if request.if_none_match.contains(etag):
+            headers['ETag'] = '"%s"' % etag
+            return '', 304, headers
+        version, body = control.encodedState(game, since, format)
+        if len(body) >= app.config['STATE_GZIP_MIN_SIZE'] and 'gzip' in request.accept_encodings:
+            version, body = control.encodedState(game, since, format, True)
+            headers['Content-Encoding'] = 'gzip'
+        #The body may be of a later version than the one asked about above
+        headers['ETag'] = '"%s-%d%s"' % (game['id'], version, '-b' if format == 'binary' else '')
+        return Response(body, mimetype=STATE_MIMETYPE if format == 'binary' else 'application/json', headers=headers)
+
+    '''
+    Server-sent events of a room: lobby changes as "room", game progress as "game"
+    /events?room=73d38bf6-ba81-486d-a054-00ceef9c13d6
+    '''
+    @app.route('/events', methods=['GET'])
+    def getEvents():
+        room_id = request.args.get('room')
+        if not room_id:
+            return 'Missing room ID', 406
+        activity.touch(room_id)
+        return Response(broker.stream(room_id), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+
+    '''
+    Spectators of a game: one "state" event with the whole game, then a "step" event
+    per turn with the tiles it added, the same bytes for every spectator
+    /game/watch?id=<game id from /replays or the "start" room event>
+    '''
+    @app.route('/game/watch', methods=['GET'])
+    def watchGame():
+        game_id = request.args.get('id')
+        if not game_id or not control.findGame(game_id):
+            return 'Game not found', 404
+        return Response(broker.stream('game:' + game_id, lambda: control.spectatorState(game_id)),
+            mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+
+    '''
+    Games of a room, latest first
+    /replays?room=73d38bf6-ba81-486d-a054-00ceef9c13d6&limit=20
+    '''
+    @app.route('/replays', methods=['GET'])
+    def getReplays():
+        room_id = request.args.get('room')
+        if not room_id:
+            return 'Missing room ID', 406
+        limit = min(request.args.get('limit', 20, type=int), 200)
+        replays = ReplayModel.query.with_entities(
+            ReplayModel.id, ReplayModel.map, ReplayModel.started, ReplayModel.ended
+        ).filter_by(room=room_id).order_by(ReplayModel.started.desc()).limit(limit).all()
+        return jsonify([{
+            'id': r.id,
+            'map': r.map,
+            'started': r.started,
+            'ended': r.ended,
+            'live': r.ended is None and bool(control.findGame(r.id))
+        } for r in replays])
+
+    '''
+    /replay?id=<game id> downloads the replay, see replays.py for the format
+    '''
+    @app.route('/replay', methods=['GET'])
+    def getReplay():
+        data = loadReplay(request.args.get('id'))
+        if data is None:
+            return 'Replay not found', 404
+        return Response(data, mimetype='application/octet-stream', headers={
+            'Content-Disposition': 'attachment; filename="%s.tron"' % request.args.get('id')
+        })
+
+    '''
+    /replay/play?id=<game id> returns the map and every move of the game:
+    {"map": ..., "data": <packed map>, "players": [...], "spawns": [[x, y], ...],
+     "moves": [{"player": ..., "steps": [{"x": 1, "y": 2}, ...], "killed": false}, ...]}
+    '''
+    @app.route('/replay/play', methods=['GET'])
+    def playGameReplay():
+        data = loadReplay(request.args.get('id'))
+        if data is None:
+            return 'Replay not found', 404
+        return playReplay(data, lambda map_id: MapModel.query.get(map_id).tiles)
+
+    '''
+    Players by rating, best first, a page at a time
+    /leaderboard?page=0&size=50
+    {"page": 0, "size": 50, "total": 1234, "players": [
+        {"rank": 1, "id": "7740930d-d34a-4085-abfb-275576e142b4", "name": "jackson",
+         "rating": 1712.4, "games": 31, "wins": 19}, ...]}
+    '''
+    @app.route('/leaderboard', methods=['GET'])
+    def getLeaderboard():
+        page = max(0, request.args.get('page', 0, type=int))
+        size = request.args.get('size', app.config['LEADERBOARD_PAGE'], type=int)
+        size = max(1, min(size, app.config['LEADERBOARD_MAX_PAGE']))
+        index = rankIndex()
+        offset = page * size
+        players = []
+        found = index.find(offset)
+        if found is not None:
+            #Only the bucket of the first player is skipped through in the table
+            bucket, better = found
+            players = rankedPlayers(leaderboardQuery().filter(RatingModel.bucket <= bucket).order_by(
+                *rankOrder()).offset(offset - better).limit(size))
+        for rank, player in enumerate(players, offset + 1):
+            player['rank'] = rank
+        return {'page': page, 'size': size, 'total': index.total, 'players': players}
+
+    '''
+    A player's rank and the players right above and below
+    /leaderboard/player?id=7740930d-d34a-4085-abfb-275576e142b4&around=5
+    {"rank": 12, "id": ..., "name": "jackson", "rating": 1712.4, "games": 31, "wins": 19,
+     "above": [{"rank": 7, ...}, ..., {"rank": 11, ...}], "below": [{"rank": 13, ...}, ...]}
+    '''
+    @app.route('/leaderboard/player', methods=['GET'])
+    def getPlayerRank():
+        rating = RatingModel.query.get(request.args.get('id'))
+        if rating is None:
+            return 'Player not rated', 404
+        around = max(0, min(request.args.get('around', 5, type=int), app.config['LEADERBOARD_MAX_PAGE']))
+        key = tuple_(RatingModel.bucket, RatingModel.rating, RatingModel.player)
+        position = (rating.bucket, rating.rating, rating.player)
+        #Players in better buckets from the index, the ones ahead in the same bucket from the table
+        rank = rankIndex().above(rating.bucket) + 1 + RatingModel.query.filter(
+            RatingModel.bucket == rating.bucket, key > position).count()
+        above = rankedPlayers(leaderboardQuery().filter(key > position).order_by(*rankOrder(False)).limit(around))[::-1]
+        below = rankedPlayers(leaderboardQuery().filter(key < position).order_by(*rankOrder()).limit(around))
+        for i, player in enumerate(above):
+            player['rank'] = rank - len(above) + i
+        for i, player in enumerate(below):
+            player['rank'] = rank + 1 + i
+        name = db.session.query(PlayerModel.name).filter_by(id=rating.player).scalar()
+        player = rankedPlayers([(rating, name)])[0]
+        player.update(rank=rank, above=above, below=below)
+        return player
+
+    '''
+    {
+        "player": {"id": "7740930d-d34a-4085-abfb-275576e142b4"},
+        "settings": {"width": 16, "height": 16, "players": 4},
+        "vote": 2,
+        "ready": true,
+        "bots": true
+    }
+    Queues the player for a room with these settings. Everything but the player is
+    optional: players are ready by default and a player left alone gets bots.
+    The room comes as a "match" event of /matchmaking/events or from /matchmaking/status.
+    '''
+    @app.route('/matchmaking/enqueue', methods=['POST'])
+    def enqueueMatch():
+        data = request.get_json()
+        if not data.get('player'):
+            return 'Missing player information', 406
+        player = PlayerModel.query.get(data['player'].get('id'))
+        if not player:
+            return 'Invalid player', 406
+        settings = parseSettings(data.get('settings') or {})
+        if settings is None:
+            return 'Invalid room settings', 406
+        vote = data.get('vote')
+        if vote is not None and vote not in range(1, len(app.config['MAP_DENSITIES']) + 2):
+            return 'Invalid vote', 406
+        matchmaker.enqueue(player.id, (settings['players'], settings['width'], settings['height']),
+            vote, bool(data.get('ready', True)), bool(data.get('bots', True)))
+        activity.touch(player.id)
+        return matchmaker.status(player.id), 201
+
+    '''
+    /matchmaking/status?player=7740930d-d34a-4085-abfb-275576e142b4
+    {"state": "waiting", "room": null, "game": null, "waited": 1.2, "waiting": 3}
+    {"state": "matched", "room": "b20451f3-631d-4d8a-99bb-c268a06c43dd", "game": null}
+    '''
+    @app.route('/matchmaking/status', methods=['GET'])
+    def getMatchStatus():
+        status = matchmaker.status(request.args.get('player'))
+        if status is None:
+            return 'Player is not queued', 404
+        activity.touch(request.args.get('player'))
+        return status
+
+    @app.route('/matchmaking/cancel', methods=['POST'])
+    def cancelMatch():
+        data = request.get_json()
+        if not data.get('player'):
+            return 'Missing player information', 406
+        if not matchmaker.cancel(data['player'].get('id')):
+            return 'Player is not waiting', 406
+        return 'Done!'
+
+    '''
+    Server-sent events of a queued player: "status" once, then "match" when a room is formed
+    /matchmaking/events?player=7740930d-d34a-4085-abfb-275576e142b4
+    '''
+    @app.route('/matchmaking/events', methods=['GET'])
+    def getMatchEvents():
+        player_id = request.args.get('player')
+        if not player_id:
+            return 'Missing player ID', 406
+        return Response(broker.stream('player:' + player_id, lambda: encodeEvent('status', matchmaker.status(player_id))),
+            mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+
+    '''
+    Request profiles per route, needs the X-Admin-Token header
+    GET /admin/profile?route=/game/state&limit=30 top functions by cumulative time
+    GET /admin/profile?format=collapsed collapsed stacks for flamegraph.pl (sample mode)
+    POST /admin/profile {"rate": 0.01, "mode": "sample"} changes what is profiled
+    DELETE /admin/profile drops the collected profiles
+    '''
+    @app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+    def adminProfile():
+        if not isAdmin():
+            return 'Forbidden', 403
+        if request.method == 'POST':
+            data = request.get_json() or {}
+            try:
+                profiler.configure(data.get('rate'), data.get('mode'))
+            except (TypeError, ValueError) as e:
+                return str(e), 406
+        elif request.method == 'DELETE':
+            profiler.reset()
+        route = request.args.get('route')
+        if request.args.get('format') == 'collapsed':
+            return Response(profiler.collapsed(route), mimetype='text/plain')
         return {
-            'turn': game['turn'],
-            'number_of_players': len(game['players']),
-            'current_player': game['current_player'],
-            'map' : game['map'],
-            'history': game['history'],
-            'players': game['players']
+            'rate': profiler.rate,
+            'mode': profiler.mode,
+            'routes': profiler.report(route, request.args.get('limit', 30, type=int))
         }
 
+    '''
+    Runs a reaper pass now, needs the X-Admin-Token header
+    POST /admin/reap
+    {"players": 12, "rooms": 3, "maps": 9, "tiles": 0, "pages": 41}
+    '''
+    @app.route('/admin/reap', methods=['POST'])
+    def adminReap():
+        if not isAdmin():
+            return 'Forbidden', 403
+        counts = reaper.once()
+        if counts is None:
+            return 'Reaper pass failed', 500
+        return counts
+
+    @app.route('/metrics', methods=['GET'])
+    def getMetrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 player_put_args = reqparse.RequestParser()
 player_put_args.add_argument("name", type=str, help="Name of player is required", required=True)
 player_put_args.add_argument("id", type=int, help="ID of player is required", required=True)
@@ -597,6 +1668,14 @@ player_put_args.add_argument("id", type=int, help="ID of player is required", re
 if  __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Time server")
     parser.add_argument('--port', type=int)
+    parser.add_argument('--log-level', default='WARNING')
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    #What startup built lives as long as the server, full garbage collections
+    #(a pause for every request and for the tick loop) no longer walk it.
+    #gc.freeze needs Python 3.7.
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
     
     app.run(host='127.0.0.1', port=args.port)
\ No newline at end of file
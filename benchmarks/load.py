@@ -0,0 +1,262 @@
+#Plays full games against the API and reports per endpoint latency percentiles
+#
+#   python benchmarks/load.py --lobbies 20
+#   python benchmarks/load.py --url http://127.0.0.1:5000 --lobbies 20
+#
+#Without --url the app runs in-process through the Flask test client on a
+#throwaway SQLite database, so peak RSS includes the server.
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+class Recorder(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, endpoint, elapsed, ok):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(elapsed)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, duration):
+        endpoints = {}
+        total = 0
+        for endpoint, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            total += len(samples)
+            endpoints[endpoint] = {
+                'requests': len(samples),
+                'errors': self.errors.get(endpoint, 0),
+                'rps': len(samples) / duration,
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p95_ms': percentile(samples, 95) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000
+            }
+        return total, endpoints
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+class InProcessClient(object):
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, endpoint, params=None, body=None):
+        response = self.client.open('/' + endpoint, method=method, query_string=params, json=body)
+        data = response.get_json(silent=True)
+        return response.status_code, data if data is not None else response.get_data(as_text=True)
+
+
+class HttpClient(object):
+    def __init__(self, url):
+        self.url = url.rstrip('/') + '/'
+
+    def request(self, method, endpoint, params=None, body=None):
+        url = self.url + endpoint
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req) as response:
+                status, raw = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, raw = e.code, e.read()
+        try:
+            return status, json.loads(raw)
+        except ValueError:
+            return status, raw.decode(errors='replace')
+
+
+class Lobby(object):
+    def __init__(self, client, recorder, players, bots, max_turns, rng):
+        self.client = client
+        self.recorder = recorder
+        self.size = players
+        self.bots = bots
+        self.max_turns = max_turns
+        self.rng = rng
+        #Client side view of the board built from /game/state deltas
+        self.blocked = set()
+        self.history = {}
+        self.version = None
+
+    def call(self, method, endpoint, params=None, body=None):
+        start = time.perf_counter()
+        status, data = self.client.request(method, endpoint, params, body)
+        self.recorder.record(endpoint, time.perf_counter() - start, status < 400)
+        return status, data
+
+    def run(self):
+        players = []
+        for i in range(self.size):
+            _, player = self.call('POST', 'player/create', body={'name': 'bench%d' % i})
+            players.append(player)
+        _, room = self.call('POST', 'room/create', body={'player': {'id': players[0]['id']}})
+        for player in players[1:]:
+            self.call('POST', 'room/join', body={'room': {'id': room['id']}, 'player': {'id': player['id']}})
+        if self.bots:
+            self.call('POST', 'room/bots', body={'room': {'id': room['id']}, 'count': self.bots})
+        self.call('GET', 'map/get', params={'id': room['id']})
+        for player in players:
+            self.call('POST', 'player/ready', body={'id': player['id'], 'vote': self.rng.randint(1, 4)})
+        status, _ = self.call('POST', 'game/start', body={'room': {'id': room['id']}})
+        if status >= 400:
+            return 0
+        alive = {p['id'] for p in players}
+        turns = 0
+        while turns < self.max_turns:
+            state = None
+            for player_id in list(alive):
+                params = {'id': player_id}
+                if self.version is not None:
+                    params['since'] = self.version
+                status, data = self.call('GET', 'game/state', params=params)
+                if status != 200:
+                    alive.discard(player_id)
+                    continue
+                state = data
+            if state is None or state['number_of_players'] <= 1:
+                break
+            self.merge(state)
+            current = state['current_player']
+            if current not in alive:
+                #A bot's turn, it moves on its own
+                time.sleep(0.01)
+                continue
+            self.call('POST', 'game/step', body={'player': {'id': current}, 'steps': self.randomPath(current)})
+            turns += 1
+        return turns
+
+    def merge(self, state):
+        if state['since'] is None:
+            self.blocked = set()
+            self.history = {}
+        for tile in state['map']:
+            cell = (tile['x'], tile['y'])
+            if tile['occupied'] or tile['player'] is not None:
+                self.blocked.add(cell)
+            else:
+                self.blocked.discard(cell)
+        for player_id, steps in state['history'].items():
+            self.history.setdefault(player_id, []).extend(steps)
+        self.version = state['version']
+        self.width, self.height = state['width'], state['height']
+
+    def randomPath(self, player_id):
+        head = self.history[player_id][-1]
+        path = [(head['x'], head['y'])]
+        for _ in range(4):
+            x, y = path[-1]
+            options = [(x + dx, y + dy) for dx, dy in DIRECTIONS
+                       if 1 <= x + dx <= self.width and 1 <= y + dy <= self.height
+                       and (x + dx, y + dy) not in self.blocked and (x + dx, y + dy) not in path]
+            if not options:
+                #Boxed in, crash into the nearest wall to finish the game
+                options = [(x + dx, y + dy) for dx, dy in DIRECTIONS]
+                path.append(self.rng.choice(options))
+                break
+            path.append(self.rng.choice(options))
+        return [{'x': x, 'y': y} for x, y in path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tron load generator")
+    parser.add_argument('--url', help="Server to load, runs the app in-process when omitted")
+    parser.add_argument('--lobbies', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--players', type=int, default=2, choices=(1, 2, 3, 4))
+    parser.add_argument('--bots', type=int, default=0, choices=(0, 1, 2, 3))
+    parser.add_argument('--max-turns', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="JSON results file")
+    args = parser.parse_args()
+
+    if args.url:
+        client = lambda: HttpClient(args.url)
+    else:
+        database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        os.environ['TRON_DATABASE_URI'] = 'sqlite:///' + database
+        from api import app, db
+        with app.app_context():
+            db.create_all()
+        client = lambda: InProcessClient(app)
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    seeds = [rng.random() for _ in range(args.lobbies)]
+    turns = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not seeds:
+                    return
+                seed = seeds.pop()
+            lobby = Lobby(client(), recorder, args.players, args.bots, args.max_turns, random.Random(seed))
+            played = lobby.run()
+            with lock:
+                turns.append(played)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.perf_counter() - start
+
+    total, endpoints = recorder.summary(duration)
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mode': 'http' if args.url else 'in-process',
+        'config': vars(args),
+        'duration_s': duration,
+        'requests': total,
+        'rps': total / duration,
+        'games': len(turns),
+        'turns': sum(turns),
+        #ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'endpoints': endpoints
+    }
+
+    print('%-16s %8s %7s %9s %9s %9s %9s' % ('endpoint', 'requests', 'errors', 'rps', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for endpoint, line in endpoints.items():
+        print('%-16s %8d %7d %9.1f %9.2f %9.2f %9.2f' % (
+            endpoint, line['requests'], line['errors'], line['rps'], line['p50_ms'], line['p95_ms'], line['p99_ms']))
+    print('total %d requests in %.2fs, %.1f req/s, %d games, %d turns, peak RSS %.1f MB' % (
+        total, duration, result['rps'], result['games'], result['turns'], result['peak_rss_mb']))
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         'load-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print('results written to %s' % output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#Lobby writes per second with one commit per request versus group commit
+#
+#   python benchmarks/lobby_writes.py --threads 16 --cycles 50
+#
+#Each mode runs in its own process on a fresh SQLite file. A cycle is
+#player/create x2, room/create, room/join, player/ready x2, room/setpw and
+#room/leave, all of them lobby writes.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+MODES = (('commit per request', '0'), ('group commit', '1'))
+
+
+def run(threads, cycles):
+    from api import app, db
+    with app.app_context():
+        db.create_all()
+    done = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        writes = 0
+        for _ in range(cycles):
+            a = client.post('/player/create', json={'name': 'a'}).get_json()
+            b = client.post('/player/create', json={'name': 'b'}).get_json()
+            room = client.post('/room/create', json={'player': {'id': a['id']}}).get_json()
+            client.post('/room/join', json={'room': {'id': room['id']}, 'player': {'id': b['id']}})
+            client.post('/player/ready', json={'id': a['id'], 'vote': 1})
+            client.post('/player/ready', json={'id': b['id'], 'vote': 1})
+            client.post('/room/setpw', json={'id': room['id'], 'password': 1234})
+            client.post('/room/leave', json={'room': {'id': room['id']}, 'player': {'id': b['id']}})
+            writes += 8
+        with lock:
+            done.append(writes)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    duration = time.perf_counter() - start
+    return {'writes': sum(done), 'duration_s': duration, 'writes_per_s': sum(done) / duration}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lobby write throughput")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--cycles', type=int, default=50)
+    parser.add_argument('--output', help="JSON results file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args.threads, args.cycles)))
+        return
+
+    results = {}
+    for name, group_commit in MODES:
+        env = dict(os.environ,
+                   TRON_GROUP_COMMIT=group_commit,
+                   TRON_DATABASE_URI='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'lobby.db'))
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child',
+                              '--threads', str(args.threads), '--cycles', str(args.cycles)],
+                             env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results[name] = json.loads(out.strip().splitlines()[-1])
+        print('%-20s %6d writes in %6.2fs  %8.1f writes/s' % (
+            name, results[name]['writes'], results[name]['duration_s'], results[name]['writes_per_s']))
+    before, after = (results[name]['writes_per_s'] for name, _ in MODES)
+    print('speedup %.2fx' % (after / before))
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         'lobby-writes-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'config': vars(args), 'results': results}, f, indent=2)
+    print('results written to %s' % output)
+
+
+if __name__ == "__main__":
+    main()
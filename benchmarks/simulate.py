@@ -0,0 +1,73 @@
+#Plays seeded games with the headless engine and reports win shares per spawn
+#slot and per map, and how many games and turns a second the rules manage
+#
+#   python benchmarks/simulate.py --games 1000000 --policies safe safe
+#   python benchmarks/simulate.py --policies bot random --density 0.3 --maps 64
+#   python benchmarks/simulate.py --workers 1 --games 20000 --baseline benchmarks/results/simulate-base.json
+#
+#With --baseline the run fails when turns/s falls more than --tolerance below the
+#baseline's, compare runs with the same policies, sizes and --workers.
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from simulator import simulate, POLICIES
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tron game simulator")
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--policies', nargs='+', default=['safe', 'safe'],
+                        help="One per player in spawn order: %s or module:function" % ', '.join(POLICIES))
+    parser.add_argument('--width', type=int, default=16)
+    parser.add_argument('--height', type=int, default=16)
+    parser.add_argument('--density', type=float, default=0.2, help="Obstacle density, 0 plays the empty map")
+    parser.add_argument('--maps', type=int, default=16, help="Seeded maps the games cycle through")
+    parser.add_argument('--max-turns', type=int, default=1000, help="Turns before a game counts as a draw")
+    parser.add_argument('--workers', type=int, help="Processes, defaults to one per CPU")
+    parser.add_argument('--chunk', type=int, default=500, help="Games per task sent to a worker")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', help="Results file of an earlier run to compare turns/s with")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--output', help="JSON results file")
+    args = parser.parse_args()
+    if not 2 <= len(args.policies) <= 4:
+        parser.error('--policies takes 2 to 4 policies')
+
+    result = simulate(args.games, args.width, args.height, args.policies, args.density, args.maps,
+                      args.max_turns, args.workers, args.chunk, args.seed)
+    result['timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    result['config'] = vars(args)
+
+    print('%-20s %6s %6s %s' % ('map', 'games', 'fair', 'win share by spawn'))
+    for line in result['maps']:
+        print('%-20d %6d %6.2f %s' % (line['seed'], line['games'], line['fairness'],
+                                     ' '.join('%.3f' % share for share in line['win_share'])))
+    print('%d games (%d draws) in %.2fs on %d workers, %.0f games/s, %.0f turns/s, %.1f turns a game' % (
+        result['games'], result['draws'], result['duration_s'], result['workers'],
+        result['games_per_s'], result['turns_per_s'], result['mean_turns']))
+    print('win share by spawn: %s' % ' '.join('%.3f' % share for share in result['win_share']))
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         'simulate-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print('results written to %s' % output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        floor = baseline['turns_per_s'] * (1 - args.tolerance)
+        if result['turns_per_s'] < floor:
+            print('regression: %.0f turns/s, baseline %.0f' % (result['turns_per_s'], baseline['turns_per_s']))
+            sys.exit(1)
+        print('ok: %.0f turns/s, baseline %.0f' % (result['turns_per_s'], baseline['turns_per_s']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#Keeps thousands of real-time games of bots running through the server's tick loop
+#and reports whether it holds its tick rate
+#
+#   python benchmarks/ticks.py --games 1000 --rate 20
+#   python benchmarks/ticks.py --games 2000 --rate 10 --seconds 30
+#   python benchmarks/ticks.py --games 500 --players 2 --size 16 --density 0 --maps 1
+#
+#The games go through GameControl as /game/start would start them, so every tick
+#also updates the game store and publishes the events. Ended games are replaced
+#to keep --games running, seeded maps keep them from all ending at once. Fails
+#when the loop managed less than --min-share of --rate ticks a second.
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tron tick loop benchmark")
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--size', type=int, default=32, help="Board width and height")
+    parser.add_argument('--density', type=float, default=0.1, help="Obstacle density, 0 plays the empty map")
+    parser.add_argument('--maps', type=int, default=16, help="Seeded maps the games cycle through")
+    parser.add_argument('--rate', type=float, default=20, help="Ticks a second")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--min-share', type=float, default=0.95, help="Share of --rate the loop must hold")
+    parser.add_argument('--output', help="JSON results file")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['TRON_DATABASE_URI'] = 'sqlite:///' + database
+    os.environ['TRON_TICK_RATE'] = str(args.rate)
+    os.environ['TRON_REAPER_INTERVAL'] = '0'
+    from api import app, db, control
+    from mapgen import emptyMap, generateMap
+    from maps import mapId
+    with app.app_context():
+        db.create_all()
+    #Frozen like the server does at startup, see api.py
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    if args.density:
+        maps = [generateMap(args.size, args.size, args.players, args.density, seed)[0] for seed in range(args.maps)]
+    else:
+        maps = [emptyMap(args.size, args.size, args.players)['data']]
+    maps = [(mapId(data), data) for data in maps]
+    loop = control.ticks
+    moved = [0]
+    apply = loop.apply
+
+    def counted(game_id, moves, killed):
+        moved[0] += len(moves)
+        apply(game_id, moves, killed)
+    loop.apply = counted
+
+    started = [0]
+
+    def startGame():
+        players = [{'id': 'b%d-%d' % (started[0], n), 'name': 'Bot %d' % n} for n in range(args.players)]
+        map_id, map_data = maps[started[0] % len(maps)]
+        started[0] += 1
+        control.startGame(None, players, map_id, map_data, [p['id'] for p in players], mode='realtime')
+
+    for _ in range(args.games):
+        startGame()
+    stop = threading.Event()
+
+    def refill():
+        while not stop.wait(0.1):
+            for _ in range(args.games - loop.activeCount()):
+                startGame()
+    threading.Thread(target=refill, daemon=True).start()
+
+    #The first ticks warm up
+    time.sleep(min(1.0, args.seconds / 10))
+    ticks, overruns, moves, first = loop.ticks, loop.overruns, moved[0], started[0]
+    loop.recent.clear()
+    start = time.perf_counter()
+    time.sleep(args.seconds)
+    duration = time.perf_counter() - start
+    stop.set()
+    seconds = list(loop.recent)
+    ticks, overruns = loop.ticks - ticks, loop.overruns - overruns
+    result = {
+        'games': args.games,
+        'players': args.players,
+        'size': args.size,
+        'rate': args.rate,
+        'duration_s': duration,
+        'ticks': ticks,
+        'ticks_per_s': ticks / duration,
+        'overruns': overruns,
+        'overrun_share': overruns / ticks if ticks else 0,
+        'games_started': started[0] - first,
+        'moves_per_s': (moved[0] - moves) / duration,
+        'tick_p50_ms': percentile(seconds, 0.5) * 1000,
+        'tick_p99_ms': percentile(seconds, 0.99) * 1000,
+        'tick_max_ms': max(seconds) * 1000 if seconds else 0,
+        'period_ms': 1000 / args.rate,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    print('%d games of %d on %dx%d at %.0f Hz: %.1f ticks/s, %d overruns, tick p50 %.1fms p99 %.1fms max %.1fms (period %.1fms)' % (
+        args.games, args.players, args.size, args.size, args.rate, result['ticks_per_s'], overruns,
+        result['tick_p50_ms'], result['tick_p99_ms'], result['tick_max_ms'], result['period_ms']))
+    print('%.0f moves/s, %d games ended and replaced' % (result['moves_per_s'], result['games_started']))
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         'ticks-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print('results written to %s' % output)
+    if result['ticks_per_s'] < args.rate * args.min_share:
+        print('tick rate not held: %.1f ticks/s of %.0f' % (result['ticks_per_s'], args.rate))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import array
+import bisect
+import functools
+from maps import loadMap, tileId, BITS
+
+
+@functools.lru_cache(maxsize=64)
+def blankWalls(width, height):
+    return bytes(width * height)
+
+@functools.lru_cache(maxsize=64)
+def wallBits(walls):
+    return int(walls[::-1].translate(BITS), 2)
+
+
+class Board(object):
+    #Cells are indexed by (y-1)*width + (x-1). The walls of a map are one read-only
+    #grid shared by every board of that map, everything else grows with the trails:
+    #a cell is in self.cells only while a player's trail (head included) covers it.
+    def __init__(self, width=16, height=16, map_id=None, data=None):
+        self.map = map_id
+        #Packed map the walls come from, see maps.packMap
+        self.data = data
+        self.width = width
+        self.height = height
+        self.walls = loadMap(data)[2] if data else blankWalls(width, height)
+        #cell -> slot of the player whose trail covers it
+        self.cells = {}
+        self.players = [None]
+        self.slots = {}
+        self.trails = {}
+        #Version and cell of every cell touched, in order. Flat arrays rather than a
+        #list of tuples: a long game adds nothing for the garbage collector to walk.
+        self.version = 0
+        self.versions = array.array('I')
+        self.changed = array.array('I')
+
+    @classmethod
+    def fromMap(cls, map_id, data):
+        width, height, _ = loadMap(data)
+        return cls(width, height, map_id, data)
+
+    def __getstate__(self):
+        #The walls are loaded again from the map instead of being copied
+        state = dict(self.__dict__)
+        del state['walls']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.walls = loadMap(self.data)[2] if self.data else blankWalls(self.width, self.height)
+
+    def index(self, x, y):
+        return (int(y) - 1) * self.width + int(x) - 1
+
+    def inBounds(self, x, y):
+        return 1 <= int(x) <= self.width and 1 <= int(y) <= self.height
+
+    def isFree(self, x, y):
+        if not self.inBounds(x, y):
+            return False
+        i = self.index(x, y)
+        return not self.walls[i] and i not in self.cells
+
+    def getOwner(self, x, y):
+        return self.players[self.cells.get(self.index(x, y), 0)]
+
+    def place(self, player_id, x, y):
+        slot = self.slots.get(player_id)
+        if slot is None:
+            slot = len(self.players)
+            self.players.append(player_id)
+            self.slots[player_id] = slot
+            self.trails[player_id] = array.array('I')
+        i = self.index(x, y)
+        self.cells[i] = slot
+        self.trails[player_id].append(i)
+        self.touch(i)
+
+    def touch(self, i):
+        self.versions.append(self.version)
+        self.changed.append(i)
+
+    def firstCollision(self, xs, ys):
+        #Index of the first hop leaving the board or hitting a wall, a trail or the
+        #path itself, len(xs) if the whole path is clear
+        width, height = self.width, self.height
+        walls, cells = self.walls, self.cells
+        seen = set()
+        for i in range(1, len(xs)):
+            x, y = xs[i], ys[i]
+            if not (1 <= x <= width and 1 <= y <= height):
+                return i
+            cell = (y - 1) * width + x - 1
+            if walls[cell] or cell in cells or cell in seen:
+                return i
+            seen.add(cell)
+        return len(xs)
+
+    def advance(self, player_id, xs, ys, end):
+        #Moves the head along hops 1..end-1, leaving a trail behind
+        for i in range(1, end):
+            #The old head becomes trail
+            self.touch(self.index(xs[i - 1], ys[i - 1]))
+            self.place(player_id, xs[i], ys[i])
+
+    def removePlayer(self, player_id):
+        slot = self.slots.pop(player_id, None)
+        if slot is None:
+            return
+        for i in self.trails.pop(player_id):
+            if self.cells.get(i) == slot:
+                del self.cells[i]
+                self.touch(i)
+        self.players[slot] = None
+
+    def bitboards(self):
+        #The board as ints with bit i set for cell i: the walls, plus the trail
+        #(head included) and the head cell of every player, keyed by slot
+        trails = {}
+        heads = {}
+        for player_id, cells in self.trails.items():
+            slot = self.slots[player_id]
+            bits = 0
+            for i in cells:
+                bits |= 1 << i
+            trails[slot] = bits
+            heads[slot] = cells[-1]
+        return wallBits(self.walls), trails, heads
+
+    def changedCells(self, version):
+        #Cells changed after version, each once, in the order of their last change
+        start = bisect.bisect_left(self.versions, version + 1)
+        cells = {}
+        for i in self.changed[start:]:
+            cells.pop(i, None)
+            cells[i] = True
+        return list(cells)
+
+    def changedSince(self, version):
+        return [self.tile(i) for i in self.changedCells(version)]
+
+    def tile(self, i):
+        slot = self.cells.get(i, 0)
+        player = self.players[slot]
+        return {
+            'id': tileId(self.map, i % self.width + 1, i // self.width + 1),
+            'x': i % self.width + 1,
+            'y': i // self.width + 1,
+            #Trails are occupied, heads are not
+            'occupied': bool(self.walls[i]) or (slot != 0 and self.trails[player][-1] != i),
+            'player': player
+        }
+
+    def tiles(self):
+        #Same order as the stored maps: x major, y minor
+        return [self.tile((y - 1) * self.width + x - 1)
+                for x in range(1, self.width + 1)
+                for y in range(1, self.height + 1)]
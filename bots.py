@@ -0,0 +1,242 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from maps import grid, popcount
+
+logger = logging.getLogger('tron')
+
+#Tiles a player moves per turn, the client sends exactly four
+HOPS = 4
+WIN = 1 << 20
+MAX_DEPTH = 12
+
+class Timeout(Exception):
+    pass
+
+
+def paths(geo, blocked, head):
+    #Every HOPS long path from head over free tiles, one per (end, tiles covered)
+    #since paths that cover the same tiles and end together leave the same position
+    found = {}
+    neighbours = geo.neighbours
+
+    def walk(cell, covered, path):
+        if len(path) > HOPS:
+            found.setdefault((cell, covered), path)
+            return
+        taken = blocked | covered
+        for nxt in neighbours[cell]:
+            bit = 1 << nxt
+            if not taken & bit:
+                walk(nxt, covered | bit, path + (nxt,))
+
+    walk(head, 0, (head,))
+    return [(end, covered, path) for (end, covered), path in found.items()]
+
+
+class Search(object):
+    #Paranoid alpha-beta: the bot maximises, every other player minimises the
+    #bot's score, in turn order. A ply is one player's whole turn.
+    def __init__(self, geo, me, deadline):
+        self.geo = geo
+        self.me = me
+        self.deadline = deadline
+
+    def evaluate(self, blocked, heads):
+        #Voronoi territory: tiles the bot reaches before every opponent minus the
+        #tiles some opponent reaches first, ties belong to nobody
+        geo = self.geo
+        free = geo.full & ~blocked
+        mine = 1 << heads[self.me]
+        theirs = 0
+        for slot, head in heads.items():
+            if slot != self.me:
+                theirs |= 1 << head
+        claimed = mine | theirs
+        score = 0
+        while mine or theirs:
+            grow_mine = geo.spread(mine) & free & ~claimed
+            grow_theirs = geo.spread(theirs) & free & ~claimed
+            tied = grow_mine & grow_theirs
+            mine = grow_mine & ~tied
+            theirs = grow_theirs & ~tied
+            claimed |= grow_mine | grow_theirs
+            score += popcount(mine) - popcount(theirs)
+        return score
+
+    def value(self, blocked, trails, heads, order, turn, depth, ply, alpha, beta):
+        if time.monotonic() > self.deadline:
+            raise Timeout()
+        if self.me not in heads:
+            return -WIN + ply
+        if len(heads) == 1:
+            return WIN - ply
+        if depth == 0:
+            return self.evaluate(blocked, heads)
+        while order[turn % len(order)] not in heads:
+            turn += 1
+        slot = order[turn % len(order)]
+        moves = paths(self.geo, blocked, heads[slot])
+        if not moves:
+            #Boxed in: the player crashes and its trail is cleared
+            heads = dict(heads)
+            del heads[slot]
+            return self.value(blocked & ~trails[slot], trails, heads, order, turn + 1, depth - 1, ply + 1, alpha, beta)
+        maximising = slot == self.me
+        best = -WIN * 2 if maximising else WIN * 2
+        for end, covered, _ in moves:
+            moved = dict(heads)
+            moved[slot] = end
+            trail = dict(trails)
+            trail[slot] = trails[slot] | covered
+            score = self.value(blocked | covered, trail, moved, order, turn + 1, depth - 1, ply + 1, alpha, beta)
+            if maximising:
+                best = max(best, score)
+                alpha = max(alpha, score)
+            else:
+                best = min(best, score)
+                beta = min(beta, score)
+            if alpha >= beta:
+                break
+        return best
+
+    def root(self, blocked, trails, heads, order, moves, depth):
+        #Scores of the bot's moves, best first
+        scored = []
+        alpha = -WIN * 2
+        for end, covered, path in moves:
+            moved = dict(heads)
+            moved[self.me] = end
+            trail = dict(trails)
+            trail[self.me] = trails[self.me] | covered
+            score = self.value(blocked | covered, trail, moved, order, 1, depth - 1, 1, alpha, WIN * 2)
+            alpha = max(alpha, score)
+            scored.append((score, (end, covered, path)))
+        scored.sort(key=lambda s: -s[0])
+        return scored
+
+
+def chooseMove(width, height, obstacles, trails, heads, order, budget):
+    #Tiles of the bot's next turn as 1-based (x, y) pairs. trails and heads are
+    #keyed by player slot, order[0] is the bot and the rest follow in turn order.
+    #Deepens one ply at a time until the budget (seconds) runs out and plays the
+    #best move of the deepest finished search.
+    geo = grid(width, height)
+    me = order[0]
+    blocked = obstacles
+    for trail in trails.values():
+        blocked |= trail
+    moves = paths(geo, blocked, heads[me])
+    if not moves:
+        #No full turn left: go as far as possible, then step right into whatever
+        #is there, which is a wall, a trail or the edge of the board
+        path = [heads[me]]
+        taken = blocked
+        while True:
+            free = [cell for cell in geo.neighbours[path[-1]] if not taken & 1 << cell]
+            if not free:
+                break
+            path.append(free[0])
+            taken |= 1 << free[0]
+        tiles = [(cell % width + 1, cell // width + 1) for cell in path]
+        return tiles + [(tiles[-1][0] + 1, tiles[-1][1])]
+    search = Search(geo, me, time.monotonic() + budget)
+    best = moves[0]
+    for depth in range(1, MAX_DEPTH + 1):
+        try:
+            scored = search.root(blocked, trails, heads, order, moves, depth)
+        except Timeout:
+            break
+        best = scored[0][1]
+        if abs(scored[0][0]) >= WIN - MAX_DEPTH:
+            #Forced win or loss, looking deeper will not change it
+            break
+        #The next iteration tries the best moves first so alpha-beta cuts more
+        moves = [move for _, move in scored]
+    return [(cell % width + 1, cell // width + 1) for cell in best[2]]
+
+
+def watchParent(pid):
+    #Pool workers hold the pipes of the pool open, so one that outlives a killed
+    #server would wait for work forever
+    def watch():
+        while os.getppid() == pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class BotRunner(object):
+    #Searches run in a process pool so bots neither hold the GIL of request
+    #threads nor block them, finished moves are played from a small thread pool.
+    #read(game_id, fn) is GameStore.read, the position is taken from one version.
+    def __init__(self, play, read, workers, budget):
+        self.play = play
+        self.read = read
+        self.workers = workers
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.pool = None
+        self.moves = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='bot-move')
+        #(game_id, version) of the turns being searched
+        self.pending = set()
+
+    def executor(self):
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    methods = multiprocessing.get_all_start_methods()
+                    #fork does not re-import the app in the workers
+                    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+                    self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context,
+                        initializer=watchParent, initargs=(os.getpid(),))
+        return self.pool
+
+    def position(self, game):
+        #(key, bot, arguments of chooseMove) if it is a bot's turn
+        player_id = game['current_player']
+        if game['ended'] is not None or player_id not in game.get('bots', ()):
+            return None
+        board = game['board']
+        obstacles, trails, heads = board.bitboards()
+        players = [p['id'] for p in game['players']]
+        start = players.index(player_id)
+        order = [board.slots[p] for p in players[start:] + players[:start]]
+        return (game['id'], game['version']), player_id, (board.width, board.height,
+            obstacles, trails, heads, order, self.budget)
+
+    def schedule(self, game):
+        if game['ended'] is not None or game['current_player'] not in game.get('bots', ()):
+            return
+        position = self.read(game['id'], self.position)
+        if position is None:
+            return
+        key, player_id, arguments = position
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+        try:
+            future = self.executor().submit(chooseMove, *arguments)
+            future.add_done_callback(lambda future: self.moves.submit(self.finish, key, player_id, future))
+        except RuntimeError:
+            #The pools take no new work once the interpreter is exiting
+            logger.debug('bot move dropped game=%s player=%s', game['id'], player_id)
+            with self.lock:
+                self.pending.discard(key)
+        except Exception:
+            with self.lock:
+                self.pending.discard(key)
+            raise
+
+    def finish(self, key, player_id, future):
+        try:
+            self.play(player_id, future.result())
+        except Exception:
+            logger.exception('bot move failed game=%s player=%s', key[0], player_id)
+        finally:
+            with self.lock:
+                self.pending.discard(key)
@@ -85,6 +85,13 @@ class TronGameScene extends AbstractScene {
         this.activePlayer = null
 
         this.playerIdToColor = {}
+
+        this.state = null
+        this.tileIndex = {}
+
+        /* Real-time games publish every tick, one state request runs at a time */
+        this.loading = false
+        this.reload = false
     }
 
     init() {
@@ -96,22 +103,80 @@ class TronGameScene extends AbstractScene {
         this.canvasHandler.addElement(this.map)
         this.canvasHandler.addElement(this.notifyElem)
 
-        this.intervalId = null
+        this.events = null
 
         this.getStateData()
     }
 
     halt() {
-        if (this.intervalId != null) {
-            clearInterval(this.intervalId)
-        }
+        this.stopListening()
 
         super.halt()
     }
 
+    listen() {
+        this.events = new EventStreamHandler(this, this.manager.room_id)
+        .on('open', (handle) => {
+            handle.getStateData()
+        })
+        .on('game', (handle, data) => {
+            handle.getStateData()
+        })
+        .start()
+    }
+
+    stopListening() {
+        if (this.events != null) {
+            this.events.close()
+            this.events = null
+        }
+    }
+
+    mergeState(data) {
+        if (data['since'] == null || this.state == null || this.state['game'] != data['game']) {
+            this.state = data
+            this.tileIndex = {}
+
+            data['map'].forEach((element, i) => {
+                this.tileIndex[element['x'] + ',' + element['y']] = i
+            });
+
+            return
+        }
+
+        data['map'].forEach(element => {
+            this.state['map'][this.tileIndex[element['x'] + ',' + element['y']]] = element
+        });
+
+        let history = {}
+
+        data['players'].forEach(element => {
+            let steps = this.state['history'][element.id] || []
+
+            history[element.id] = steps.concat(data['history'][element.id] || [])
+        });
+
+        this.state['history'] = history
+
+        for (const key of ['version', 'turn', 'mode', 'number_of_players', 'current_player', 'players']) {
+            this.state[key] = data[key]
+        }
+    }
+
     getStateData() {
-        new GetGameStateDataHandler(this, this.manager.player_id)
+        if (this.loading) {
+            this.reload = true
+
+            return
+        }
+
+        this.loading = true
+
+        new GetGameStateDataHandler(this, this.manager.player_id, this.state != null ? this.state['version'] : null)
         .setErrorCallback((handle, status, response) => {
+            handle.loading = false
+            handle.reload = false
+
             if (handle.dialog != null) {
                 handle.dialog.close()
             }
@@ -120,10 +185,7 @@ class TronGameScene extends AbstractScene {
                 response = 'Could not connect to the server'
             }
 
-            if (this.intervalId != null) {
-                clearInterval(this.intervalId)
-                this.intervalId = null
-            }
+            handle.stopListening()
     
             if (handle.hasGameStarted) {
                 handle.createDialog(new GameOverDialog(handle, false))
@@ -137,8 +199,8 @@ class TronGameScene extends AbstractScene {
                 } else {
                     handle.removeDialog()
 
-                    if (this.intervalId == null) {
-                        this.intervalId = setInterval(this.getStateData.bind(handle), 5000)
+                    if (handle.events == null) {
+                        handle.listen()
                     }
                 }
             })
@@ -147,13 +209,26 @@ class TronGameScene extends AbstractScene {
             let playerTiles = []
             let lineTiles = []
 
+            handle.loading = false
+
+            /* Asked again meanwhile: once this state is merged */
+            if (handle.reload) {
+                handle.reload = false
+                setTimeout(() => handle.getStateData(), 0)
+            }
+
+            /* 304: nothing changed since our version */
+            if (data == undefined) {
+                return
+            }
+
+            handle.mergeState(data)
+            data = handle.state
+
             if (handle.hasGameStarted && data['number_of_players'] == 1) {
                 handle.createDialog(new GameOverDialog(handle, true))
 
-                if (this.intervalId != null) {
-                    clearInterval(this.intervalId)
-                    this.intervalId = null
-                }
+                handle.stopListening()
 
                 handle.dialog.setCloseCallback((handle) => {
                     handle.manager.room_id = null
@@ -179,7 +254,11 @@ class TronGameScene extends AbstractScene {
                 }
             });
 
-            if (handle.manager.player_id == data['current_player'] && this.activePlayer != data['current_player']) {
+            if (data['mode'] == 'realtime') {
+                if (!handle.hasGameStarted) {
+                    this.notifyElem.setText('Real-time: steer with the arrow keys!')
+                }
+            } else if (handle.manager.player_id == data['current_player'] && this.activePlayer != data['current_player']) {
                 this.notifyElem.setText('Your turn!')
             } else if (handle.activePlayer != data['current_player'] && handle.activePlayer != handle.manager.player_id) {
                 this.notifyElem.setText("Other's turn!")
@@ -256,8 +335,8 @@ class TronGameScene extends AbstractScene {
                 }
             }
 
-            if (this.intervalId == null) {
-                this.intervalId = setInterval(this.getStateData.bind(handle), 5000)
+            if (handle.events == null) {
+                handle.listen()
             }
 
             this.hasGameStarted = true
@@ -265,6 +344,19 @@ class TronGameScene extends AbstractScene {
     }
 
     onKeyPressed(e) {
+        if (this.state != null && this.state['mode'] == 'realtime') {
+            const directions = {37: 'left', 65: 'left', 38: 'up', 87: 'up', 39: 'right', 68: 'right', 40: 'down', 83: 'down'}
+
+            if (directions[e.keyCode] != undefined) {
+                /* A crashed player finds out from the next state */
+                new DirectionDataHandler(this, this.manager.player_id, directions[e.keyCode])
+                .setErrorCallback((handle, status, response) => {})
+                .startRequest((handle, data) => {})
+            }
+
+            return
+        }
+
         let lastCoord = null
 
         if (this.pendingMovements.length > 0) {
@@ -363,6 +455,7 @@ class RoomListScene extends AbstractScene {
         super.init()
 
         this.roomList = new RoomListElem()
+        this.matchEvents = null
 
         this.canvasHandler.addElement(this.roomList)
 
@@ -412,6 +505,12 @@ class RoomListScene extends AbstractScene {
                     handle.manager.changeScene(new RoomDetailScene(handle.manager))
                 })
             }
+        } else if (e.keyCode === 81 && this.matchEvents == null) {
+            new EnqueueMatchDataHandler(this, this.manager.player_id)
+            .setErrorCallback(this.genericErrorHandlerFunction)
+            .startRequest((handle, data) => {
+                handle.waitForMatch()
+            })
         } else if (e.keyCode === 67) {
             new CreateRoomDataHandler(this, this.manager.player_id)
             .setErrorCallback(this.genericErrorHandlerFunction)
@@ -421,13 +520,50 @@ class RoomListScene extends AbstractScene {
             })
         }
     }
+
+    waitForMatch() {
+        const matched = (handle, data) => {
+            if (data == null || data['room'] == null) {
+                return
+            }
+
+            handle.stopWaiting()
+            handle.manager.room_id = data['room']
+            handle.manager.changeScene(new RoomDetailScene(handle.manager))
+        }
+
+        this.createDialog(new MatchmakingDialog(this))
+        this.dialog.buttonManager.setButtonCallback(0, (handle, options) => {
+            new CancelMatchDataHandler(handle, handle.manager.player_id).startRequest(null)
+            handle.stopWaiting()
+            handle.dialog.close()
+        })
+
+        this.matchEvents = new MatchEventStreamHandler(this, this.manager.player_id)
+        .on('status', matched)
+        .on('match', matched)
+        .start()
+    }
+
+    stopWaiting() {
+        if (this.matchEvents != null) {
+            this.matchEvents.close()
+            this.matchEvents = null
+        }
+    }
+
+    halt() {
+        this.stopWaiting()
+
+        super.halt()
+    }
 }
 
 class RoomDetailScene extends AbstractScene {
     constructor(manager) {
         super(manager)
 
-        this.intervalId = null
+        this.events = null
         this.mapList = null
         this.isPlayerReady = false
 
@@ -469,8 +605,18 @@ class RoomDetailScene extends AbstractScene {
                 });
             }
 
-            if (this.intervalId == null) {
-                this.intervalId = setInterval(this.getRoomData.bind(handle), 5000)
+            if (handle.events == null && handle.manager != null) {
+                handle.events = new EventStreamHandler(handle, handle.manager.room_id)
+                .on('open', (handle) => {
+                    handle.getRoomData()
+                })
+                .on('room', (handle, data) => {
+                    handle.getRoomData()
+                })
+                .on('game', (handle, data) => {
+                    handle.getRoomData()
+                })
+                .start()
             }
         })
     }
@@ -486,11 +632,24 @@ class RoomDetailScene extends AbstractScene {
                 }
 
                 handle.dialog.close()
+
+                new SetBotsDataHandler(handle, handle.manager.room_id, parseInt(options[0].value))
+                .setErrorCallback(this.genericErrorHandlerFunction)
+                .startRequest((handle, data) => {
+                    handle.getRoomData()
+                })
             })
             handle.dialog.buttonManager.setButtonCallback(1, (handle, options) => {
                 handle.dialog.close()
             })
         })
+        this.playerList.buttonManager.setButtonCallback(5, (handle) => {
+            new StartGameDataHandler(handle, handle.manager.room_id, 'realtime')
+            .setErrorCallback(this.genericErrorHandlerFunction)
+            .startRequest((handle, data) => {
+                handle.manager.changeScene(new TronGameScene(handle.manager))
+            })
+        })
         this.playerList.buttonManager.setButtonCallback(4, (handle) => {
             handle.createDialog(new DialogElem(handle))
 
@@ -561,8 +720,9 @@ class RoomDetailScene extends AbstractScene {
     }
 
     halt() {
-        if (this.intervalId != null) {
-            clearInterval(this.intervalId)
+        if (this.events != null) {
+            this.events.close()
+            this.events = null
         }
 
         super.halt()
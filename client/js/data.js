@@ -43,6 +43,124 @@ class Room {
     }
 }
 
+/* Compact /game/state (see wire.py) decoded into the same object as the JSON one */
+function decodeGameState(buffer) {
+    const view = new DataView(buffer)
+    const bytes = new Uint8Array(buffer)
+    const decoder = new TextDecoder()
+    const dx = [1, -1, 0, 0]
+    const dy = [0, 0, 1, -1]
+    let offset = 0
+
+    const u8 = () => view.getUint8((offset += 1) - 1)
+    const u16 = () => view.getUint16((offset += 2) - 2, true)
+    const u32 = () => view.getUint32((offset += 4) - 4, true)
+    const text = () => {
+        const length = u16()
+
+        return decoder.decode(bytes.subarray(offset, offset += length))
+    }
+
+    u8()
+    const flags = u8()
+    const delta = (flags & 1) == 1
+    const width = u16()
+    const height = u16()
+    const state = {'version': u32(), 'since': u32(), 'turn': u32()}
+    const current = u8()
+
+    if (!delta) {
+        state['since'] = null
+    }
+
+    state['mode'] = (flags & 2) == 2 ? 'realtime' : 'turns'
+    state['game'] = text()
+    state['width'] = width
+    state['height'] = height
+
+    const mapId = text()
+    const tile = (cell, occupied, player) => {
+        const x = cell % width + 1
+        const y = Math.floor(cell / width) + 1
+
+        return {'id': mapId + '-' + x + '-' + y, 'x': x, 'y': y, 'occupied': occupied, 'player': player}
+    }
+
+    const slots = {0: null}
+    const players = []
+
+    for (let count = u8(); count > 0; count--) {
+        const slot = u8()
+        const ready = u8() == 1
+        const player = {'id': text(), 'name': text(), 'ready': ready}
+
+        slots[slot] = player['id']
+        players.push(player)
+    }
+
+    state['players'] = players
+    state['number_of_players'] = players.length
+    state['current_player'] = current < players.length ? players[current]['id'] : null
+    state['history'] = {}
+
+    for (let count = u8(); count > 0; count--) {
+        const slot = u8()
+
+        u16()
+
+        let x = u16()
+        let y = u16()
+        const hops = u16()
+        const tiles = [{'x': x, 'y': y}]
+
+        for (let i = 0; i < hops; i++) {
+            const direction = (bytes[offset + (i >> 2)] >> (2 * (i & 3))) & 3
+
+            x += dx[direction]
+            y += dy[direction]
+            tiles.push({'x': x, 'y': y})
+        }
+
+        offset += (hops + 3) >> 2
+        state['history'][slots[slot]] = tiles
+    }
+
+    state['map'] = []
+
+    if (delta) {
+        for (let count = u32(); count > 0; count--) {
+            const cell = u16()
+            const slot = u8()
+            const owner = slots[slot & 0x7f]
+
+            /* Trails are occupied, heads are not */
+            state['map'].push(tile(cell, owner != null && (slot & 0x80) == 0, owner))
+        }
+
+        return state
+    }
+
+    const owners = {}
+
+    for (const [player, tiles] of Object.entries(state['history'])) {
+        tiles.forEach((element, i) => {
+            owners[(element['y'] - 1) * width + element['x'] - 1] = [player, i == tiles.length - 1]
+        })
+    }
+
+    for (let x = 1; x <= width; x++) {
+        for (let y = 1; y <= height; y++) {
+            const cell = (y - 1) * width + x - 1
+            const wall = (bytes[offset + (cell >> 3)] >> (cell & 7)) & 1
+            const owner = owners[cell]
+
+            state['map'].push(tile(cell, wall == 1 || (owner != null && !owner[1]), owner != null ? owner[0] : null))
+        }
+    }
+
+    return state
+}
+
 class AbstractDataHandler {
     constructor(handle, endpoint, type = 'GET') {
         this.handle = handle
@@ -52,6 +170,9 @@ class AbstractDataHandler {
         this.endpoint = endpoint
         this.type = type
         this.errorCallback = null
+        this.ifModified = false
+        this.binary = null
+        this.decode = null
     }
 
     setErrorCallback(callback) {
@@ -64,7 +185,12 @@ class AbstractDataHandler {
         let request = {
             type: this.type,
             url: this.baseUrl + this.endpoint,
+            ifModified: this.ifModified,
             success: (data) => {
+                if (data != undefined && this.decode != null) {
+                    data = this.decode(data)
+                }
+
                 if (callback != null) {
                     callback(this.handle, data)
                 }
@@ -86,6 +212,12 @@ class AbstractDataHandler {
             request['contentType'] = 'application/x-www-form-urlencoded; charset=UTF-8'
         }
 
+        if (this.binary != null) {
+            request['headers'] = {'Accept': this.binary}
+            request['dataType'] = 'binary'
+            request['xhrFields'] = {'responseType': 'arraybuffer'}
+        }
+
         $.ajax(request);
     }
 }
@@ -99,6 +231,9 @@ class CreateMapDataHandler extends AbstractDataHandler {
 class GetRoomListDataHandler extends AbstractDataHandler {
     constructor(handle) {
         super(handle, "rooms")
+
+        //Only rooms that can still be joined
+        this.params = {'full': 0, 'started': 0}
     }
 }
 
@@ -153,10 +288,10 @@ class CreateRoomDataHandler extends AbstractDataHandler {
 }
 
 class StartGameDataHandler extends AbstractDataHandler {
-    constructor(handle, room_id) {
+    constructor(handle, room_id, mode = 'turns') {
         super(handle, 'game/start', 'POST')
 
-        this.data = {'room': {'id': room_id}}
+        this.data = {'room': {'id': room_id}, 'mode': mode}
     }
 }
 
@@ -177,10 +312,17 @@ class SetReadyDataHandler extends AbstractDataHandler {
 }
 
 class GetGameStateDataHandler extends AbstractDataHandler {
-    constructor(handle, player_id) {
+    constructor(handle, player_id, since = null) {
         super(handle, 'game/state')
 
         this.params = {'id': player_id}
+        this.ifModified = true
+        this.binary = 'application/x-tron-state'
+        this.decode = decodeGameState
+
+        if (since != null) {
+            this.params['since'] = since
+        }
     }
 }
 
@@ -192,6 +334,15 @@ class StepDataHandler extends AbstractDataHandler {
     }
 }
 
+/* Real-time games: up, down, left or right from the next tick on */
+class DirectionDataHandler extends AbstractDataHandler {
+    constructor(handle, player_id, direction) {
+        super(handle, 'game/direction', 'POST')
+
+        this.data = {'player': {'id': player_id}, 'direction': direction}
+    }
+}
+
 class SetRoomPasswordDataHandler extends AbstractDataHandler {
     constructor(handle, room_id, password) {
         super(handle, 'room/setpw', 'POST')
@@ -199,3 +350,91 @@ class SetRoomPasswordDataHandler extends AbstractDataHandler {
         this.data = {'id': room_id, 'password': password}
     }
 }
+
+class SetBotsDataHandler extends AbstractDataHandler {
+    constructor(handle, room_id, count) {
+        super(handle, 'room/bots', 'POST')
+
+        this.data = {'room': {'id': room_id}, 'count': count}
+    }
+}
+
+class EnqueueMatchDataHandler extends AbstractDataHandler {
+    constructor(handle, player_id, settings = null) {
+        super(handle, 'matchmaking/enqueue', 'POST')
+
+        this.data = {'player': {'id': player_id}}
+
+        if (settings != null) {
+            this.data['settings'] = settings
+        }
+    }
+}
+
+class CancelMatchDataHandler extends AbstractDataHandler {
+    constructor(handle, player_id) {
+        super(handle, 'matchmaking/cancel', 'POST')
+
+        this.data = {'player': {'id': player_id}}
+    }
+}
+
+class GetReplayDataHandler extends AbstractDataHandler {
+    constructor(handle, game_id) {
+        super(handle, 'replay/play')
+
+        this.params = {'id': game_id}
+    }
+}
+
+class EventStreamHandler {
+    constructor(handle, room_id) {
+        this.handle = handle
+        this.baseUrl = "http://127.0.0.1:5000/"
+        this.url = this.baseUrl + 'events?' + jQuery.param({'room': room_id})
+        this.callbacks = {}
+        this.source = null
+    }
+
+    on(event, callback) {
+        this.callbacks[event] = callback
+
+        return this
+    }
+
+    start() {
+        this.source = new EventSource(this.url)
+
+        for (const [event, callback] of Object.entries(this.callbacks)) {
+            this.source.addEventListener(event, (e) => {
+                callback(this.handle, e.data != null ? JSON.parse(e.data) : null)
+            })
+        }
+
+        return this
+    }
+
+    close() {
+        if (this.source != null) {
+            this.source.close()
+            this.source = null
+        }
+    }
+}
+
+class WatchGameStreamHandler extends EventStreamHandler {
+    //"state" carries the whole game, every "step" after it the tiles one turn added.
+    //A step whose version is not the next one means events were dropped: reconnect.
+    constructor(handle, game_id) {
+        super(handle, null)
+        this.url = this.baseUrl + 'game/watch?' + jQuery.param({'id': game_id})
+    }
+}
+
+class MatchEventStreamHandler extends EventStreamHandler {
+    //"status" comes first, so a match made before the stream opened is not missed
+    constructor(handle, player_id) {
+        super(handle, null)
+        this.url = this.baseUrl + 'matchmaking/events?' + jQuery.param({'player': player_id})
+    }
+}
\ No newline at end of file
@@ -516,7 +516,7 @@ class RoomListElem extends AbstractUiElem {
         ctx.textAlign = 'center'
         let fontSize = window.innerHeight / 60
         ctx.font = fontSize + 'px Arial'
-        ctx.fillText('Press "C" to create a new room, "R" to refresh, and "Return" to join', window.innerWidth / 2, window.innerHeight / 10)
+        ctx.fillText('Press "C" to create a new room, "Q" to find a game, "R" to refresh, and "Return" to join', window.innerWidth / 2, window.innerHeight / 10)
         ctx.fillText('Navigate in the room list using the up and down arrow keys', window.innerWidth / 2, window.innerHeight / 10 + fontSize + 2)
 
         this.rooms.forEach(element => {
@@ -912,11 +912,13 @@ class PlayerListElem extends AbstractUiElem {
             if (this.buttonManager.buttons.length < 4) {
                 this.buttonManager.addButton('Set Computer Count')
                 this.buttonManager.addButton(this.buttonText)
+                this.buttonManager.addButton('Start Real-Time Game')
 
                 return true
             }
         } else {
             if (this.buttonManager.buttons.length > 3) {
+                this.buttonManager.removeButton(5)
                 this.buttonManager.removeButton(4)
                 this.buttonManager.removeButton(3)
             }
@@ -1153,6 +1155,23 @@ class ErrorDialog extends DialogElem {
     }
 }
 
+class MatchmakingDialog extends DialogElem {
+    constructor(handle) {
+        super(handle, false)
+
+        this.buttonManager.buttons[0].setText('Cancel')
+    }
+
+    draw(ctx) {
+        super.draw(ctx)
+
+        ctx.textAlign = 'center'
+        ctx.fillStyle = Colors.LightUi
+
+        ctx.fillText('Looking for other players...', this.startX + this.rectWidth / 2, this.startY + this.rectHeight / 2)
+    }
+}
+
 class TitleTextElem extends AbstractUiElem {
     constructor(text) {
         super()
@@ -22,12 +22,51 @@ class PlayerModel(db.Model):
 class RoomModel(db.Model):
     id = db.Column(db.String, primary_key=True)
     master = db.Column(db.String, nullable=False)
-    players = db.Column(db.String, nullable=False)
+    players = db.Column(db.String, nullable=False, default='[]')
     ready = db.Column(db.Boolean, nullable=False)
     passwd = db.Column(db.Integer, nullable=True)
     map = db.Column(db.String, nullable=True)
-    votes = db.Column(db.String, nullable=False)
-    
+    votes = db.Column(db.String, nullable=False, default='[]')
+
+class RoomMemberModel(db.Model):
+    __table_args__ = (db.UniqueConstraint('room', 'player'),)
+    id = db.Column(db.Integer, primary_key=True)
+    room = db.Column(db.String, nullable=False, index=True)
+    player = db.Column(db.String, nullable=False, index=True)
+    ready = db.Column(db.Boolean, nullable=False, default=False)
+    vote = db.Column(db.Integer, nullable=True)
+
+class RoomSettingsModel(db.Model):
+    room = db.Column(db.String, primary_key=True)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    players = db.Column(db.Integer, nullable=False)
+
+class BotModel(db.Model):
+    player = db.Column(db.String, primary_key=True)
+    room = db.Column(db.String, nullable=False, index=True)
+
+class ReplayModel(db.Model):
+    id = db.Column(db.String, primary_key=True)
+    room = db.Column(db.String, nullable=False, index=True)
+    map = db.Column(db.String, nullable=False)
+    started = db.Column(db.Float, nullable=False)
+    ended = db.Column(db.Float, nullable=True)
+    data = db.Column(db.LargeBinary, nullable=True)
+
+class ActivityModel(db.Model):
+    id = db.Column(db.String, primary_key=True)
+    seen = db.Column(db.Float, nullable=False, index=True)
+
+class RatingModel(db.Model):
+    __table_args__ = (db.Index('ix_rating_model_rank', 'bucket', 'rating', 'player'),)
+    player = db.Column(db.String, primary_key=True)
+    rating = db.Column(db.Float, nullable=False)
+    bucket = db.Column(db.Integer, nullable=False)
+    games = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Float, nullable=False)
+
 class TileModel(db.Model):
     id = db.Column(db.String, primary_key=True)
     x = db.Column(db.Integer, nullable=False)
@@ -39,6 +78,31 @@ class MapModel(db.Model):
     id = db.Column(db.String, primary_key=True)
     tiles = db.Column(db.String, nullable=False)
 
+def backfillRoomMembers():
+    #One-time move of the JSON players and votes of rooms created before
+    #RoomMemberModel into member rows, in join order. The JSON is emptied after,
+    #so running it again finds nothing to move.
+    moved = 0
+    for room in RoomModel.query.filter(db.or_(RoomModel.players != '[]', RoomModel.votes != '[]')):
+        votes = {}
+        for vote in json.loads(room.votes or '[]'):
+            for player_id, value in vote.items():
+                try:
+                    votes[player_id] = int(value)
+                except (TypeError, ValueError):
+                    pass
+        for player in json.loads(room.players or '[]'):
+            if RoomMemberModel.query.filter_by(room=room.id, player=player['id']).first():
+                continue
+            db.session.add(RoomMemberModel(room=room.id, player=player['id'],
+                ready=bool(player.get('ready')), vote=votes.get(player['id'])))
+            moved += 1
+        room.players = '[]'
+        room.votes = '[]'
+    db.session.commit()
+    return moved
+
 with app.app_context():
     db.create_all()
-    print('database init done')
\ No newline at end of file
+    print('database init done')
+    print('room members moved: %d' % backfillRoomMembers())
\ No newline at end of file
@@ -0,0 +1,164 @@
+import bisect
+import logging
+import time
+from board import Board
+from maps import grid
+from replays import startReplay, recordTurn, recordHop, recordCrash
+
+logger = logging.getLogger('tron')
+
+#Replays and the game log keep the hop count of a turn in 2 bytes
+MAX_HOPS = 0xFFFF
+
+#The rules of a game, with no Flask or database behind them. A game is a dict,
+#the API keeps them in a GameStore and the simulator plays them in a loop.
+
+
+def newGame(game_id, room_id, players, map_id, map_data, bots=(), spawns=None, record=True, mode='turns'):
+    #players are {'id': ...} dicts in turn order, map_data a packed map (maps.packMap).
+    #Without record the game keeps no replay, which the simulator does not need.
+    #"realtime" games have no turns, ticks.TickLoop moves every player at once.
+    game = {
+        "id": game_id,
+        "room": room_id,
+        "mode": mode,
+        "ended": None,
+        #Player ids whose turns BotRunner plays
+        "bots": list(bots),
+        "version": 0,
+        "turn": 1,
+        "current_player": players[0]['id'] if mode == 'turns' else None,
+        "players": players,
+        "board": None,
+        "history": {},
+        #(version, player_id, index) for every history entry, in order
+        "history_log": [],
+        #(version, player_id) of the players that crashed, in order
+        "out": []
+    }
+    board = Board.fromMap(map_id, map_data)
+    if spawns is None:
+        spawns = grid(board.width, board.height).spawns(len(players))
+    game['spawns'] = [tuple(spawn) for spawn in spawns[:len(players)]]
+    for player, (x, y) in zip(game['players'], spawns):
+        board.place(player['id'], x, y)
+        game['history'][player['id']] = [{"x": x, "y": y}]
+        game['history_log'].append((0, player['id'], 0))
+    game['board'] = board
+    if record:
+        game['replay'] = startReplay(game)
+    return game
+
+def applyStep(game, player_id, xs, ys):
+    #One turn of player_id along the tiles xs, ys (the head first). Returns
+    #(game, killed), or False when the turn is rejected and nothing changed.
+    history = game['history'].get(player_id)
+    if history is None:
+        return False
+    if not xs or history[-1]['x'] != xs[0] or history[-1]['y'] != ys[0]:
+        return False
+    if len(xs) - 1 > MAX_HOPS:
+        logger.debug('step rejected reason=length game=%s player=%s hops=%d', game['id'], player_id, len(xs) - 1)
+        return False
+    if game['current_player'] != player_id:
+        logger.debug('step rejected reason=turn game=%s current=%s player=%s', game['id'], game['current_player'], player_id)
+        return False
+    if validatePath(xs, ys) is not None:
+        logger.debug('step rejected reason=path game=%s player=%s', game['id'], player_id)
+        return False
+    bumpVersion(game)
+    if 'replay' in game:
+        recordTurn(game['replay'], game['board'].slots[player_id], xs, ys)
+    #Every hop before the first crash is applied in one go
+    end = game['board'].firstCollision(xs, ys)
+    game['board'].advance(player_id, xs, ys, end)
+    for i in range(1, end):
+        history.append({"x": xs[i], "y": ys[i]})
+        game['history_log'].append((game['version'], player_id, len(history) - 1))
+    killed = end < len(xs)
+    if killed:
+        killPlayer(game, player_id)
+    game['current_player'] = nextPlayer(game)
+    return game, killed
+
+def applyTick(game, moves, killed):
+    #One tick of a real-time game: moves are (player_id, x, y) of the players that
+    #went one tile further, killed the ids of those that crashed. Returns the game.
+    bumpVersion(game)
+    game['turn'] += 1
+    board = game['board']
+    replay = game.get('replay')
+    version = game['version']
+    log = game['history_log']
+    for player_id, x, y in moves:
+        history = game['history'].get(player_id)
+        if history is None:
+            continue
+        head = history[-1]
+        if replay is not None:
+            recordHop(replay, board.slots[player_id], x - head['x'], y - head['y'])
+        #board.advance by one hop: the old head becomes trail
+        board.touch(board.trails[player_id][-1])
+        board.place(player_id, x, y)
+        history.append({"x": x, "y": y})
+        log.append((version, player_id, len(history) - 1))
+    for player_id in killed:
+        if player_id in game['history']:
+            if replay is not None:
+                recordCrash(replay, board.slots[player_id])
+            killPlayer(game, player_id)
+    return game
+
+def validatePath(xs, ys):
+    #Index of the first hop that is not a single orthogonal move, None if all are
+    hops = [abs(x1 - x0) + abs(y1 - y0) for x0, x1, y0, y1 in zip(xs, xs[1:], ys, ys[1:])]
+    for i, d in enumerate(hops):
+        if d != 1:
+            return i + 1
+    return None
+
+def bumpVersion(game):
+    game['version'] += 1
+    game['board'].version = game['version']
+
+def nextPlayer(game):
+    if not game['players']:
+        return None
+    turn_index = game['turn'] % (len(game['players']))
+    game['turn'] += 1
+    return game['players'][turn_index]['id']
+
+def killPlayer(game, player_id):
+    logger.info('kill game=%s player=%s', game['id'], player_id)
+    game['board'].removePlayer(player_id)
+    for i in range(len(game['players'])):
+        if game['players'][i]['id'] == player_id:
+            del game['players'][i]
+            break
+    game['history'].pop(player_id)
+    game.setdefault('out', []).append((game['version'], player_id))
+    if len(game['players']) <= 1:
+        endGame(game)
+    logger.debug('players game=%s left=%d', game['id'], len(game['players']))
+
+def endGame(game):
+    if game['ended'] is None:
+        game['ended'] = time.time()
+
+def standings(game):
+    #player_id -> place in an ended game, a higher place outlasted a lower one: the
+    #version a player crashed at, one more than the last for those still standing.
+    #Players that crashed in the same tick share their place.
+    places = {player_id: version for version, player_id in game.get('out', ())}
+    for player in game['players']:
+        places[player['id']] = game['version'] + 1
+    return places
+
+def historySince(game, version):
+    #player_id -> history entries added after version
+    start = bisect.bisect_left(game['history_log'], (version + 1,))
+    history = {}
+    for _, player_id, index in game['history_log'][start:]:
+        if player_id in game['history']:
+            history.setdefault(player_id, []).append(game['history'][player_id][index])
+    return history
@@ -0,0 +1,64 @@
+from singleton import Singleton
+import json
+import queue
+import threading
+
+
+def encodeEvent(event, data):
+    return ('event: %s\ndata: %s\n\n' % (event, json.dumps(data))).encode()
+
+
+class EventBroker(metaclass=Singleton):
+    #Messages are serialized once per publish and the same bytes go to every subscriber
+    def __init__(self, backlog=64, keepalive=15):
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.backlog = backlog
+        self.keepalive = keepalive
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue(maxsize=self.backlog)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self.lock:
+            subscribers = self.channels.get(channel)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.channels[channel]
+
+    def publish(self, channel, event, data):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        if not subscribers:
+            return
+        message = encodeEvent(event, data)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                #Slow client, it resyncs from /game/state or /room on the next event,
+                #spectators reconnect to /game/watch when a version is missing
+                pass
+
+    def watched(self, channel):
+        return channel in self.channels
+
+    def stream(self, channel, first=None):
+        #first() is sent after subscribing, so no event published meanwhile is lost
+        subscriber = self.subscribe(channel)
+        try:
+            yield b'retry: 1000\n\n'
+            if first is not None:
+                yield first()
+            while True:
+                try:
+                    yield subscriber.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield b': keepalive\n\n'
+        finally:
+            self.unsubscribe(channel, subscriber)
@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import pickle
+import struct
+import threading
+import uuid
+
+logger = logging.getLogger('tron')
+
+#Record header: type, body length
+HEADER = struct.Struct('<BH')
+START, ALIAS, STEP, KILL, TURN = 1, 2, 3, 4, 5
+#Game number (per segment), game version after the event, player slot
+EVENT = struct.Struct('<IIB')
+#Hop count and the first tile of a step, the hops follow as 2-bit directions
+PATH = struct.Struct('<HHH')
+DIRECTIONS = {(1, 0): 0, (-1, 0): 1, (0, 1): 2, (0, -1): 3}
+OFFSETS = {v: k for k, v in DIRECTIONS.items()}
+
+
+def encodePath(xs, ys):
+    hops = len(xs) - 1
+    packed = bytearray((hops + 3) // 4)
+    for i in range(hops):
+        packed[i // 4] |= DIRECTIONS[(xs[i + 1] - xs[i], ys[i + 1] - ys[i])] << (2 * (i % 4))
+    return PATH.pack(hops, xs[0], ys[0]) + bytes(packed)
+
+def decodePath(data):
+    hops, x, y = PATH.unpack_from(data)
+    xs, ys = [x], [y]
+    for i in range(hops):
+        dx, dy = OFFSETS[(data[PATH.size + i // 4] >> (2 * (i % 4))) & 3]
+        xs.append(xs[-1] + dx)
+        ys.append(ys[-1] + dy)
+    return xs, ys
+
+
+class GameLog(object):
+    #Append-only event log of live games in numbered segments next to a snapshot.
+    #A snapshot rotates to a new segment, pickles every game and drops the older
+    #segments. Replay skips events at or below the version a game was saved at,
+    #so events that race a snapshot are applied exactly once.
+    def __init__(self, directory, sync='os', snapshot_every=10000):
+        self.directory = directory
+        self.sync = sync
+        self.snapshot_every = snapshot_every
+        self.lock = threading.Lock()
+        self.snapshotting = False
+        self.file = None
+        self.segment = 0
+        self.numbers = {}
+        self.appended = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def segmentPath(self, n):
+        return os.path.join(self.directory, 'log.%08d' % n)
+
+    def segments(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith('log.'):
+                found.append(int(name[4:]))
+        return sorted(found)
+
+    def open(self, segment):
+        if self.file is not None:
+            self.file.close()
+        self.segment = segment
+        self.numbers = {}
+        self.file = open(self.segmentPath(segment), 'ab')
+
+    def write(self, type, body):
+        self.file.write(HEADER.pack(type, len(body)) + body)
+
+    def number(self, game_id):
+        #Games are referred to by a 4 byte number, announced once per segment
+        n = self.numbers.get(game_id)
+        if n is None:
+            n = self.numbers[game_id] = len(self.numbers) + 1
+            self.write(ALIAS, struct.pack('<I', n) + uuid.UUID(game_id).bytes)
+        return n
+
+    def flush(self):
+        self.file.flush()
+        if self.sync == 'always':
+            os.fsync(self.file.fileno())
+
+    def start(self, game, map_data, add):
+        #add(game) puts the game in the store under the lock, so a snapshot either
+        #has the game or rotates after the START record and keeps it
+        body = json.dumps({
+            'id': game['id'],
+            'room': game['room'],
+            'players': game['players'],
+            'bots': game['bots'],
+            'spawns': game['spawns'],
+            'map': game['board'].map,
+            'tiles': map_data
+        }).encode()
+        with self.lock:
+            self.write(START, body)
+            self.number(game['id'])
+            self.flush()
+            add(game)
+        self.appendedOne()
+
+    def step(self, game, slot, xs, ys, killed, next_slot):
+        with self.lock:
+            n = self.number(game['id'])
+            self.write(STEP, EVENT.pack(n, game['version'], slot) + encodePath(xs, ys))
+            if killed:
+                self.write(KILL, EVENT.pack(n, game['version'], slot))
+            self.write(TURN, EVENT.pack(n, game['version'], next_slot))
+            self.flush()
+        self.appendedOne()
+
+    def appendedOne(self):
+        with self.lock:
+            self.appended += 1
+            if self.appended < self.snapshot_every or self.snapshotting:
+                return
+            self.snapshotting = True
+        threading.Thread(target=self.snapshotInBackground, daemon=True).start()
+
+    def snapshotInBackground(self):
+        try:
+            self.snapshot(self.store)
+        except Exception:
+            logger.exception('game log snapshot failed')
+        finally:
+            with self.lock:
+                self.snapshotting = False
+
+    def snapshot(self, store):
+        with self.lock:
+            segment = self.segment + 1
+            self.flush()
+            self.open(segment)
+            self.appended = 0
+        games = store.snapshot()
+        path = os.path.join(self.directory, 'snapshot')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'segment': segment, 'games': games}, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        #Compaction: everything before the new segment is in the snapshot
+        for n in self.segments():
+            if n < segment:
+                os.remove(self.segmentPath(n))
+        logger.info('game log snapshot segment=%d games=%d', segment, len(games))
+
+    def recover(self, store, newGame, applyStep):
+        #Rebuilds store from the snapshot and the segments after it, then opens a
+        #fresh segment for new events
+        self.store = store
+        segment = 0
+        path = os.path.join(self.directory, 'snapshot')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            segment = saved['segment']
+            for data in saved['games'].values():
+                store.add(pickle.loads(data))
+        replayed = 0
+        last = segment
+        for n in self.segments():
+            if n < segment:
+                continue
+            last = n
+            if os.path.getsize(self.segmentPath(n)) == 0:
+                os.remove(self.segmentPath(n))
+                continue
+            replayed += self.replay(self.segmentPath(n), store, newGame, applyStep)
+        self.open(last + 1)
+        logger.info('game log recovered games=%d events=%d', store.activeCount(), replayed)
+
+    def replay(self, path, store, newGame, applyStep):
+        with open(path, 'rb') as f:
+            data = f.read()
+        games = {}
+        offset = replayed = 0
+        while offset + HEADER.size <= len(data):
+            type, length = HEADER.unpack_from(data, offset)
+            body = data[offset + HEADER.size:offset + HEADER.size + length]
+            if len(body) < length:
+                #Torn write at the end of the log
+                break
+            offset += HEADER.size + length
+            if type == START:
+                start = json.loads(body)
+                if store.get(start['id']) is None:
+                    store.add(newGame(start['id'], start['room'], start['players'], start['map'], start['tiles'],
+                        start['bots'], start['spawns']))
+            elif type == ALIAS:
+                n, = struct.unpack_from('<I', body)
+                games[n] = str(uuid.UUID(bytes=body[4:20]))
+            elif type == STEP:
+                n, version, slot = EVENT.unpack_from(body)
+                game = store.get(games.get(n))
+                if game is None or game['version'] >= version:
+                    continue
+                xs, ys = decodePath(body[EVENT.size:])
+                player_id = game['board'].players[slot]
+                store.update(game['id'], lambda game: applyStep(game, player_id, xs, ys))
+                replayed += 1
+            #KILL and TURN follow from replaying the step, they are kept for readers of the log
+        return replayed
@@ -0,0 +1,168 @@
+import collections
+import functools
+import logging
+import random
+import threading
+from maps import grid, packMap, popcount, BITS
+
+logger = logging.getLogger('tron')
+
+#A map is fair when its obstacles keep at least this share of the balance between
+#spawn regions that the empty board has
+BALANCE = 0.8
+#Seeds tried for one map before settling for the empty map
+ATTEMPTS = 50
+
+
+def densityTable(density):
+    #bytes.translate table turning random bytes into obstacles with the given probability
+    cut = int(round(density * 256))
+    return bytes([1] * cut + [0] * (256 - cut))
+
+def flood(geo, free, start):
+    #Tiles of free reachable from the tiles in start
+    reached = start & free
+    while True:
+        grown = (reached | geo.spread(reached)) & free
+        if grown == reached:
+            return reached
+        reached = grown
+
+def regions(geo, free, spawns):
+    #Free tiles closer to each spawn than to any other, ties belong to nobody
+    fronts = list(spawns)
+    claimed = 0
+    for front in fronts:
+        claimed |= front
+    areas = [1] * len(fronts)
+    while any(fronts):
+        grown = [geo.spread(front) & free & ~claimed for front in fronts]
+        seen = tied = 0
+        for bits in grown:
+            tied |= seen & bits
+            seen |= bits
+        claimed |= seen
+        fronts = [bits & ~tied for bits in grown]
+        for i, bits in enumerate(fronts):
+            areas[i] += popcount(bits)
+    return areas
+
+def generateMap(width, height, players, density, seed):
+    #The map of a seed as (packed map, fairness). Fairness is 0 when some spawn
+    #cannot reach the others, otherwise the smallest spawn region over the largest
+    #for two players and for a full room.
+    geo = grid(width, height)
+    rng = random.Random(seed)
+    #rng.randbytes(n) on Python 3.9+, spelled out so older versions build the same maps
+    n = width * height
+    obstacles = bytearray(rng.getrandbits(n * 8).to_bytes(n, 'little').translate(densityTable(density)))
+    spawn_cells = {}
+    for n in range(2, players + 1):
+        spawn_cells[n] = [(y - 1) * width + x - 1 for x, y in geo.spawns(n)]
+        for cell in spawn_cells[n]:
+            obstacles[cell] = 0
+            for near in geo.neighbours[cell]:
+                obstacles[near] = 0
+    free = geo.full & ~int(bytes(obstacles)[::-1].translate(BITS), 2)
+    reached = flood(geo, free, 1 << spawn_cells[2][0])
+    for cells in spawn_cells.values():
+        for cell in cells:
+            if not reached >> cell & 1:
+                return packMap(width, height, obstacles), 0
+    fairness = 1
+    for n in set((2, players)):
+        areas = regions(geo, free, [1 << cell for cell in spawn_cells[n]])
+        fairness = min(fairness, min(areas) / max(areas))
+    return packMap(width, height, obstacles), fairness
+
+@functools.lru_cache(maxsize=64)
+def emptyMap(width, height, players):
+    #Spawns on a ring are not perfectly balanced even without obstacles
+    data, fairness = generateMap(width, height, players, 0, 0)
+    return {'seed': 0, 'density': 0, 'data': data, 'fairness': fairness}
+
+
+class MapPool(object):
+    #Ready maps per (width, height, players, density), kept at `size` each by a
+    #background thread. take() only generates in the request when a pool ran dry.
+    def __init__(self, size=8):
+        self.size = size
+        self.pools = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        #Latest map taken per key, handed out again when a pool is empty and the
+        #caller cannot wait for a new one
+        self.last = {}
+
+    def warm(self, width, height, players, densities):
+        with self.condition:
+            for density in densities:
+                self.pools.setdefault((width, height, players, density), collections.deque())
+            self.condition.notify()
+        self.start()
+
+    def take(self, width, height, players, density, wait=True):
+        #{'seed', 'density', 'data', 'fairness'} of a fair map. Without wait an empty
+        #pool hands out its last map again, or the empty map before it had one, and
+        #the background thread starts filling it.
+        key = (width, height, players, density)
+        with self.condition:
+            pool = self.pools.setdefault(key, collections.deque())
+            ready = pool.popleft() if pool else None
+            if ready is None and not wait:
+                ready = self.last.get(key)
+            self.condition.notify()
+        self.start()
+        if ready is None and not wait:
+            logger.info('map pool empty width=%d height=%d players=%d density=%s, empty map instead', *key)
+            return emptyMap(width, height, players)
+        if ready is None:
+            logger.info('map pool empty width=%d height=%d players=%d density=%s', *key)
+            ready = self.generate(*key)
+        self.last[key] = ready
+        return ready
+
+    def generate(self, width, height, players, density):
+        #A map at least BALANCE as fair as the empty one, or the empty map when no
+        #attempt gets there: a lopsided map is never handed out
+        wanted = BALANCE * emptyMap(width, height, players)['fairness']
+        for _ in range(ATTEMPTS):
+            seed = random.getrandbits(63)
+            data, fairness = generateMap(width, height, players, density, seed)
+            if fairness >= wanted:
+                return {'seed': seed, 'density': density, 'data': data, 'fairness': fairness}
+        logger.warning('no fair map width=%d height=%d players=%d density=%s, empty map instead',
+            width, height, players, density)
+        return emptyMap(width, height, players)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='map-pool', daemon=True)
+                self.thread.start()
+
+    def hungry(self):
+        for key, pool in self.pools.items():
+            if len(pool) < self.size:
+                return key
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                key = self.hungry()
+                while key is None:
+                    self.condition.wait()
+                    key = self.hungry()
+            try:
+                ready = self.generate(*key)
+            except Exception:
+                logger.exception('map generation failed width=%d height=%d players=%d density=%s', *key)
+                #Not retried until a request asks for it again
+                with self.condition:
+                    self.pools.pop(key, None)
+                continue
+            with self.condition:
+                self.pools[key].append(ready)
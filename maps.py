@@ -1,17 +1,118 @@
-class BasicMap(object):
-    map = {}
-
-    def __init__(self) -> None:
-        for x in range(16):
-            for y in range(16):
-                self.map[x+1,y+1] = [
-                    #x-1, y
-                    (max(x, 1), y+1),
-                    #x+1, y
-                    (min(x+2, 16), y+1),
-                    #x, y-1
-                    (x+1, max(y, 1)),
-                    #x, y+1
-                    (x+1, min(y+2, 16))
-                ]
+import base64
+import functools
+import hashlib
+import json
 
+
+#bytes.translate tables between grids of 0/1 bytes and strings of '0'/'1' digits
+BITS = bytes([ord('0')] + [ord('1')] * 255)
+GRID = bytes.maketrans(b'01', b'\x00\x01')
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    def popcount(bits):
+        return bin(bits).count('1')
+
+
+class Grid(object):
+    #Tables of one board size, shared by every game of that size: the neighbours of
+    #each cell ((y-1)*width + (x-1)), the bitboard masks of the bots and the spawn
+    #positions for each player count
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.neighbours = []
+        for i in range(width * height):
+            x, y = i % width, i // width
+            self.neighbours.append(tuple(
+                ny * width + nx
+                for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1))
+                if 0 <= nx < width and 0 <= ny < height
+            ))
+        self.full = (1 << width * height) - 1
+        first = int(('0' * (width - 1) + '1') * height, 2)
+        #Shifting a bitboard by one moves along a row, these drop the tiles that wrapped around
+        self.not_first = self.full & ~first
+        self.not_last = self.full & ~(first << width - 1)
+        self.spawn_tables = {}
+
+    def spread(self, bits):
+        #Every tile next to a tile in bits
+        return ((bits << 1) & self.not_first) | ((bits >> 1) & self.not_last) \
+            | ((bits << self.width) & self.full) | (bits >> self.width)
+
+    def spawns(self, players):
+        #(x, y) of each player, evenly spaced clockwise around a ring set in
+        #from the edges so nobody starts next to a wall or another player
+        table = self.spawn_tables.get(players)
+        if table is None:
+            margin = min(self.width, self.height) // 6
+            left, top = 1 + margin, 1 + margin
+            right, bottom = self.width - margin, self.height - margin
+            ring = []
+            ring += [(x, top) for x in range(left, right)]
+            ring += [(right, y) for y in range(top, bottom)]
+            ring += [(x, bottom) for x in range(right, left, -1)]
+            ring += [(left, y) for y in range(bottom, top, -1)]
+            table = self.spawn_tables[players] = [ring[k * len(ring) // players] for k in range(players)]
+        return table
+
+    def spaced(self, players):
+        #Whether the ring has room for that many spawns with no two on the same or
+        #touching tiles, diagonals included
+        spawns = self.spawns(players)
+        return all(max(abs(x1 - x0), abs(y1 - y0)) >= 2
+            for i, (x0, y0) in enumerate(spawns) for x1, y1 in spawns[i + 1:])
+
+
+@functools.lru_cache(maxsize=64)
+def grid(width, height):
+    return Grid(width, height)
+
+
+#Maps are stored as "<width>x<height>:<base64 obstacle bitmap>", one bit per tile
+#in board order ((y-1)*width + (x-1)), and identified by the hash of that string
+def packMap(width, height, obstacles):
+    bits = int(bytes(obstacles)[::-1].translate(BITS), 2)
+    bitmap = bits.to_bytes((width * height + 7) // 8, 'little')
+    return '%dx%d:%s' % (width, height, base64.b64encode(bitmap).decode())
+
+def unpackMap(data):
+    if data.startswith('['):
+        #Legacy maps stored as a JSON list of tiles
+        tiles = json.loads(data)
+        width = max(int(t['x']) for t in tiles)
+        height = max(int(t['y']) for t in tiles)
+        obstacles = bytearray(width * height)
+        for t in tiles:
+            if t['occupied']:
+                obstacles[(int(t['y']) - 1) * width + int(t['x']) - 1] = 1
+        return width, height, obstacles
+    size, bitmap = data.split(':', 1)
+    width, height = (int(v) for v in size.split('x'))
+    bits = int.from_bytes(base64.b64decode(bitmap), 'little')
+    obstacles = bytearray(format(bits, '0%db' % (width * height))[::-1].encode().translate(GRID))
+    return width, height, obstacles
+
+@functools.lru_cache(maxsize=64)
+def loadMap(data):
+    #Read-only (width, height, obstacles) shared by every board of the map
+    width, height, obstacles = unpackMap(data)
+    return width, height, bytes(obstacles)
+
+def mapId(data):
+    return hashlib.sha1(data.encode()).hexdigest()
+
+def tileId(map_id, x, y):
+    return '%s-%d-%d' % (map_id, x, y)
+
+def expandTiles(map_id, data):
+    width, height, obstacles = unpackMap(data)
+    return [{
+        'id': tileId(map_id, x, y),
+        'x': x,
+        'y': y,
+        'occupied': bool(obstacles[(y - 1) * width + x - 1]),
+        'player': None
+    } for x in range(1, width + 1) for y in range(1, height + 1)]
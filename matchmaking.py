@@ -0,0 +1,151 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger('tron')
+
+
+class Matchmaker(object):
+    #Waiting players in one FIFO per (players, width, height). A background thread
+    #takes every full group it can, at most `batch` rooms at a time, and hands them
+    #to form(groups) in one call, which returns (room_id, game_id) per group. Then
+    #notify(ticket) tells each player. A player who waited `max_wait` seconds gets a
+    #room with whoever else is waiting, or with bots if they asked for them.
+    def __init__(self, form, notify, interval=0.1, max_wait=10.0, batch=1000, keep=60.0):
+        self.form = form
+        self.notify = notify
+        self.interval = interval
+        self.max_wait = max_wait
+        self.batch = batch
+        self.keep = keep
+        self.condition = threading.Condition()
+        self.queues = {}
+        #Tickets still waiting per key, cancelled ones stay in the queue until popped
+        self.waiting = collections.Counter()
+        #player_id -> ticket, matched tickets are kept `keep` seconds for status polls
+        self.tickets = {}
+        self.matched = collections.deque()
+        self.thread = None
+
+    def enqueue(self, player_id, key, vote=None, ready=True, bots=True):
+        with self.condition:
+            ticket = self.tickets.get(player_id)
+            if ticket is not None and ticket['state'] == 'waiting':
+                return ticket
+            ticket = self.tickets[player_id] = {
+                'player': player_id,
+                'key': key,
+                'state': 'waiting',
+                'queued': time.time(),
+                'vote': vote,
+                'ready': ready,
+                'bots': bots,
+                'room': None,
+                'game': None
+            }
+            self.queues.setdefault(key, collections.deque()).append(ticket)
+            self.waiting[key] += 1
+            if self.waiting[key] >= key[0]:
+                self.condition.notify()
+        self.start()
+        return ticket
+
+    def cancel(self, player_id):
+        with self.condition:
+            ticket = self.tickets.get(player_id)
+            if ticket is None or ticket['state'] != 'waiting':
+                return False
+            ticket['state'] = 'cancelled'
+            self.waiting[ticket['key']] -= 1
+            del self.tickets[player_id]
+            return True
+
+    def status(self, player_id):
+        ticket = self.tickets.get(player_id)
+        if ticket is None:
+            return None
+        status = {'state': ticket['state'], 'room': ticket['room'], 'game': ticket['game']}
+        if ticket['state'] == 'waiting':
+            status['waited'] = time.time() - ticket['queued']
+            status['waiting'] = self.waiting[ticket['key']]
+        return status
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='matchmaker', daemon=True)
+                self.thread.start()
+
+    def pop(self, key, count):
+        queue = self.queues[key]
+        group = []
+        while len(group) < count:
+            ticket = queue.popleft()
+            if ticket['state'] == 'waiting':
+                ticket['state'] = 'forming'
+                group.append(ticket)
+        self.waiting[key] -= len(group)
+        return group
+
+    def collect(self, now):
+        #(key, tickets) of the rooms to form now, oldest players first
+        groups = []
+        for key, queue in self.queues.items():
+            players = key[0]
+            while self.waiting[key] >= players and len(groups) < self.batch:
+                groups.append((key, self.pop(key, players)))
+            if not self.waiting[key] or len(groups) >= self.batch:
+                continue
+            while queue[0]['state'] != 'waiting':
+                queue.popleft()
+            oldest = queue[0]
+            if now - oldest['queued'] < self.max_wait:
+                continue
+            if self.waiting[key] >= 2 or oldest['bots']:
+                groups.append((key, self.pop(key, self.waiting[key])))
+        return groups
+
+    def requeue(self, groups):
+        #Tickets of rooms that could not be formed go back to the front of their queue
+        with self.condition:
+            for key, tickets in reversed(groups):
+                for ticket in reversed(tickets):
+                    ticket['state'] = 'waiting'
+                    self.queues[key].appendleft(ticket)
+                self.waiting[key] += len(tickets)
+
+    def run(self):
+        groups = []
+        while True:
+            with self.condition:
+                if len(groups) < self.batch:
+                    self.condition.wait(self.interval)
+                now = time.time()
+                groups = self.collect(now)
+                while self.matched and self.matched[0][0] < now - self.keep:
+                    _, ticket = self.matched.popleft()
+                    if self.tickets.get(ticket['player']) is ticket:
+                        del self.tickets[ticket['player']]
+            if not groups:
+                continue
+            try:
+                formed = self.form(groups)
+            except Exception:
+                logger.exception('matchmaking failed rooms=%d', len(groups))
+                self.requeue(groups)
+                time.sleep(self.interval)
+                continue
+            with self.condition:
+                for (_, tickets), (room_id, game_id) in zip(groups, formed):
+                    for ticket in tickets:
+                        ticket['state'] = 'matched'
+                        ticket['room'] = room_id
+                        ticket['game'] = game_id
+                        self.matched.append((now, ticket))
+            for _, tickets in groups:
+                for ticket in tickets:
+                    self.notify(ticket)
+            logger.info('matchmaking formed rooms=%d', len(groups))
@@ -0,0 +1,108 @@
+from singleton import Singleton
+import bisect
+import threading
+import time
+from collections import deque
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(metaclass=Singleton):
+    #Prometheus text exposition without the client library
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+        #Timestamps of recent steps for the steps per second gauge
+        self.steps = deque()
+        self.window = 10
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, labels=(), value=1):
+        with self.lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        with self.lock:
+            key = (name, labels)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def gauge(self, name, callback):
+        #callback is evaluated on every scrape
+        self.gauges[name] = callback
+
+    def step(self):
+        self.inc('tron_steps_total')
+        now = time.monotonic()
+        with self.lock:
+            self.steps.append(now)
+            self.trimSteps(now)
+
+    def trimSteps(self, now):
+        while self.steps and self.steps[0] < now - self.window:
+            self.steps.popleft()
+
+    def stepsPerSecond(self):
+        with self.lock:
+            self.trimSteps(time.monotonic())
+            return len(self.steps) / self.window
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(h.counts), h.sum, h.count, h.buckets) for key, h in histograms]
+        described = set()
+
+        def header(name):
+            if name in described or name not in self.help:
+                return
+            described.add(name)
+            kind, text = self.help[name]
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append('%s%s %s' % (name, formatLabels(labels), value))
+        for (name, labels), counts, total, count, buckets in histograms:
+            header(name)
+            cumulative = 0
+            for bound, n in zip(buckets + ('+Inf',), counts):
+                cumulative += n
+                lines.append('%s_bucket%s %d' % (name, formatLabels(labels + (('le', str(bound)),)), cumulative))
+            lines.append('%s_sum%s %s' % (name, formatLabels(labels), total))
+            lines.append('%s_count%s %d' % (name, formatLabels(labels), count))
+        for name, callback in sorted(self.gauges.items()):
+            header(name)
+            lines.append('%s %s' % (name, callback()))
+        return '\n'.join(lines) + '\n'
+
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
@@ -0,0 +1,115 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('tron')
+
+
+@event.listens_for(Engine, 'connect')
+def tuneSqlite(dbapi_connection, connection_record):
+    #WAL lets readers run while a group commit holds the write lock
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    #Only takes effect on a new database, the reaper then hands free pages back
+    cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=30000')
+    cursor.close()
+
+
+class Write(object):
+    def __init__(self, fn, after=None):
+        self.fn = fn
+        self.after = after
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitter(object):
+    #Lobby writes are functions of a session. Writes submitted by concurrent
+    #requests within `window` seconds run in one transaction with one commit,
+    #and every submitter waits for that commit. If the batch fails, its writes
+    #are retried one by one so one bad write does not fail the others.
+    #after(result) runs once the write is committed, in commit order, for state
+    #outside the database that must follow it exactly once.
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, fn, after=None):
+        if not self.app.config['GROUP_COMMIT']:
+            result = fn(self.db.session)
+            self.db.session.commit()
+            if after is not None:
+                after(result)
+            return result
+        self.start()
+        write = Write(fn, after)
+        self.queue.put(write)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        with self.app.app_context():
+            Session = sessionmaker(bind=self.db.engine, expire_on_commit=False)
+        window = self.app.config['GROUP_COMMIT_WINDOW']
+        limit = self.app.config['GROUP_COMMIT_MAX_BATCH']
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + window
+            while len(batch) < limit:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.commit(Session, batch)
+            for write in batch:
+                write.done.set()
+
+    def commit(self, Session, batch):
+        session = Session()
+        try:
+            for write in batch:
+                write.result = write.fn(session)
+            session.commit()
+            logger.debug('group commit writes=%d', len(batch))
+        except Exception as e:
+            session.rollback()
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                for write in batch:
+                    self.commit(Session, [write])
+            return
+        finally:
+            session.close()
+        for write in batch:
+            if write.after is not None:
+                try:
+                    write.after(write.result)
+                except Exception:
+                    logger.exception('group commit after-commit hook failed')
@@ -0,0 +1,178 @@
+import cProfile
+import collections
+import hmac
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+MODES = ('cprofile', 'sample')
+
+
+def frameName(code):
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+class Profiler(object):
+    #Opt-in request profiling as WSGI middleware. A `rate` share of requests, plus
+    #requests whose X-Profile header is `token`, run under cProfile or have their
+    #thread's stack sampled every `interval` seconds. Results add up per route.
+    #With rate 0 an unprofiled request costs one attribute test and one header lookup.
+    def __init__(self, rate=0.0, mode='cprofile', token=None, interval=0.005):
+        self.rate = rate
+        self.mode = mode
+        self.token = token
+        self.interval = interval
+        self.lock = threading.Lock()
+        #route -> {'requests', 'seconds', 'stats': pstats.Stats, 'samples': Counter of stacks}
+        self.routes = {}
+        #cProfile can only follow one request at a time
+        self.busy = threading.Lock()
+        #thread ident -> samples of the request it is serving
+        self.active = {}
+        self.wake = threading.Event()
+        self.thread = None
+
+    def wrap(self, wsgi_app, routeOf):
+        def middleware(environ, start_response):
+            if self.rate and random.random() < self.rate or \
+                    self.token is not None and self.authorized(environ.get('HTTP_X_PROFILE')):
+                return self.profile(wsgi_app, environ, start_response, routeOf(environ))
+            return wsgi_app(environ, start_response)
+        return middleware
+
+    def authorized(self, token):
+        #Constant time like api.isAdmin, as bytes since a header may not be ASCII
+        return token is not None and hmac.compare_digest(token.encode('latin-1'), self.token.encode())
+
+    def configure(self, rate=None, mode=None):
+        if rate is not None:
+            self.rate = min(max(float(rate), 0.0), 1.0)
+        if mode is not None:
+            if mode not in MODES:
+                raise ValueError('unknown profiling mode %s' % mode)
+            self.mode = mode
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+    def profile(self, wsgi_app, environ, start_response, route):
+        start = time.perf_counter()
+        if self.mode == 'sample':
+            samples = collections.Counter()
+            ident = threading.get_ident()
+            self.active[ident] = samples
+            self.startSampler()
+            self.wake.set()
+            try:
+                return wsgi_app(environ, start_response)
+            finally:
+                del self.active[ident]
+                self.record(route, time.perf_counter() - start, samples=samples)
+        if not self.busy.acquire(blocking=False):
+            return wsgi_app(environ, start_response)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                return wsgi_app(environ, start_response)
+            finally:
+                profile.disable()
+        finally:
+            self.busy.release()
+            self.record(route, time.perf_counter() - start, stats=pstats.Stats(profile))
+
+    def record(self, route, seconds, stats=None, samples=None):
+        with self.lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = self.routes[route] = {'requests': 0, 'seconds': 0.0, 'stats': None, 'samples': collections.Counter()}
+            entry['requests'] += 1
+            entry['seconds'] += seconds
+            if stats is not None:
+                if entry['stats'] is None:
+                    entry['stats'] = stats
+                else:
+                    entry['stats'].add(stats)
+            if samples:
+                entry['samples'].update(samples)
+
+    def startSampler(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.sample, name='profile-sampler', daemon=True)
+                self.thread.start()
+
+    def sample(self):
+        #Stacks are cut at Profiler.profile so they start at the WSGI app
+        top = Profiler.profile.__code__
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            while self.active:
+                frames = sys._current_frames()
+                for ident, samples in list(self.active.items()):
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None and frame.f_code is not top:
+                        stack.append(frameName(frame.f_code))
+                        frame = frame.f_back
+                    if stack:
+                        samples[';'.join(reversed(stack))] += 1
+                time.sleep(self.interval)
+
+    def report(self, route=None, limit=30):
+        #Per route: requests, seconds and the top functions by cumulative time, from
+        #cProfile when it ran for the route, otherwise from the sampled stacks
+        with self.lock:
+            routes = {r: e for r, e in self.routes.items() if route is None or r == route}
+            result = {}
+            for name, entry in routes.items():
+                result[name] = {
+                    'requests': entry['requests'],
+                    'seconds': entry['seconds'],
+                    'samples': sum(entry['samples'].values()),
+                    'top': self.topStats(entry['stats'], limit) if entry['stats'] is not None
+                        else self.topSamples(entry['samples'], limit)
+                }
+        return result
+
+    def topStats(self, stats, limit):
+        functions = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            functions.append({
+                'function': '%s:%d(%s)' % (os.path.basename(filename), line, name),
+                'calls': calls,
+                'tottime': tottime,
+                'cumtime': cumtime
+            })
+        functions.sort(key=lambda f: -f['cumtime'])
+        return functions[:limit]
+
+    def topSamples(self, samples, limit):
+        #Samples a function was on the stack (cumulative) and on top of it (self)
+        cumulative = collections.Counter()
+        own = collections.Counter()
+        for stack, count in samples.items():
+            frames = stack.split(';')
+            for name in set(frames):
+                cumulative[name] += count
+            own[frames[-1]] += count
+        return [{'function': name, 'samples': count, 'self': own[name]}
+                for name, count in cumulative.most_common(limit)]
+
+    def collapsed(self, route=None):
+        #"route;frame;frame count" lines, the input of flamegraph.pl and speedscope
+        with self.lock:
+            lines = []
+            for name, entry in sorted(self.routes.items()):
+                if route is not None and name != route:
+                    continue
+                for stack, count in sorted(entry['samples'].items()):
+                    lines.append('%s;%s %d' % (name, stack, count))
+        return '\n'.join(lines) + '\n' if lines else ''
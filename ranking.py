@@ -0,0 +1,108 @@
+import array
+import threading
+import time
+
+#Elo ratings of the players and the in-memory index that ranks them, the ratings
+#themselves live in the rating table, see api.RatingModel.
+
+
+def expected(rating, other):
+    #Expected score of a player rated `rating` against one rated `other`
+    return 1.0 / (1.0 + 10.0 ** ((other - rating) / 400.0))
+
+def rateGame(ratings, places, k):
+    #New ratings after one game. ratings and places are player_id -> value, a higher
+    #place outlasted a lower one and equal places are a draw (engine.standings).
+    #Every pair of players is a match and each player's k is shared among its
+    #opponents, so a game of four moves ratings as much as a game of two.
+    players = list(ratings)
+    if len(players) < 2:
+        return dict(ratings)
+    share = k / (len(players) - 1)
+    rated = {}
+    for player in players:
+        rating, place = ratings[player], places[player]
+        delta = 0.0
+        for other in players:
+            if other == player:
+                continue
+            score = 1.0 if place > places[other] else 0.5 if place == places[other] else 0.0
+            delta += score - expected(rating, ratings[other])
+        rated[player] = rating + share * delta
+    return rated
+
+
+class RankIndex(object):
+    #How many players have a rating in each `step` wide bucket of low..high, as a
+    #Fenwick tree with the best bucket first. The players rated above a bucket and
+    #the bucket holding the nth best player both take O(log buckets), the rating
+    #table is only read within one bucket. Ratings out of range count in the
+    #lowest or highest bucket. Callers hold `lock` around load and changes.
+    def __init__(self, low=0.0, high=4000.0, step=0.1):
+        self.low = low
+        self.step = step
+        self.size = int(round((high - low) / step))
+        self.lock = threading.Lock()
+        self.tree = array.array('q', bytes(8 * (self.size + 1)))
+        self.total = 0
+        #time.monotonic() of the last load, None before the first
+        self.loaded = None
+
+    def bucket(self, rating):
+        return min(max(int((rating - self.low) / self.step), 0), self.size - 1)
+
+    def load(self, counts):
+        #Replaces the index with (bucket, players) pairs, in linear time
+        tree = array.array('q', bytes(8 * (self.size + 1)))
+        total = 0
+        for bucket, count in counts:
+            tree[self.size - bucket] += count
+            total += count
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree, self.total, self.loaded = tree, total, time.monotonic()
+
+    def add(self, bucket, count=1):
+        i = self.size - bucket
+        self.total += count
+        tree = self.tree
+        while i <= self.size:
+            tree[i] += count
+            i += i & -i
+
+    def move(self, old, new):
+        #A player's rating went from bucket old to bucket new, None being unrated
+        if old == new:
+            return
+        if old is not None:
+            self.add(old, -1)
+        if new is not None:
+            self.add(new)
+
+    def above(self, bucket):
+        #Players in better buckets
+        i = self.size - bucket - 1
+        count = 0
+        tree = self.tree
+        while i > 0:
+            count += tree[i]
+            i -= i & -i
+        return count
+
+    def find(self, offset):
+        #(bucket, players in better buckets) of the bucket holding the player at
+        #offset, 0 being the best, or None past the last player
+        if not 0 <= offset < self.total:
+            return None
+        tree = self.tree
+        position = seen = 0
+        mask = 1 << self.size.bit_length()
+        while mask:
+            i = position + mask
+            if i <= self.size and seen + tree[i] <= offset:
+                position = i
+                seen += tree[i]
+            mask >>= 1
+        return self.size - position - 1, seen
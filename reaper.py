@@ -0,0 +1,69 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('tron')
+
+
+class Activity(object):
+    #Last time each player or room id was used, kept in memory so requests do not
+    #write. The reaper drains it into the activity table once per pass.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = {}
+
+    def touch(self, *ids):
+        now = time.time()
+        with self.lock:
+            for id in ids:
+                if id is not None:
+                    self.seen[id] = now
+
+    def drain(self):
+        with self.lock:
+            seen, self.seen = self.seen, {}
+        return seen
+
+    def pending(self, id):
+        #Used since the last drain, the table does not know it yet
+        return id in self.seen
+
+
+class Reaper(object):
+    #Calls sweep() every `interval` seconds from a background thread. sweep returns
+    #{kind: rows deleted}, every pass that deleted something is logged and added
+    #to the tron_reaped_total counter through reaped(kind, count).
+    def __init__(self, sweep, reaped, interval=60.0):
+        self.sweep = sweep
+        self.reaped = reaped
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None or not self.interval:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='reaper', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.once()
+
+    def once(self):
+        start = time.perf_counter()
+        try:
+            counts = self.sweep()
+        except Exception:
+            logger.exception('reaper pass failed')
+            return None
+        for kind, count in counts.items():
+            if count:
+                self.reaped(kind, count)
+        if any(counts.values()):
+            logger.info('reaped %s seconds=%.3f', ' '.join('%s=%d' % item for item in sorted(counts.items())),
+                time.perf_counter() - start)
+        return counts
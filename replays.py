@@ -0,0 +1,96 @@
+import json
+import struct
+from board import Board
+from gamelog import DIRECTIONS, OFFSETS
+
+#Format version and length of the JSON header that starts every replay
+HEADER = struct.Struct('<BI')
+FORMAT = 1
+#Player slot and hop count of a turn, the hops follow as 2-bit directions
+TURN = struct.Struct('<BH')
+#Slot flag of a crash without a path, which only real-time games have
+CRASHED = 0x80
+
+
+def startReplay(game):
+    #The header names the map and the spawns, every turn after it only carries
+    #directions since each path starts at its player's head
+    board = game['board']
+    header = json.dumps({
+        'game': game['id'],
+        'room': game['room'],
+        'map': board.map,
+        'width': board.width,
+        'height': board.height,
+        'mode': game.get('mode', 'turns'),
+        'players': [{'id': p['id'], 'name': p.get('name')} for p in game['players']],
+        'bots': game['bots'],
+        'spawns': game['spawns']
+    }, separators=(',', ':')).encode()
+    return bytearray(HEADER.pack(FORMAT, len(header)) + header)
+
+def recordTurn(replay, slot, xs, ys):
+    #The whole path as sent, the crash hop included, replaying it crashes the same way
+    hops = len(xs) - 1
+    packed = bytearray((hops + 3) // 4)
+    for i in range(hops):
+        packed[i // 4] |= DIRECTIONS[(xs[i + 1] - xs[i], ys[i + 1] - ys[i])] << (2 * (i % 4))
+    replay += TURN.pack(slot, hops) + packed
+
+def recordHop(replay, slot, dx, dy):
+    #recordTurn of a single hop, what every move of a real-time game is
+    replay += TURN.pack(slot, 1)
+    replay.append(DIRECTIONS[(dx, dy)])
+
+def recordCrash(replay, slot):
+    #A real-time player that ran into something on a tick, the hop it tried is not kept
+    replay += TURN.pack(slot | CRASHED, 0)
+
+def readReplay(data):
+    #(header, [(slot, xs, ys, crashed)]) with the tiles rebuilt from the spawns
+    version, length = HEADER.unpack_from(data)
+    if version != FORMAT:
+        raise ValueError('unknown replay format %d' % version)
+    header = json.loads(bytes(data[HEADER.size:HEADER.size + length]))
+    heads = {slot: tuple(spawn) for slot, spawn in enumerate(header['spawns'], 1)}
+    turns = []
+    offset = HEADER.size + length
+    while offset < len(data):
+        slot, hops = TURN.unpack_from(data, offset)
+        offset += TURN.size
+        crashed = bool(slot & CRASHED)
+        slot &= ~CRASHED
+        x, y = heads[slot]
+        xs, ys = [x], [y]
+        for i in range(hops):
+            dx, dy = OFFSETS[(data[offset + i // 4] >> (2 * (i % 4))) & 3]
+            xs.append(xs[-1] + dx)
+            ys.append(ys[-1] + dy)
+        offset += (hops + 3) // 4
+        heads[slot] = (xs[-1], ys[-1])
+        turns.append((slot, xs, ys, crashed))
+    return header, turns
+
+def playReplay(data, mapData):
+    #Header plus the packed map and every turn as the hops that were played and
+    #whether the player crashed. mapData(map_id) is the packed map of an id.
+    header, turns = readReplay(data)
+    header['data'] = mapData(header['map'])
+    board = Board.fromMap(header['map'], header['data'])
+    for player, (x, y) in zip(header['players'], header['spawns']):
+        board.place(player['id'], x, y)
+    moves = []
+    for slot, xs, ys, crashed in turns:
+        player_id = header['players'][slot - 1]['id']
+        end = 1 if crashed else board.firstCollision(xs, ys)
+        board.advance(player_id, xs, ys, end)
+        killed = crashed or end < len(xs)
+        if killed:
+            board.removePlayer(player_id)
+        moves.append({
+            'player': player_id,
+            'steps': [{'x': x, 'y': y} for x, y in zip(xs[:end], ys[:end])],
+            'killed': killed
+        })
+    header['moves'] = moves
+    return header
@@ -0,0 +1,129 @@
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger('tron')
+
+FULL, PROTECTED, STARTED = 1, 2, 4
+
+
+class RoomList(object):
+    #One build of the room list: rooms sorted by id, each already encoded as JSON
+    def __init__(self, rooms):
+        self.built = time.monotonic()
+        self.ids = [room_id for room_id, _, _ in rooms]
+        self.encoded = [encoded for _, encoded, _ in rooms]
+        self.flags = [flags for _, _, flags in rooms]
+        #excluded flags -> positions of the rooms that have none of them
+        self.views = {0: range(len(self.ids))}
+        self.lock = threading.Lock()
+
+    def patched(self, ids, rooms):
+        #A copy with the rooms of ids replaced by rooms, which only has those that
+        #still exist. The other rooms keep their encoding.
+        patched = RoomList(())
+        patched.built = self.built
+        patched.ids, patched.encoded, patched.flags = list(self.ids), list(self.encoded), list(self.flags)
+        for room_id in ids:
+            i = bisect.bisect_left(patched.ids, room_id)
+            if i < len(patched.ids) and patched.ids[i] == room_id:
+                del patched.ids[i], patched.encoded[i], patched.flags[i]
+        for room_id, encoded, flags in rooms:
+            i = bisect.bisect_left(patched.ids, room_id)
+            patched.ids.insert(i, room_id)
+            patched.encoded.insert(i, encoded)
+            patched.flags.insert(i, flags)
+        patched.views = {0: range(len(patched.ids))}
+        return patched
+
+    def view(self, exclude):
+        positions = self.views.get(exclude)
+        if positions is None:
+            with self.lock:
+                positions = self.views.get(exclude)
+                if positions is None:
+                    positions = [i for i, flags in enumerate(self.flags) if not flags & exclude]
+                    self.views[exclude] = positions
+        return positions
+
+    def page(self, exclude, cursor, limit):
+        #Rooms after cursor (a room id) without any of the excluded flags,
+        #returns the encoded rooms and the cursor of the next page or None
+        positions = self.view(exclude)
+        start = 0
+        if cursor:
+            #positions are in id order, so the first room after cursor can be bisected
+            start = bisect.bisect_left(positions, bisect.bisect_right(self.ids, cursor))
+        chosen = positions[start:start + limit]
+        next_cursor = None
+        if start + limit < len(positions):
+            next_cursor = self.ids[chosen[-1]]
+        return [self.encoded[i] for i in chosen], next_cursor
+
+
+class RoomListCache(object):
+    #Pre-serialized /rooms listing. Lobby writes call invalidate() with the rooms
+    #they changed and the next reader re-encodes only those. Writes of other worker
+    #processes are not seen here, so every ttl seconds (0: never) the whole list is
+    #loaded again in the background, as after reload(), and readers keep the
+    #previous list until it is done.
+    def __init__(self, load, ttl=1.0):
+        #load(ids) returns (room_id, encoded, flags) of the rooms of ids that still
+        #exist, or of every room when ids is None
+        self.load = load
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.building = threading.Lock()
+        self.current = None
+        self.dirty = set()
+        #Rooms invalidated while a full reload runs, None when none runs
+        self.touched = None
+
+    def invalidate(self, room_ids):
+        with self.lock:
+            self.dirty.update(room_ids)
+            if self.touched is not None:
+                self.touched.update(room_ids)
+
+    def reload(self):
+        with self.lock:
+            if self.touched is not None:
+                return
+            self.touched = set()
+        threading.Thread(target=self.reloadAll, name='room-list', daemon=True).start()
+
+    def reloadAll(self):
+        try:
+            rooms = RoomList(self.load(None))
+        except Exception:
+            logger.exception('room list reload failed')
+            rooms = None
+        with self.building:
+            with self.lock:
+                #The load may have read these before their writes, patch them again
+                self.dirty |= self.touched
+                self.touched = None
+            if rooms is not None:
+                self.current = rooms
+
+    def rooms(self):
+        if self.current is None:
+            with self.building:
+                if self.current is None:
+                    with self.lock:
+                        self.dirty.clear()
+                    self.current = RoomList(self.load(None))
+        if self.ttl and time.monotonic() - self.current.built >= self.ttl:
+            self.reload()
+        if self.dirty:
+            with self.building:
+                with self.lock:
+                    ids, self.dirty = self.dirty, set()
+                if ids:
+                    #A write that lands during the load marks its room again
+                    self.current = self.current.patched(ids, self.load(ids))
+        return self.current
+
+    def page(self, exclude=0, cursor=None, limit=50):
+        return self.rooms().page(exclude, cursor, limit)
@@ -0,0 +1,208 @@
+import collections
+import concurrent.futures
+import functools
+import importlib
+import multiprocessing
+import os
+import random
+import time
+import engine
+from bots import chooseMove, watchParent, HOPS
+from mapgen import generateMap, emptyMap
+from maps import mapId
+
+#Plays seeded games with the engine alone, spread over a process pool, for the
+#balance of maps and spawns and the throughput of the rules.
+#A policy is policy(game, player_id, rng) -> tiles [(x, y)] of the player's turn,
+#its head first. "module:function" names any other policy.
+
+STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+def head(game, player_id):
+    tile = game['history'][player_id][-1]
+    return tile['x'], tile['y']
+
+def randomMove(game, player_id, rng):
+    #Random directions that never turn back onto the path itself
+    path = [head(game, player_id)]
+    for _ in range(HOPS):
+        x, y = path[-1]
+        options = [(x + dx, y + dy) for dx, dy in STEPS if (x + dx, y + dy) not in path]
+        path.append(rng.choice(options))
+    return path
+
+def safeMove(game, player_id, rng):
+    #A random path over free tiles, or the longest there is and the crash after it
+    board = game['board']
+    best = []
+
+    def walk(path):
+        if len(path) > HOPS:
+            return path
+        x, y = path[-1]
+        steps = list(STEPS)
+        rng.shuffle(steps)
+        for dx, dy in steps:
+            tile = (x + dx, y + dy)
+            if tile not in path and board.isFree(*tile):
+                found = walk(path + [tile])
+                if found:
+                    return found
+        if len(path) > len(best):
+            best[:] = path
+        return None
+
+    path = walk([head(game, player_id)])
+    if path:
+        return path
+    x, y = best[-1]
+    return best + [(x + 1, y)]
+
+def botMove(game, player_id, rng, budget=0.005):
+    #The server's bot, its moves depend on how far the search gets in the budget
+    board = game['board']
+    obstacles, trails, heads = board.bitboards()
+    players = [p['id'] for p in game['players']]
+    start = players.index(player_id)
+    order = [board.slots[p] for p in players[start:] + players[:start]]
+    return chooseMove(board.width, board.height, obstacles, trails, heads, order, budget)
+
+POLICIES = {
+    'random': randomMove,
+    'safe': safeMove,
+    'bot': botMove
+}
+
+def policyOf(name):
+    if name in POLICIES:
+        return POLICIES[name]
+    if ':' not in name:
+        raise ValueError('unknown policy %s' % name)
+    module, function = name.split(':', 1)
+    return getattr(importlib.import_module(module), function)
+
+
+@functools.lru_cache(maxsize=256)
+def simulationMap(width, height, players, density, seed):
+    #(map_id, packed map, fairness) of a map seed, density 0 is the empty map
+    if not density:
+        generated = emptyMap(width, height, players)
+        data, fairness = generated['data'], generated['fairness']
+    else:
+        data, fairness = generateMap(width, height, players, density, seed)
+    return mapId(data), data, fairness
+
+def playGame(map_id, map_data, policies, seed, max_turns):
+    #(winner slot or None for a draw, turns, hops played) of one game, slot n
+    #spawns nth and plays policies[n - 1]
+    rng = random.Random(seed)
+    players = [{'id': 'p%d' % slot} for slot in range(1, len(policies) + 1)]
+    game = engine.newGame(str(seed), None, players, map_id, map_data, record=False)
+    slots = game['board'].slots
+    turns = hops = 0
+    while game['ended'] is None and turns < max_turns:
+        player_id = game['current_player']
+        tiles = policies[slots[player_id] - 1](game, player_id, rng)
+        if not engine.applyStep(game, player_id, [x for x, _ in tiles], [y for _, y in tiles]):
+            raise ValueError('policy %d played an invalid turn %s' % (slots[player_id], tiles))
+        turns += 1
+        hops += len(tiles) - 1
+    if game['ended'] is None or not game['players']:
+        return None, turns, hops
+    return slots[game['players'][0]['id']], turns, hops
+
+def playChunk(config, first, count):
+    #Totals of the games first..first+count-1, per map seed
+    policies = [policyOf(name) for name in config['policies']]
+    players = len(policies)
+    maps = {}
+    for n in range(first, first + count):
+        seed = config['seed'] * 1000003 + n
+        map_seed = config['maps'][n % len(config['maps'])]
+        map_id, data, fairness = simulationMap(config['width'], config['height'], players, config['density'], map_seed)
+        winner, turns, hops = playGame(map_id, data, policies, seed, config['max_turns'])
+        totals = maps.get(map_seed)
+        if totals is None:
+            totals = maps[map_seed] = {'map': map_id, 'fairness': fairness, 'games': 0, 'turns': 0, 'hops': 0,
+                'draws': 0, 'wins': [0] * players}
+        totals['games'] += 1
+        totals['turns'] += turns
+        totals['hops'] += hops
+        if winner is None:
+            totals['draws'] += 1
+        else:
+            totals['wins'][winner - 1] += 1
+    return maps
+
+def simulate(games, width=16, height=16, policies=('safe', 'safe'), density=0.2, maps=16,
+             max_turns=1000, workers=None, chunk=500, seed=1):
+    #Plays `games` games on `maps` seeded maps and sums them up per spawn slot and
+    #per map. workers=1 plays in this process, which is what throughput
+    #comparisons want; otherwise chunks of games go to a process pool.
+    for name in policies:
+        policyOf(name)
+    rng = random.Random(seed)
+    config = {
+        'width': width,
+        'height': height,
+        'policies': list(policies),
+        'density': density,
+        'maps': [rng.getrandbits(63) for _ in range(maps)],
+        'max_turns': max_turns,
+        'seed': seed
+    }
+    chunks = [(first, min(chunk, games - first)) for first in range(0, games, chunk)]
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        results = [playChunk(config, first, count) for first, count in chunks]
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context,
+                initializer=watchParent, initargs=(os.getpid(),)) as pool:
+            results = list(pool.map(playChunk, [config] * len(chunks), *zip(*chunks)))
+    duration = time.perf_counter() - start
+    return summarize(config, results, duration, workers)
+
+def summarize(config, results, duration, workers):
+    players = len(config['policies'])
+    per_map = collections.OrderedDict()
+    for map_seed in config['maps']:
+        totals = None
+        for result in results:
+            part = result.get(map_seed)
+            if part is None:
+                continue
+            if totals is None:
+                totals = dict(part, wins=list(part['wins']))
+                continue
+            for key in ('games', 'turns', 'hops', 'draws'):
+                totals[key] += part[key]
+            totals['wins'] = [a + b for a, b in zip(totals['wins'], part['wins'])]
+        if totals is not None:
+            totals['seed'] = map_seed
+            totals['win_share'] = shares(totals['wins'], totals['games'])
+            per_map[map_seed] = totals
+    games = sum(m['games'] for m in per_map.values())
+    wins = [sum(m['wins'][i] for m in per_map.values()) for i in range(players)]
+    turns = sum(m['turns'] for m in per_map.values())
+    hops = sum(m['hops'] for m in per_map.values())
+    return {
+        'games': games,
+        'draws': sum(m['draws'] for m in per_map.values()),
+        'wins': wins,
+        'win_share': shares(wins, games),
+        'turns': turns,
+        'mean_turns': turns / games if games else 0,
+        'hops': hops,
+        'duration_s': duration,
+        'workers': workers,
+        'games_per_s': games / duration if duration else 0,
+        'turns_per_s': turns / duration if duration else 0,
+        'maps': list(per_map.values())
+    }
+
+def shares(wins, games):
+    return [w / games if games else 0 for w in wins]
@@ -1,11 +1,11 @@
-from tile import Tile
+from src.tile import Tile
 import array as arr
 class Map(object):
-    def __init__(self):
+    def __init__(self, width=16, height=16):
         self.tiles = []
         #Tile initialization   
-        for i in range(16):
+        for i in range(width):
             x = []
-            for j in range(16):
+            for j in range(height):
                 x.append(Tile(i+1, j+1))
             self.tiles.append(x)
@@ -3,6 +3,6 @@ class Tile(object):
         self.x = x
         self.y = y
         self.occupied = False
-        self.player
+        self.player = None
 
     
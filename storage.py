@@ -0,0 +1,282 @@
+import pickle
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+class ConflictError(Exception):
+    pass
+
+
+class GameStore(object):
+    #Live games keyed by game id plus a player -> game index.
+    #update() is the only way to mutate a stored game: fn(game) runs atomically
+    #against the latest version, the player index and end time are then taken
+    #from game['players'] and game['ended'].
+    def add(self, game):
+        raise NotImplementedError
+
+    def get(self, game_id):
+        raise NotImplementedError
+
+    def findByPlayer(self, player_id):
+        raise NotImplementedError
+
+    def update(self, game_id, fn):
+        raise NotImplementedError
+
+    def read(self, game_id, fn):
+        #fn(game) against one consistent version of the game, without holding up
+        #update(). None if there is no such game.
+        game = self.get(game_id)
+        return None if game is None else fn(game)
+
+    def evict(self, deadline):
+        raise NotImplementedError
+
+    def activeCount(self):
+        raise NotImplementedError
+
+
+class MemoryGameStore(GameStore):
+    #One writer per game at a time through its lock, games do not wait for each
+    #other. Readers take no lock: a write makes the game's sequence number odd while
+    #it runs and even again after, and read() runs fn again if the number moved.
+    def __init__(self, read_attempts=4):
+        self.lock = threading.Lock()
+        self.games = {}
+        self.players = {}
+        self.locks = {}
+        self.sequences = {}
+        self.read_attempts = read_attempts
+        #(end time, game_id) in the order the games ended
+        self.finished = deque()
+
+    def add(self, game):
+        with self.lock:
+            self.games[game['id']] = game
+            self.locks[game['id']] = threading.Lock()
+            self.sequences[game['id']] = 0
+            for player in game['players']:
+                self.players[player['id']] = game
+            if game['ended'] is not None:
+                self.finished.append((game['ended'], game['id']))
+
+    def get(self, game_id):
+        return self.games.get(game_id)
+
+    def snapshot(self):
+        #game_id -> pickled game, each one consistent on its own
+        saved = {}
+        for game_id in list(self.games):
+            data = self.read(game_id, lambda game: pickle.dumps(game, pickle.HIGHEST_PROTOCOL))
+            if data is not None:
+                saved[game_id] = data
+        return saved
+
+    def findByPlayer(self, player_id):
+        return self.players.get(player_id)
+
+    def update(self, game_id, fn):
+        lock = self.locks.get(game_id)
+        if lock is None:
+            return None
+        with lock:
+            game = self.games.get(game_id)
+            if game is None:
+                return None
+            ended = game['ended']
+            before = [p['id'] for p in game['players']]
+            self.sequences[game_id] += 1
+            try:
+                result = fn(game)
+                self.reconcile(game, before, ended)
+            finally:
+                self.sequences[game_id] += 1
+        return result
+
+    def read(self, game_id, fn):
+        for _ in range(self.read_attempts):
+            sequence = self.sequences.get(game_id)
+            game = self.games.get(game_id)
+            if sequence is None or game is None:
+                return None
+            if sequence % 2:
+                #A write is running, let it finish
+                time.sleep(0)
+                continue
+            try:
+                result = fn(game)
+            except Exception:
+                #Reading a game while it changes can fail in any way, only a
+                #failure on a version that held still is real
+                if self.sequences.get(game_id) == sequence:
+                    raise
+                continue
+            if self.sequences.get(game_id) == sequence:
+                return result
+        #A busy game: wait for its writer once rather than retrying forever
+        lock = self.locks.get(game_id)
+        if lock is None:
+            return None
+        with lock:
+            game = self.games.get(game_id)
+            return None if game is None else fn(game)
+
+    def reconcile(self, game, before, ended):
+        if len(game['players']) == len(before) and (ended is not None or game['ended'] is None):
+            return
+        with self.lock:
+            left = set(before) - set(p['id'] for p in game['players'])
+            for player_id in left:
+                if self.players.get(player_id) is game:
+                    del self.players[player_id]
+            if ended is None and game['ended'] is not None:
+                self.finished.append((game['ended'], game['id']))
+
+    def evict(self, deadline):
+        with self.lock:
+            while self.finished and self.finished[0][0] <= deadline:
+                _, game_id = self.finished.popleft()
+                game = self.games.pop(game_id, None)
+                self.locks.pop(game_id, None)
+                self.sequences.pop(game_id, None)
+                if not game:
+                    continue
+                for player in game['players']:
+                    if self.players.get(player['id']) is game:
+                        del self.players[player['id']]
+
+    def activeCount(self):
+        return len(self.games) - len(self.finished)
+
+
+class SqliteGameStore(GameStore):
+    #Shared between worker processes through one SQLite file in WAL mode.
+    #Games are pickled, writes are compare-and-set on the rev column. A decoded game
+    #is not changed once it is cached, so reading one needs nothing more than get().
+    def __init__(self, path, retries=20):
+        self.path = path
+        self.retries = retries
+        self.local = threading.local()
+        #game_id -> (rev, game) of the last game this process decoded
+        self.cache = {}
+        connection = self.connection()
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS games (
+                id TEXT PRIMARY KEY,
+                rev INTEGER NOT NULL,
+                ended REAL,
+                data BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS games_ended ON games (ended);
+            CREATE TABLE IF NOT EXISTS game_players (
+                player TEXT PRIMARY KEY,
+                game TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS game_players_game ON game_players (game);
+        ''')
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def add(self, game):
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('INSERT INTO games (id, rev, ended, data) VALUES (?, 0, ?, ?)',
+                (game['id'], game['ended'], pickle.dumps(game, pickle.HIGHEST_PROTOCOL)))
+            connection.executemany('INSERT OR REPLACE INTO game_players (player, game) VALUES (?, ?)',
+                [(p['id'], game['id']) for p in game['players']])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get(self, game_id):
+        row = self.connection().execute('SELECT rev FROM games WHERE id = ?', (game_id,)).fetchone()
+        if row is None:
+            self.cache.pop(game_id, None)
+            return None
+        cached = self.cache.get(game_id)
+        if cached is not None and cached[0] == row[0]:
+            return cached[1]
+        return self.load(game_id)[1]
+
+    def load(self, game_id):
+        row = self.connection().execute('SELECT rev, data FROM games WHERE id = ?', (game_id,)).fetchone()
+        if row is None:
+            return None, None
+        game = pickle.loads(row[1])
+        self.cache[game_id] = (row[0], game)
+        return row[0], game
+
+    def findByPlayer(self, player_id):
+        row = self.connection().execute('SELECT game FROM game_players WHERE player = ?', (player_id,)).fetchone()
+        if row is None:
+            return None
+        return self.get(row[0])
+
+    def update(self, game_id, fn):
+        connection = self.connection()
+        for _ in range(self.retries):
+            row = connection.execute('SELECT rev, data FROM games WHERE id = ?', (game_id,)).fetchone()
+            if row is None:
+                return None
+            rev, game = row[0], pickle.loads(row[1])
+            result = fn(game)
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                changed = connection.execute('UPDATE games SET rev = ?, ended = ?, data = ? WHERE id = ? AND rev = ?',
+                    (rev + 1, game['ended'], pickle.dumps(game, pickle.HIGHEST_PROTOCOL), game_id, rev)).rowcount
+                if not changed:
+                    #Another worker got there first, retry on its version
+                    connection.execute('ROLLBACK')
+                    continue
+                players = [p['id'] for p in game['players']]
+                connection.execute('DELETE FROM game_players WHERE game = ? AND player NOT IN (%s)'
+                    % ','.join('?' * len(players)), [game_id] + players)
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            self.cache[game_id] = (rev + 1, game)
+            return result
+        raise ConflictError('Too many concurrent updates of game %s' % game_id)
+
+    def evict(self, deadline):
+        connection = self.connection()
+        expired = [row[0] for row in connection.execute(
+            'SELECT id FROM games WHERE ended IS NOT NULL AND ended <= ?', (deadline,))]
+        if not expired:
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for game_id in expired:
+                connection.execute('DELETE FROM game_players WHERE game = ?', (game_id,))
+                connection.execute('DELETE FROM games WHERE id = ?', (game_id,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        for game_id in expired:
+            self.cache.pop(game_id, None)
+
+    def activeCount(self):
+        return self.connection().execute('SELECT count(*) FROM games WHERE ended IS NULL').fetchone()[0]
+
+
+def createStore(url):
+    #"memory" or "sqlite:///path/to/games.db"
+    if url == 'memory':
+        return MemoryGameStore()
+    if url.startswith('sqlite:///'):
+        return SqliteGameStore(url[len('sqlite:///'):])
+    raise ValueError('Unknown game store %s' % url)
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+#api reads its settings on import, so they are set before any test imports it
+directory = tempfile.mkdtemp(prefix='tron-tests-')
+os.environ['TRON_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'database.db')
+os.environ['TRON_GAME_STORE'] = 'sqlite:///' + os.path.join(directory, 'games.db')
+os.environ['TRON_REAPER_INTERVAL'] = '0'
+os.environ['TRON_BOT_WORKERS'] = '1'
+os.environ['TRON_BOT_MOVE_BUDGET'] = '0.02'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
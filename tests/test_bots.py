@@ -0,0 +1,21 @@
+import time
+
+from api import app, db, control
+from mapgen import emptyMap
+from maps import mapId
+
+
+def test_bot_moves_after_a_human_step_on_the_sqlite_store():
+    with app.app_context():
+        db.create_all()
+    data = emptyMap(16, 16, 2)['data']
+    game = control.startGame('room', [{'id': 'human'}, {'id': 'bot'}], mapId(data), data, ['bot'])
+    head = game['history']['human'][-1]
+    x, y = next((head['x'] + dx, head['y'] + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+        if game['board'].isFree(head['x'] + dx, head['y'] + dy))
+    assert control.step({'player': {'id': 'human'}, 'steps': [head, {'x': x, 'y': y}]}) == 'bot'
+    deadline = time.monotonic() + 10
+    while control.findGame(game['id'])['current_player'] != 'human':
+        assert time.monotonic() < deadline, 'the bot never played its turn'
+        time.sleep(0.05)
+    assert control.findGame(game['id'])['version'] == 2
@@ -0,0 +1,21 @@
+from api import app, parseSettings
+from maps import grid
+
+
+def test_spawns_of_accepted_settings_are_apart():
+    with app.app_context():
+        for size in (8, 9, 12, 16):
+            for players in range(2, app.config['MAX_PLAYERS'] + 1):
+                settings = parseSettings({'width': size, 'height': size, 'players': players})
+                if settings is None:
+                    continue
+                spawns = grid(size, size).spawns(players)
+                for i, (x0, y0) in enumerate(spawns):
+                    for x1, y1 in spawns[i + 1:]:
+                        assert max(abs(x1 - x0), abs(y1 - y0)) >= 2
+
+
+def test_small_board_rejects_more_players_than_it_can_space():
+    with app.app_context():
+        assert parseSettings({'width': 8, 'height': 8, 'players': app.config['MAX_PLAYERS']}) is None
+        assert parseSettings({'width': 8, 'height': 8, 'players': 4}) is not None
@@ -0,0 +1,252 @@
+import array
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger('tron')
+
+#Directions of /game/direction and their steps
+DIRECTIONS = {'right': (1, 0), 'left': (-1, 0), 'down': (0, 1), 'up': (0, -1)}
+STEPS = tuple(DIRECTIONS.values())
+
+
+def heading(x, y, width, height):
+    #Players start towards the middle of the board, along the axis it is further on
+    dx, dy = (width + 1) / 2 - x, (height + 1) / 2 - y
+    if abs(dx) >= abs(dy):
+        return (1 if dx >= 0 else -1), 0
+    return 0, (1 if dy >= 0 else -1)
+
+def isFree(grid, width, height, x, y):
+    return 1 <= x <= width and 1 <= y <= height and not grid[(y - 1) * width + x - 1]
+
+
+class TickLoop(object):
+    #Real-time games all move `rate` times a second on one thread. Every player of
+    #every live game is a row of flat arrays (head, direction, wanted direction) and
+    #a game a run of rows plus one occupancy grid of walls and trails, so a tick is
+    #a single pass over the rows, with no timer or lock per game. /game/direction
+    #only writes a row's wanted direction, each tick takes the latest one.
+    #apply(game_id, moves, killed) gets what a tick did to a game: (player_id, x, y)
+    #of the players that moved and the ids of those that crashed.
+    def __init__(self, apply, rate=20.0):
+        self.apply = apply
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.xs = array.array('i')
+        self.ys = array.array('i')
+        self.dxs = array.array('b')
+        self.dys = array.array('b')
+        self.wxs = array.array('b')
+        self.wys = array.array('b')
+        self.alive = bytearray()
+        self.bots = bytearray()
+        #Cells of each row's trail as an array('I'), they are freed when the row crashes
+        self.trails = []
+        self.ids = []
+        #player_id -> row
+        self.rows = {}
+        #{'id', 'width', 'height', 'grid', 'first', 'last', 'live'} of each game,
+        #its rows are first..last-1
+        self.games = []
+        #Rows of ended games, dropped once they are half of all rows
+        self.dead = 0
+        #Ticks run, ticks that took longer than their period and the seconds of the last one
+        self.ticks = 0
+        self.overruns = 0
+        self.seconds = 0.0
+        #Seconds of the latest ticks
+        self.recent = collections.deque(maxlen=1000)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='ticks', daemon=True)
+                self.thread.start()
+
+    def add(self, game):
+        #Takes a new game over, before anything else can change it
+        board = game['board']
+        width, height = board.width, board.height
+        grid = bytearray(board.walls)
+        for i in board.cells:
+            grid[i] = 1
+        bots = set(game['bots'])
+        with self.lock:
+            first = len(self.ids)
+            for player in game['players']:
+                player_id = player['id']
+                head = game['history'][player_id][-1]
+                dx, dy = heading(head['x'], head['y'], width, height)
+                self.rows[player_id] = len(self.ids)
+                self.ids.append(player_id)
+                self.xs.append(head['x'])
+                self.ys.append(head['y'])
+                self.dxs.append(dx)
+                self.dys.append(dy)
+                self.wxs.append(dx)
+                self.wys.append(dy)
+                self.alive.append(1)
+                self.bots.append(player_id in bots)
+                self.trails.append(array.array('I', board.trails[player_id]))
+            self.games.append({
+                'id': game['id'],
+                'width': width,
+                'height': height,
+                'grid': grid,
+                'first': first,
+                'last': len(self.ids),
+                'live': len(self.ids) - first
+            })
+        self.start()
+        self.wake.set()
+
+    def steer(self, player_id, direction):
+        #False when the player is not in a live real-time game
+        dx, dy = DIRECTIONS[direction]
+        with self.lock:
+            row = self.rows.get(player_id)
+            if row is None or not self.alive[row]:
+                return False
+            self.wxs[row] = dx
+            self.wys[row] = dy
+        return True
+
+    def activeCount(self):
+        return sum(1 for game in self.games if game['live'])
+
+    def run(self):
+        period = 1.0 / self.rate
+        deadline = time.perf_counter()
+        while True:
+            if not self.games:
+                self.wake.wait()
+                self.wake.clear()
+                deadline = time.perf_counter()
+            start = time.perf_counter()
+            try:
+                changed = self.tick()
+            except Exception:
+                logger.exception('tick failed')
+                changed = []
+            for game_id, moves, killed in changed:
+                try:
+                    self.apply(game_id, moves, killed)
+                except Exception:
+                    logger.exception('tick of game %s failed', game_id)
+            self.ticks += 1
+            self.seconds = time.perf_counter() - start
+            self.recent.append(self.seconds)
+            deadline += period
+            now = time.perf_counter()
+            if now > deadline:
+                #Behind: the next tick starts now rather than several at once
+                self.overruns += 1
+                deadline = now
+            else:
+                time.sleep(deadline - now)
+
+    def tick(self):
+        #Moves every live row one cell, [(game_id, moves, killed)] of the games that changed
+        changed = []
+        with self.lock:
+            xs, ys, dxs, dys, wxs, wys = self.xs, self.ys, self.dxs, self.dys, self.wxs, self.wys
+            alive, bots, trails, ids = self.alive, self.bots, self.trails, self.ids
+            for game in self.games:
+                if not game['live']:
+                    continue
+                grid, width, height = game['grid'], game['width'], game['height']
+                #cell -> the row moving there, a cell two rows want is a head-on crash
+                targets = {}
+                clashes = set()
+                crashed = []
+                for row in range(game['first'], game['last']):
+                    if not alive[row]:
+                        continue
+                    dx, dy = wxs[row], wys[row]
+                    if dx == -dxs[row] and dy == -dys[row]:
+                        #Turning back onto the own trail is ignored
+                        dx, dy = wxs[row], wys[row] = dxs[row], dys[row]
+                    else:
+                        dxs[row], dys[row] = dx, dy
+                    x, y = xs[row] + dx, ys[row] + dy
+                    blocked = not (1 <= x <= width and 1 <= y <= height) or grid[(y - 1) * width + x - 1]
+                    if blocked and bots[row]:
+                        dx, dy = self.steerBot(row, grid, width, height)
+                        x, y = xs[row] + dx, ys[row] + dy
+                        blocked = not isFree(grid, width, height, x, y)
+                    if blocked:
+                        crashed.append(row)
+                        continue
+                    cell = (y - 1) * width + x - 1
+                    if cell in targets:
+                        clashes.add(cell)
+                        crashed.append(row)
+                    else:
+                        targets[cell] = row
+                for cell in clashes:
+                    crashed.append(targets.pop(cell))
+                moves = []
+                for cell, row in targets.items():
+                    grid[cell] = 1
+                    xs[row] = x = cell % width + 1
+                    ys[row] = y = cell // width + 1
+                    trails[row].append(cell)
+                    moves.append((ids[row], x, y))
+                for row in crashed:
+                    alive[row] = 0
+                    for cell in trails[row]:
+                        grid[cell] = 0
+                    del trails[row][:]
+                game['live'] -= len(crashed)
+                if game['live'] <= 1:
+                    #The last one standing has won and stops there
+                    for row in range(game['first'], game['last']):
+                        alive[row] = 0
+                    game['live'] = 0
+                    self.dead += game['last'] - game['first']
+                changed.append((game['id'], moves, [ids[row] for row in crashed]))
+            if self.dead * 2 > len(ids):
+                self.compact()
+        return changed
+
+    def steerBot(self, row, grid, width, height):
+        #Bots go straight on until the cell ahead is taken, then turn to the free
+        #neighbour with the most free cells around it. Returns the direction.
+        x, y = self.xs[row], self.ys[row]
+        dx, dy = self.dxs[row], self.dys[row]
+        best, room = (dx, dy), -1
+        for sx, sy in STEPS:
+            if sx == -dx and sy == -dy or not isFree(grid, width, height, x + sx, y + sy):
+                continue
+            free = sum(isFree(grid, width, height, x + sx + ax, y + sy + ay) for ax, ay in STEPS)
+            if free > room:
+                best, room = (sx, sy), free
+        self.dxs[row], self.dys[row] = self.wxs[row], self.wys[row] = best
+        return best
+
+    def compact(self):
+        #Drops the rows of ended games, under the lock
+        games = [game for game in self.games if game['live']]
+        rows = [row for game in games for row in range(game['first'], game['last'])]
+        for name in ('xs', 'ys', 'dxs', 'dys', 'wxs', 'wys'):
+            values = getattr(self, name)
+            setattr(self, name, array.array(values.typecode, [values[row] for row in rows]))
+        self.alive = bytearray(self.alive[row] for row in rows)
+        self.bots = bytearray(self.bots[row] for row in rows)
+        self.trails = [self.trails[row] for row in rows]
+        self.ids = [self.ids[row] for row in rows]
+        self.rows = {player_id: row for row, player_id in enumerate(self.ids)}
+        first = 0
+        for game in games:
+            shift = first - game['first']
+            game['first'] += shift
+            game['last'] += shift
+            first = game['last']
+        self.games = games
+        self.dead = 0
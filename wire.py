@@ -0,0 +1,76 @@
+import bisect
+import struct
+from board import wallBits
+from gamelog import DIRECTIONS
+
+#Media type of the compact /game/state, decoded by decodeGameState in client/js/data.js
+MIMETYPE = 'application/x-tron-state'
+FORMAT = 1
+#Flags: a delta since a version, a real-time game
+DELTA = 1
+REALTIME = 2
+#Format, flags, width, height, version, since, turn, index of the current player (255: none)
+HEADER = struct.Struct('<BBHHIIIB')
+#Slot, ready and the id and name that follow
+PLAYER = struct.Struct('<BB')
+#Slot, history index of the first tile, that tile and the hops after it as 2-bit directions
+SEGMENT = struct.Struct('<BHHHH')
+#Cell and the slot of the trail covering it (0: free), plus HEAD if it is the head
+CELL = struct.Struct('<HB')
+HEAD = 0x80
+
+
+def text(value):
+    data = ('' if value is None else str(value)).encode()
+    return struct.pack('<H', len(data)) + data
+
+def segment(slot, first, tiles):
+    hops = len(tiles) - 1
+    packed = bytearray((hops + 3) // 4)
+    for i in range(hops):
+        step = (tiles[i + 1]['x'] - tiles[i]['x'], tiles[i + 1]['y'] - tiles[i]['y'])
+        packed[i // 4] |= DIRECTIONS[step] << (2 * (i % 4))
+    return SEGMENT.pack(slot, first, tiles[0]['x'], tiles[0]['y'], hops) + packed
+
+def encodeState(game, since=None):
+    #The same state as the JSON /game/state, but the board is the wall bitmap
+    #(or the changed cells since a version) and each history a run of directions
+    board = game['board']
+    delta = since is not None
+    ids = [p['id'] for p in game['players']]
+    current = ids.index(game['current_player']) if game['current_player'] in ids else 255
+    out = [
+        HEADER.pack(FORMAT, (DELTA if delta else 0) | (REALTIME if game.get('mode') == 'realtime' else 0),
+            board.width, board.height,
+            game['version'], since or 0, game['turn'], current),
+        text(game['id']),
+        text(board.map),
+        bytes([len(ids)])
+    ]
+    for player in game['players']:
+        out.append(PLAYER.pack(board.slots.get(player['id'], 0), bool(player.get('ready'))))
+        out.append(text(player['id']))
+        out.append(text(player.get('name')))
+    #First history index each player has after since
+    firsts = {}
+    if delta:
+        start = bisect.bisect_left(game['history_log'], (since + 1,))
+        for _, player_id, index in game['history_log'][start:]:
+            if player_id in game['history'] and player_id not in firsts:
+                firsts[player_id] = index
+    else:
+        firsts = {player_id: 0 for player_id in game['history']}
+    out.append(bytes([len(firsts)]))
+    for player_id, first in firsts.items():
+        out.append(segment(board.slots[player_id], first, game['history'][player_id][first:]))
+    if delta:
+        cells = board.changedCells(since)
+        out.append(struct.pack('<I', len(cells)))
+        for i in cells:
+            slot = board.cells.get(i, 0)
+            if slot and board.trails[board.players[slot]][-1] == i:
+                slot |= HEAD
+            out.append(CELL.pack(i, slot))
+    else:
+        out.append(wallBits(board.walls).to_bytes((board.width * board.height + 7) // 8, 'little'))
+    return b''.join(out)